@@ -1,39 +1,83 @@
 # ALPR.py
 from __future__ import annotations
 
+import base64
+import binascii
 import json
 import time
-from datetime import datetime
 
-from backend import cpai, db, text_utils, state
-from backend.mqtt_wrap import start_mqtt, publish_message
+import sqlite3
+
+from backend import cluster, config, cpai, db, processing, sampler, state, tracing, tracker, video
+from backend.mqtt_wrap import start_mqtt
 from backend.logger import log
-from backend.config import TOPIC_PREFIX
+
+JPEG_MAGIC = b"\xff\xd8"
 
 
 # -----------------------
 # Обработка сообщения от MQTT (камеры / BlueIris)
 # -----------------------
 
-def on_mqtt_message(client, userdata, msg):
+def _point_from_topic(topic: str) -> str | None:
+    """
+    ALPR/<point>/snapshot -> <point>; общий топик ALPR/snapshot -> None.
+    """
+    prefix = config.TOPIC_PREFIX
+    rel = topic[len(prefix) + 1:] if topic.startswith(prefix + "/") else topic
+    parts = rel.split("/")
+    return parts[0] if len(parts) == 2 and parts[0] else None
+
+
+def _decode_b64_image(value: str) -> bytes | None:
+    # допускаем data URI: "data:image/jpeg;base64,...."
+    if value.startswith("data:"):
+        value = value.partition(",")[2]
     try:
-        payload = msg.payload.decode("utf-8", errors="ignore")
-    except Exception:
-        payload = ""
-    log(f"📥 MQTT {msg.topic} = {payload}", debug=True)
+        return base64.b64decode(value, validate=False)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def on_mqtt_message(client, userdata, msg):
+    """
+    Поддерживаемые форматы:
+      - бинарный JPEG в payload на топике точки (ALPR/<point>/snapshot);
+      - JSON {"point": ..., "image": "<base64>"};
+      - JSON {"point": ..., "snapshot": "path/to/file.jpg"} — старый формат, кадр читается с диска.
+    JPEG из payload передаётся дальше как memoryview, без временных файлов и копий.
+    """
+    payload = msg.payload or b""
+    topic_point = _point_from_topic(msg.topic)
+
+    if payload[:2] == JPEG_MAGIC:
+        log(f"📥 MQTT {msg.topic} = JPEG {len(payload)} байт", debug=True)
+        process_snapshot(topic_point or "unknown", image=memoryview(payload))
+        return
 
-    # Ожидаем JSON вида {"point": "Vorota", "snapshot": "path/to/file.jpg"}
+    log(f"📥 MQTT {msg.topic} = {payload[:512].decode('utf-8', errors='ignore')}", debug=True)
     try:
         data = json.loads(payload)
     except Exception:
         log("⚠️ Некорректный JSON в MQTT-сообщении", debug=True)
         return
+    if not isinstance(data, dict):
+        log("⚠️ Некорректный JSON в MQTT-сообщении", debug=True)
+        return
 
-    point = data.get("point") or "unknown"
-    snapshot_path = data.get("snapshot")
+    point = data.get("point") or topic_point or "unknown"
+
+    if data.get("image"):
+        image = _decode_b64_image(str(data["image"]))
+        if not image:
+            log(f"⚠️ Некорректный base64 в сообщении от {point}")
+            return
+        process_snapshot(point, image=memoryview(image))
+        return
 
+    snapshot_path = data.get("snapshot")
     if not snapshot_path:
-        log(f"⚠️ Нет snapshot в сообщении от {point}")
+        log(f"⚠️ Нет snapshot/image в сообщении от {point}")
         return
 
     # Запускаем обработку
@@ -44,15 +88,34 @@ def on_mqtt_message(client, userdata, msg):
 # Основная логика обработки кадра
 # -----------------------
 
-def process_snapshot(point: str, snapshot_path: str):
+def process_snapshot(point: str, snapshot_path: str | None = None, image: bytes | memoryview | None = None):
     """
-    Обработка нового кадра от камеры.
+    Обработка нового кадра от камеры: файл snapshot_path или JPEG в памяти (image).
+    Кадр получает трассу (tracing) — её ID уходит в MQTT и событие номера.
+    В кластере кадр точки другого узла пропускается (его обработает владелец).
     """
-    log(f"🖼️ Получен кадр от {point}: {snapshot_path}")
+    if not cluster.owns(point):
+        log(f"🧭 Кадр {point} пропущен: точка арендована другим узлом", debug=True)
+        return
+    capture_ts = time.time()
+    with tracing.trace(point, capture_ts):
+        _process_snapshot(point, snapshot_path, image, capture_ts)
+
+
+def _process_snapshot(point: str, snapshot_path: str | None, image: bytes | memoryview | None, capture_ts: float):
+    # на точке только уже распознанные машины — CPAI не нужен (tracker.should_sample)
+    if not tracker.should_sample(point):
+        log(f"⏩ Кадр {point} пропущен: машина уже распознана", debug=True)
+        return
+
+    if image is not None:
+        log(f"🖼️ Получен кадр от {point}: {len(image)} байт")
+    else:
+        log(f"🖼️ Получен кадр от {point}: {snapshot_path}")
 
     # Отправляем в CPAI
     try:
-        results = cpai.send_to_cpai(snapshot_path)
+        results = cpai.detect_plates(image if image is not None else snapshot_path)
     except Exception as e:
         log(f"❌ Ошибка CPAI: {e}")
         state.set_cpai_connected(False)
@@ -64,56 +127,48 @@ def process_snapshot(point: str, snapshot_path: str):
         log(f"ℹ️ CPAI: номера не распознаны для {point}")
         return
 
-    for plate_raw in results:
-        plate = text_utils.normalize_text(plate_raw)
-        base, region = text_utils.parse_plate_parts(plate)
-
-        # Если база определена, но региона нет — ищем достройку в people.db
-        if base and not region:
-            full_plate = db.get_plate_from_db(base)
-            if full_plate:
-                log(f"✅ Достроен номер: {plate} → {full_plate}")
-                plate = full_plate
-
-        if not plate:
-            log(f"⚠️ Номер не прошёл валидацию: {plate_raw}")
-            continue
-
-        # Проверка повторов
-        if state.is_plate_recent(point, plate):
-            log(f"⏩ Пропуск повторного номера {plate} ({point})")
-            continue
-
-        # Сохраняем в историю
-        ts = int(time.time())
-        db.add_history_record(plate, point, ts)
+    for det in results:
+        # общий конвейер: нормализация, наблюдение, трекер, ворота, история, публикация
+        processing.handle_recognized_plate(point, det["plate"], capture_ts=capture_ts, confidence=det.get("confidence"),
+                                           bbox=det.get("bbox"), image=image if image is not None else snapshot_path)
 
-        # MQTT публикация
-        publish_plate(point, plate, ts)
 
+# -----------------------
+# Запуск
+# -----------------------
 
-def publish_plate(point: str, plate: str, ts: int):
+def _sync_cameras(owned: set[str] | None = None) -> None:
     """
-    Публикует результат распознавания в MQTT.
+    RTSP-камеры точек из points; owned — только эти точки (кластер).
     """
-    last_seen = db.get_last_seen(plate)
-    data = {
-        "plate": plate,
-        "point": point,
-        "ts": ts,
-        "last_seen": last_seen,
-        "iso_time": datetime.fromtimestamp(ts).isoformat(),
-    }
-    payload = json.dumps(data, ensure_ascii=False)
-    publish_message("plates", payload)
-    log(f"📤 Опубликован номер: {plate} ({point})")
-
+    desired = {}
+    with sqlite3.connect(config.DB_BASE_PATH) as conn:
+        for name, rtp_url, in_cam, out_cam in conn.execute(
+            "SELECT name, rtp_url, in_camera_url, out_camera_url FROM points"
+        ):
+            if owned is None or name in owned:
+                desired[(name, "in")] = in_cam or rtp_url
+                desired[(name, "out")] = out_cam
+    report = video.cameras.sync(desired)
+    if any(report.values()):
+        log(f"🎥 Камеры: запущено {report['started']}, перезапущено {report['restarted']}, остановлено {report['stopped']}")
+
+
+def _on_points_changed(owned: set[str], acquired: set[str], lost: set[str]) -> None:
+    """
+    Кластер: RTSP-камеры только для своих точек — чужие читает их владелец.
+    """
+    _sync_cameras(owned)
 
-# -----------------------
-# Запуск
-# -----------------------
 
 def start():
     log("🚀 ALPR модуль запущен")
     db.init_db()
+    # кадры RTSP-камер → CPAI → общий конвейер (backend/sampler.py)
+    sampler.start()
+    if cluster.enabled():
+        cluster.subscribe(_on_points_changed)
+        cluster.start()
+    else:
+        _sync_cameras()
     start_mqtt(on_message_cb=on_mqtt_message)
@@ -1,21 +1,27 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_file, send_from_directory, stream_with_context
 from flask_cors import CORS
 import os
+import io
+import csv
+import itertools
 import json
 import threading
 import sqlite3
 import time
-import cv2
 import re
 import subprocess
 from urllib.parse import urlparse
 
 # импортируем ALPR чтобы иметь доступ к его статусам (MQTT/CPAI)
 import ALPR
+from backend import db as alpr_db
+from backend import access, cluster, config, events, evidence, metrics, sampler, state, tracing, tracker, video, watchlist
+from backend.mqtt_wrap import mqtt_stats
+from backend.logger import log, tail as log_tail, wait_for_lines as log_wait
+from backend.text_utils import normalize_text
 
 BASE_DIR = os.path.dirname(__file__)
 SETTINGS_FILE = os.path.join(BASE_DIR, "settings.json")
-LOG_FILE = os.path.join(BASE_DIR, "alpr.log")
 
 # -----------------------
 # Настройки
@@ -102,22 +108,115 @@ CORS(app)
 # -----------------------
 # API: Статус
 # -----------------------
+def _status_payload():
+    st = state.status_snapshot()
+    return {
+        "mqtt": "OK" if st["mqtt"] else "Нет соединения",
+        "cpai": "OK" if st["cpai"] else "Нет соединения",
+    }
+
 @app.route("/api/status")
 def get_status():
-    mqtt_status = "OK" if getattr(ALPR, "MQTT_CONNECTED", False) else "Нет соединения"
-    cpai_status = "OK" if getattr(ALPR, "CPAI_CONNECTED", False) else "Нет соединения"
-    return jsonify({"mqtt": mqtt_status, "cpai": cpai_status})
+    return jsonify({**_status_payload(), "mqtt_ingest": mqtt_stats()})
+
+@app.route("/metrics")
+def get_metrics():
+    """
+    Метрики в текстовом формате Prometheus: латентности стадий, FPS камер, очереди.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# -----------------------
+# API: Поток событий (SSE) — статус, номера, ворота, лог
+# -----------------------
+def _sse_data(text):
+    # каждая строка — своё поле data: (перевод строки внутри текста иначе обрывает кадр SSE)
+    return "\n".join(f"data: {line}" for line in str(text).split("\n"))
+
+@app.route("/api/events")
+def stream_events():
+    """
+    ?topics=status,plate,gate,log — какие события слать (по умолчанию все).
+    При каждом подключении (и после обрыва тоже: браузер уже показал «Нет
+    соединения») сразу отдаются текущий статус и состояние ворот, дальше —
+    только изменения. После обрыва браузер присылает Last-Event-ID и
+    получает пропущенные события из кольца шины.
+    """
+    topics = {t for t in (request.args.get("topics") or "").split(",") if t} or None
+    last_id = request.headers.get("Last-Event-ID", type=int)
+
+    def _sse(seq, etype, payload):
+        return f"id: {seq}\nevent: {etype}\n{_sse_data(payload)}\n\n"
+
+    def _gen():
+        cur = last_id if last_id is not None else events.cursor()
+        if last_id is None:
+            yield "retry: 3000\n\n"
+        if topics is None or "status" in topics:
+            yield _sse(cur, "status", json.dumps(state.status_snapshot()))
+        if topics is None or "gate" in topics:
+            for point, st in state.get_all_gates().items():
+                yield _sse(cur, "gate", json.dumps({"point": point, **st}, ensure_ascii=False))
+        while True:
+            if not events.wait(cur, timeout=15.0):
+                yield ": keepalive\n\n"
+                continue
+            r = events.since(cur, topics)
+            if r["reset"]:
+                yield _sse(r["cursor"], "reset", "{}")
+            for seq, etype, payload in r["events"]:
+                yield _sse(seq, etype, payload)
+            cur = r["cursor"]
+
+    return Response(stream_with_context(_gen()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # -----------------------
 # API: Лог
 # -----------------------
 @app.route("/api/log")
 def get_log():
-    if not os.path.exists(LOG_FILE):
-        return jsonify({"log": []})
-    with open(LOG_FILE, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-    return jsonify({"log": [line.strip() for line in lines]})
+    """
+    Хвост лога из кольцевого буфера логгера: ?cursor=N — только строки новее N,
+    без курсора — последние limit строк. Файл alpr.log не читается.
+    """
+    cursor = request.args.get("cursor", type=int)
+    limit = max(1, min(5000, request.args.get("limit", 500, type=int)))
+    r = log_tail(cursor, limit)
+    return jsonify({"log": r["lines"], "cursor": r["cursor"], "reset": r["reset"]})
+
+@app.route("/api/log/stream")
+def stream_log():
+    """
+    Server-Sent Events: каждая новая строка — событие с id = курсор.
+    После переподключения браузер сам присылает Last-Event-ID.
+    """
+    cursor = request.headers.get("Last-Event-ID", type=int)
+    if cursor is None:
+        cursor = request.args.get("cursor", type=int)
+
+    def _gen():
+        c = cursor
+        if c is None:
+            r = log_tail(None, 500)
+            c = r["cursor"]
+            for line in r["lines"]:
+                yield f"{_sse_data(line)}\n\n"
+            yield f"id: {c}\n\n"
+        while True:
+            if not log_wait(c, timeout=15.0):
+                yield ": keepalive\n\n"
+                continue
+            r = log_tail(c, 500)
+            if r["reset"]:
+                yield "event: reset\ndata: \n\n"
+            for line in r["lines"]:
+                yield f"{_sse_data(line)}\n\n"
+            c = r["cursor"]
+            yield f"id: {c}\n\n"
+
+    return Response(stream_with_context(_gen()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # -----------------------
 # Статика
@@ -141,13 +240,15 @@ def api_get_settings():
 def api_set_settings():
     """
     Обновляем settings.json. Дополнительно:
-    - live-обновление ALPR.DEBUG_MODE;
+    - config.reload(): новая версия настроек, подписчики пересобирают только
+      затронутое (логгер — debug, клиент CPAI — адрес, MQTT — брокер/подписки);
     - пересчитываем пути и создаём таблицы в (возможно новой) базе.
+    В ответе — изменившиеся ключи и те, что вступят в силу после перезапуска.
     """
     data = request.json or {}
     s = load_settings()
 
-    # merge на верхнем уровне и внутри "paths" и "cpai"
+    # merge на верхнем уровне и внутри "paths", "cpai" и "mqtt"
     if "paths" in data and isinstance(data["paths"], dict):
         s_paths = s.get("paths", {})
         s_paths.update(data["paths"])
@@ -158,24 +259,27 @@ def api_set_settings():
         s_cpai.update(data["cpai"])
         s["cpai"] = s_cpai
 
+    if "mqtt" in data and isinstance(data["mqtt"], dict):
+        s_mqtt = s.get("mqtt", {})
+        s_mqtt.update(data["mqtt"])
+        s["mqtt"] = s_mqtt
+
     for k, v in data.items():
-        if k not in ("paths", "cpai"):
+        if k not in ("paths", "cpai", "mqtt"):
             s[k] = v
 
     # миграция/дефолты для cpai
     s = _migrate_cpai(s)
     save_settings(s)
-
-    # live-обновление флага дебага внутри ALPR
-    try:
-        ALPR.DEBUG_MODE = bool(s.get("debug", False))
-    except Exception:
-        pass
+    applied = config.reload()
 
     refresh_paths_from_settings()
     ensure_tables()
+    access.engine.set_db_path(BASE_DB)
+    watchlist.engine.set_db_path(BASE_DB)
+    _sync_cameras()
 
-    return jsonify({"status": "ok"})
+    return jsonify({"status": "ok", **applied})
 
 # -----------------------
 # Инициализация БД (люди + точки)
@@ -214,11 +318,20 @@ def ensure_tables():
                 mqtt_topic TEXT,
                 rtp_url TEXT,
                 in_camera_url TEXT,
-                out_camera_url TEXT
+                out_camera_url TEXT,
+                direction_line TEXT
             )
             """
         )
 
+        conn.execute(access.ACCESS_RULES_SCHEMA)
+        conn.execute(watchlist.WATCHLIST_SCHEMA)
+
+        # миграция: линия направления (x1,y1,x2,y2) — IN/OUT по одной камере (backend/tracker.py)
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(points)")}
+        if "direction_line" not in cols:
+            conn.execute("ALTER TABLE points ADD COLUMN direction_line TEXT")
+
         # миграция совместимости: перенесём rtp_url -> in_camera_url при необходимости
         cur = conn.cursor()
         cur.execute("SELECT id, rtp_url, in_camera_url FROM points")
@@ -264,6 +377,7 @@ def get_people():
 @app.route("/api/people", methods=["POST"])
 def add_person():
     data = request.json
+    data["car_number"] = normalize_text(data.get("car_number") or "") or data.get("car_number")
     with sqlite3.connect(PEOPLE_DB) as conn:
         conn.execute(
             """
@@ -281,6 +395,7 @@ def add_person():
             ),
         )
         conn.commit()
+    access.reload()
     return jsonify({"status": "ok"})
 
 @app.route("/api/people/<int:id>", methods=["DELETE"])
@@ -288,20 +403,374 @@ def delete_person(id):
     with sqlite3.connect(PEOPLE_DB) as conn:
         conn.execute("DELETE FROM people WHERE id=?", (id,))
         conn.commit()
+    access.reload()
+    return jsonify({"status": "ok"})
+
+# -----------------------
+# API: People — массовый импорт / экспорт
+# -----------------------
+PEOPLE_FIELDS = ("name", "car_number", "car_model", "phone", "address")
+PEOPLE_IMPORT_BATCH = 5000
+
+# Допустимые заголовки столбцов в файлах управляющих компаний
+_PEOPLE_HEADER_ALIASES = {
+    "name": "name", "fio": "name", "фио": "name", "владелец": "name",
+    "car_number": "car_number", "plate": "car_number", "номер": "car_number", "госномер": "car_number", "номер авто": "car_number",
+    "car_model": "car_model", "brand": "car_model", "марка": "car_model", "марка авто": "car_model",
+    "phone": "phone", "телефон": "phone",
+    "address": "address", "адрес": "address", "квартира": "address",
+}
+
+def _map_people_header(header):
+    return [_PEOPLE_HEADER_ALIASES.get((h or "").strip().lower()) for h in header]
+
+def _iter_csv_rows(stream):
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    first = text.readline()
+    # разделитель определяем по заголовку: УК присылают и ",", и ";"
+    delim = max(",;\t", key=first.count)
+    yield from csv.reader(itertools.chain([first], text), delimiter=delim)
+
+def _iter_xlsx_rows(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("для импорта XLSX нужен пакет openpyxl")
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            yield ["" if v is None else str(v) for v in row]
+    finally:
+        wb.close()
+
+def _iter_people_records(rows, report):
+    """
+    Превращает строки файла в кортежи для executemany, нормализуя номер.
+    Заполняет report: пустые/некорректные строки и дубли внутри файла.
+    """
+    header = None
+    seen = set()
+    for line_no, row in enumerate(rows, start=1):
+        if header is None:
+            header = _map_people_header(row)
+            if "car_number" not in header:
+                raise ValueError("в файле нет столбца с номером авто (car_number / номер)")
+            continue
+        if not any((c or "").strip() for c in row):
+            continue
+        rec = dict.fromkeys(PEOPLE_FIELDS)
+        for key, val in zip(header, row):
+            if key:
+                rec[key] = (val or "").strip() or None
+        plate = normalize_text(rec["car_number"] or "")
+        if not plate:
+            report["invalid"].append(line_no)
+            continue
+        if plate in seen:
+            report["duplicates_in_file"].append(plate)
+            continue
+        seen.add(plate)
+        rec["car_number"] = plate
+        yield tuple(rec[f] for f in PEOPLE_FIELDS)
+
+def _normalize_stored_people(conn) -> set:
+    """
+    Приводит сохранённые car_number к нормализованному виду (как у импортируемых),
+    иначе ON CONFLICT(car_number) не узнаёт старые записи и создаёт дубли.
+    Если нормализованный номер уже занят другой строкой — старая не трогается.
+    Возвращает множество нормализованных номеров в базе.
+    """
+    rows = conn.execute("SELECT id, car_number FROM people WHERE car_number IS NOT NULL").fetchall()
+    stored = {raw for _, raw in rows}
+    existing = set()
+    for pid, raw in rows:
+        plate = normalize_text(raw)
+        if not plate:
+            continue
+        if plate != raw and plate not in stored:
+            conn.execute("UPDATE people SET car_number=? WHERE id=?", (plate, pid))
+            stored.add(plate)
+        existing.add(plate)
+    return existing
+
+@app.route("/api/people/import", methods=["POST"])
+def import_people():
+    """
+    Потоковый импорт жильцов из CSV/XLSX (multipart, поле file).
+    Номера нормализуются, повторы внутри файла пропускаются (первая строка выигрывает),
+    существующие номера обновляются. Всё пишется одной транзакцией пачками executemany.
+    """
+    f = request.files.get("file")
+    if not f:
+        return jsonify({"status": "error", "error": "file is required"}), 400
+    fname = (f.filename or "").lower()
+    report = {"inserted": 0, "updated": 0, "invalid": [], "duplicates_in_file": []}
+    t0 = time.time()
+    try:
+        rows = _iter_xlsx_rows(f.stream) if fname.endswith((".xlsx", ".xlsm")) else _iter_csv_rows(f.stream)
+        with sqlite3.connect(PEOPLE_DB) as conn:
+            existing = _normalize_stored_people(conn)
+            batch = []
+
+            def _flush():
+                conn.executemany(
+                    """
+                    INSERT INTO people (name, car_number, car_model, phone, address)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(car_number) DO UPDATE SET
+                      name=COALESCE(excluded.name, name),
+                      car_model=COALESCE(excluded.car_model, car_model),
+                      phone=COALESCE(excluded.phone, phone),
+                      address=COALESCE(excluded.address, address)
+                    """,
+                    batch,
+                )
+                batch.clear()
+
+            for rec in _iter_people_records(rows, report):
+                if rec[1] in existing:
+                    report["updated"] += 1
+                else:
+                    report["inserted"] += 1
+                batch.append(rec)
+                if len(batch) >= PEOPLE_IMPORT_BATCH:
+                    _flush()
+            if batch:
+                _flush()
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    except Exception as e:
+        log(f"⚠️ Ошибка импорта людей: {e}")
+        return jsonify({"status": "error", "error": str(e)}), 500
+
+    access.reload()
+    report["elapsed_s"] = round(time.time() - t0, 3)
+    log(
+        f"👥 Импорт людей: +{report['inserted']} / обновлено {report['updated']} / "
+        f"дублей {len(report['duplicates_in_file'])} / ошибок {len(report['invalid'])}"
+    )
+    return jsonify({"status": "ok", **report})
+
+@app.route("/api/people/export", methods=["GET"])
+def export_people():
+    """
+    Потоковый экспорт: ?format=csv (по умолчанию) или ndjson.
+    """
+    fmt = (request.args.get("format") or "csv").lower()
+    cols = ("id",) + PEOPLE_FIELDS
+
+    def _rows():
+        with sqlite3.connect(PEOPLE_DB) as conn:
+            cur = conn.execute(f"SELECT {', '.join(cols)} FROM people ORDER BY id")
+            while True:
+                chunk = cur.fetchmany(1000)
+                if not chunk:
+                    break
+                yield from chunk
+
+    if fmt == "ndjson":
+        def _gen():
+            for r in _rows():
+                yield json.dumps(dict(zip(cols, r)), ensure_ascii=False) + "\n"
+        return Response(stream_with_context(_gen()), mimetype="application/x-ndjson",
+                        headers={"Content-Disposition": "attachment; filename=people.ndjson"})
+
+    def _gen_csv():
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        yield "\ufeff"  # BOM, чтобы Excel открыл UTF-8 корректно
+        w.writerow(cols)
+        for r in _rows():
+            w.writerow(r)
+            if buf.tell() > 64 * 1024:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+    return Response(stream_with_context(_gen_csv()), mimetype="text/csv; charset=utf-8",
+                    headers={"Content-Disposition": "attachment; filename=people.csv"})
+
+# -----------------------
+# API: Доступ (allowlist, правила по точкам и времени)
+# -----------------------
+ACCESS_RULE_FIELDS = ("car_number", "point", "days", "time_from", "time_to")
+
+@app.route("/api/access/rules", methods=["GET"])
+def get_access_rules():
+    with sqlite3.connect(BASE_DB) as conn:
+        rows = conn.execute(
+            f"SELECT id, {', '.join(ACCESS_RULE_FIELDS)} FROM access_rules ORDER BY car_number, id"
+        ).fetchall()
+    return jsonify({"rules": [dict(zip(("id",) + ACCESS_RULE_FIELDS, r)) for r in rows]})
+
+@app.route("/api/access/rules", methods=["POST"])
+def add_access_rule():
+    data = request.json or {}
+    plate = normalize_text(data.get("car_number") or "")
+    if not plate:
+        return jsonify({"status": "error", "error": "car_number is required"}), 400
+    with sqlite3.connect(BASE_DB) as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO access_rules
+            (id, car_number, point, days, time_from, time_to)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                data.get("id"),
+                plate,
+                data.get("point") or None,
+                data.get("days") or None,
+                data.get("time_from") or None,
+                data.get("time_to") or None,
+            ),
+        )
+        conn.commit()
+    access.reload()
     return jsonify({"status": "ok"})
 
+@app.route("/api/access/rules/<int:id>", methods=["DELETE"])
+def delete_access_rule(id):
+    with sqlite3.connect(BASE_DB) as conn:
+        conn.execute("DELETE FROM access_rules WHERE id=?", (id,))
+        conn.commit()
+    access.reload()
+    return jsonify({"status": "ok"})
+
+@app.route("/api/access/check", methods=["GET"])
+def check_access():
+    """
+    Проверка решения без открытия ворот: ?point=...&plate=...
+    """
+    point = (request.args.get("point") or "").strip()
+    plate = normalize_text(request.args.get("plate") or "")
+    t0 = time.perf_counter()
+    decision = access.decide(point, plate)
+    return jsonify({"point": point, "plate": plate, **decision,
+                    "decide_us": round((time.perf_counter() - t0) * 1e6, 1)})
+
+@app.route("/api/access/stats", methods=["GET"])
+def access_stats():
+    return jsonify({"engine": access.engine.stats(), "open_latency": access.open_latency_stats()})
+
+# -----------------------
+# API: Номера под наблюдением (шаблоны с * и ?, тревога в MQTT)
+# -----------------------
+@app.route("/api/watchlist", methods=["GET"])
+def get_watchlist():
+    with sqlite3.connect(BASE_DB) as conn:
+        rows = conn.execute("SELECT id, pattern, reason, created_ts FROM watchlist ORDER BY pattern, id").fetchall()
+    return jsonify({"items": [dict(zip(("id", "pattern", "reason", "created_ts"), r)) for r in rows],
+                    "engine": watchlist.engine.stats()})
+
+@app.route("/api/watchlist", methods=["POST"])
+def add_watchlist():
+    data = request.json or {}
+    pattern = watchlist.normalize_pattern(data.get("pattern") or "")
+    if not pattern.strip("*?"):
+        return jsonify({"status": "error", "error": "pattern is required"}), 400
+    with sqlite3.connect(BASE_DB) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO watchlist (id, pattern, reason, created_ts) VALUES (?, ?, ?, ?)",
+            (data.get("id"), pattern, data.get("reason") or None, int(time.time())),
+        )
+        conn.commit()
+    watchlist.reload()
+    return jsonify({"status": "ok", "pattern": pattern})
+
+@app.route("/api/watchlist/<int:id>", methods=["DELETE"])
+def delete_watchlist(id):
+    with sqlite3.connect(BASE_DB) as conn:
+        conn.execute("DELETE FROM watchlist WHERE id=?", (id,))
+        conn.commit()
+    watchlist.reload()
+    return jsonify({"status": "ok"})
+
+@app.route("/api/watchlist/check", methods=["GET"])
+def check_watchlist():
+    """
+    Проверка номера без тревоги: ?plate=...
+    """
+    plate = normalize_text(request.args.get("plate") or "")
+    t0 = time.perf_counter()
+    hits = watchlist.match(plate)
+    return jsonify({"plate": plate, "hits": hits, "match_us": round((time.perf_counter() - t0) * 1e6, 1)})
+
+# -----------------------
+# API: Трассы событий (кадр → CPAI → история → MQTT → ворота)
+# -----------------------
+@app.route("/api/trace", methods=["GET"])
+def list_traces():
+    """
+    ?plate=&point=&limit= — последние трассы из кольца в памяти.
+    """
+    limit = min(max(request.args.get("limit", default=50, type=int), 1), 1000)
+    plate = normalize_text(request.args.get("plate") or "") or None
+    return jsonify(tracing.find(plate=plate, point=request.args.get("point") or None, limit=limit))
+
+@app.route("/api/trace/slowest", methods=["GET"])
+def slowest_traces():
+    """
+    ?n=20&since=<unix ts>&all=1 — самые долгие трассы (all=1 — включая кадры без номера).
+    """
+    n = min(max(request.args.get("n", default=20, type=int), 1), 1000)
+    return jsonify(tracing.slowest(n, since=request.args.get("since", type=float),
+                                   plates_only=request.args.get("all") != "1"))
+
+@app.route("/api/trace/<trace_id>", methods=["GET"])
+def get_trace(trace_id):
+    tr = tracing.get(trace_id)
+    if tr is None:
+        return jsonify({"error": "Трасса не найдена (возможно, вытеснена из кольца)"}), 404
+    return jsonify(tr)
+
+@app.route("/api/tracks", methods=["GET"])
+def get_tracks():
+    """
+    Живые треки машин (?point=...) и счётчики трекера.
+    """
+    return jsonify({"tracks": tracker.tracker.active(request.args.get("point") or None),
+                    "stats": tracker.tracker.stats()})
+
+@app.route("/api/cluster", methods=["GET"])
+def get_cluster():
+    """
+    Узлы кластера и аренды точек (из общего файла cluster.db).
+    """
+    return jsonify(cluster.status())
+
 # -----------------------
 # API: Points
 # -----------------------
+def _sync_cameras():
+    """
+    Перезапускает только те RTSP-читатели, чей URL изменился (если ALPR и выборка
+    кадров запущены в этом процессе). В кластере — только для точек, арендованных этим узлом.
+    """
+    if not sampler.running():
+        return
+    desired = {}
+    with sqlite3.connect(POINTS_DB) as conn:
+        for name, rtp_url, in_cam, out_cam in conn.execute(
+            "SELECT name, rtp_url, in_camera_url, out_camera_url FROM points"
+        ):
+            if cluster.enabled() and name not in cluster.owned_points():
+                continue
+            desired[(name, "in")] = in_cam or rtp_url
+            desired[(name, "out")] = out_cam
+    report = video.cameras.sync(desired)
+    if any(report.values()):
+        log(f"🎥 Камеры: запущено {report['started']}, перезапущено {report['restarted']}, остановлено {report['stopped']}")
+
 @app.route("/api/points", methods=["GET"])
 def get_points():
     with sqlite3.connect(POINTS_DB) as conn:
         rows = conn.execute(
-            "SELECT id, name, mqtt_topic, rtp_url, in_camera_url, out_camera_url FROM points"
+            "SELECT id, name, mqtt_topic, rtp_url, in_camera_url, out_camera_url, direction_line FROM points"
         ).fetchall()
         points = []
         for r in rows:
-            pid, name, mqtt_topic, rtp_url, in_camera_url, out_camera_url = r
+            pid, name, mqtt_topic, rtp_url, in_camera_url, out_camera_url, direction_line = r
             if not in_camera_url and rtp_url:
                 in_camera_url = rtp_url
             points.append(
@@ -312,6 +781,7 @@ def get_points():
                     "rtp_url": rtp_url,
                     "in_camera_url": in_camera_url,
                     "out_camera_url": out_camera_url,
+                    "direction_line": direction_line,
                 }
             )
     return jsonify({"points": points})
@@ -323,16 +793,23 @@ def add_point():
     in_cam = data.get("in_camera_url") or data.get("rtp_url") or ""
     out_cam = data.get("out_camera_url") or ""
     mqtt_topic = data.get("mqtt_topic", name)
+    line_text = (data.get("direction_line") or "").strip()
+    line = tracker.parse_line(line_text)
+    if line_text and line is None:
+        return jsonify({"status": "error", "error": "Линия направления: ожидается x1,y1,x2,y2"}), 400
     with sqlite3.connect(POINTS_DB) as conn:
         conn.execute(
             """
             INSERT OR REPLACE INTO points
-            (id, name, mqtt_topic, rtp_url, in_camera_url, out_camera_url)
-            VALUES (?, ?, ?, ?, ?, ?)
+            (id, name, mqtt_topic, rtp_url, in_camera_url, out_camera_url, direction_line)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             """,
-            (data.get("id"), name, mqtt_topic, data.get("rtp_url"), in_cam, out_cam),
+            (data.get("id"), name, mqtt_topic, data.get("rtp_url"), in_cam, out_cam,
+             ",".join(f"{v:g}" for v in line) if line else None),
         )
         conn.commit()
+    tracker.reload_lines()
+    _sync_cameras()
     return jsonify({"status": "ok"})
 
 @app.route("/api/points/<int:id>", methods=["DELETE"])
@@ -340,6 +817,7 @@ def delete_point(id):
     with sqlite3.connect(POINTS_DB) as conn:
         conn.execute("DELETE FROM points WHERE id=?", (id,))
         conn.commit()
+    _sync_cameras()
     return jsonify({"status": "ok"})
 
 # -----------------------
@@ -362,45 +840,144 @@ def api_history():
     def _start_of_day(d): return d + " 00:00:00" if len(d) == 10 else d
     def _end_of_day(d):   return d + " 23:59:59" if len(d) == 10 else d
 
-    where = []
-    args = []
-    if search:
-        where.append("plate LIKE ?")
-        args.append(f"%{search}%")
-    if date_from:
-        where.append("timestamp >= ?")
-        args.append(_start_of_day(date_from))
-    if date_to:
-        where.append("timestamp <= ?")
-        args.append(_end_of_day(date_to))
-    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
-
     db_path = _history_db_path()
     try:
         with sqlite3.connect(db_path) as conn:
             conn.row_factory = sqlite3.Row
+            # Схема backend/db.py: history(plate, point, ts INTEGER, …, crop, thumb);
+            # старая: history(timestamp TEXT, plate, point_name) — см. history_cleaner
+            cols = {r[1] for r in conn.execute("PRAGMA table_info(history)")}
+            if "ts" in cols and "point" in cols:
+                time_sql = "datetime(ts, 'unixepoch', 'localtime')"
+                select = [f"{time_sql} AS timestamp", "point AS point_name"]
+                order = "ts"
+            else:
+                time_sql = "timestamp"
+                select = ["timestamp", "point_name"]
+                order = "timestamp"
+            extra = [c for c in ("direction", "crop", "thumb") if c in cols]
+
+            where = []
+            args = []
+            if search:
+                where.append("plate LIKE ?")
+                args.append(f"%{search}%")
+            if date_from:
+                where.append(f"{time_sql} >= ?")
+                args.append(_start_of_day(date_from))
+            if date_to:
+                where.append(f"{time_sql} <= ?")
+                args.append(_end_of_day(date_to))
+            where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+
             total = conn.execute(f"SELECT COUNT(*) AS cnt FROM history{where_sql}", args).fetchone()["cnt"]
             items = conn.execute(
                 f"""
-                SELECT id, timestamp, plate, point_name
+                SELECT id, plate, {", ".join(select + extra)}
                 FROM history
                 {where_sql}
-                ORDER BY timestamp DESC, id DESC
+                ORDER BY {order} DESC, id DESC
                 LIMIT ? OFFSET ?
                 """,
                 args + [limit, offset]
             ).fetchall()
-            out = [{"id": r["id"], "timestamp": r["timestamp"], "plate": r["plate"], "point_name": r["point_name"]} for r in items]
+            out = [{k: r[k] for k in ["id", "timestamp", "plate", "point_name"] + extra} for r in items]
         return jsonify({"items": out, "total": total, "limit": limit, "offset": offset})
     except Exception as e:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} Ошибка /api/history: {e}\n")
+        log(f"⚠️ Ошибка /api/history: {e}")
         return jsonify({"items": [], "total": 0, "limit": limit, "offset": offset})
 
+# -----------------------
+# Кропы и миниатюры событий (адресуются хэшем содержимого)
+# -----------------------
+@app.route("/evidence/<digest>.jpg", methods=["GET"])
+def get_evidence(digest):
+    """
+    Содержимое по хэшу не меняется: вечный кэш браузера, ETag = хэш (If-None-Match → 304).
+    """
+    if not evidence.is_digest(digest):
+        return jsonify({"error": "not found"}), 404
+    path = evidence.path_for(digest)
+    if not os.path.exists(path):
+        return jsonify({"error": "not found"}), 404
+    resp = send_file(path, mimetype="image/jpeg", etag=digest, conditional=True, max_age=31536000)
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
+
+# -----------------------
+# API: Статистика (агрегаты stats из history.db)
+# -----------------------
+def _parse_stats_ts(value, end_of_day=False):
+    try:
+        return alpr_db.parse_ts(value, end_of_day=end_of_day)
+    except ValueError:
+        return None
+
+@app.route("/api/stats", methods=["GET"])
+def api_stats():
+    """
+    Ряды для графиков: ?period=hour|day&point=...&from=...&to=...
+    По умолчанию — последние 24 часа (hour) или 30 суток (day).
+    """
+    period = request.args.get("period", "hour")
+    if period not in alpr_db.STATS_PERIODS:
+        period = "hour"
+    point = (request.args.get("point") or "").strip() or None
+    until = _parse_stats_ts(request.args.get("to"), end_of_day=True)
+    since = _parse_stats_ts(request.args.get("from"))
+    if since is None:
+        since = (until or int(time.time())) - (86400 if period == "hour" else 30 * 86400)
+    try:
+        rows = alpr_db.fetch_stats(period, point=point, since=since, until=until)
+    except Exception as e:
+        log(f"⚠️ Ошибка /api/stats: {e}")
+        rows = []
+
+    totals = {"total": 0, "residents": 0, "unknown": 0}
+    for r in rows:
+        for k in totals:
+            totals[k] += r[k]
+    return jsonify({"period": period, "point": point, "from": since, "to": until, "items": rows, "totals": totals})
+
+# -----------------------
+# API: Присутствие и визиты (таблицы presence/visits из history.db)
+# -----------------------
+@app.route("/api/presence", methods=["GET"])
+def api_presence():
+    """
+    Кто сейчас внутри: ?point=...&limit=500
+    """
+    limit = min(max(request.args.get("limit", default=500, type=int), 1), 5000)
+    point = (request.args.get("point") or "").strip() or None
+    try:
+        data = alpr_db.fetch_presence(point=point, limit=limit)
+    except Exception as e:
+        log(f"⚠️ Ошибка /api/presence: {e}")
+        data = {"total": 0, "items": []}
+    now = int(time.time())
+    for r in data["items"]:
+        r["inside_s"] = max(0, now - int(r["in_ts"]))
+    return jsonify(data)
+
+@app.route("/api/visits", methods=["GET"])
+def api_visits():
+    """
+    Визиты с временем пребывания (новые первыми): ?plate=...&limit=100&before=<id визита>
+    """
+    limit = min(max(request.args.get("limit", default=100, type=int), 1), 1000)
+    plate = normalize_text(request.args.get("plate") or "") or None
+    try:
+        items = alpr_db.fetch_visits(plate=plate, limit=limit, before_id=request.args.get("before", type=int))
+    except Exception as e:
+        log(f"⚠️ Ошибка /api/visits: {e}")
+        items = []
+    return jsonify({"items": items, "next_before": items[-1]["id"] if len(items) == limit else None})
+
 # -----------------------
 # Снимки
 # -----------------------
 def capture_and_save_single(rtsp_url, save_path):
+    import cv2  # OpenCV грузится только при первом обновлении снимков
     try:
         cap = cv2.VideoCapture(rtsp_url)
         if not cap or not cap.isOpened():
@@ -416,8 +993,7 @@ def capture_and_save_single(rtsp_url, save_path):
         cv2.imwrite(save_path, frame)
         return True
     except Exception as e:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} Ошибка capture_and_save_single {e}\n")
+        log(f"⚠️ Ошибка capture_and_save_single {e}")
         return False
 
 @app.route("/api/refresh_snapshots", methods=["POST"])
@@ -447,10 +1023,9 @@ def refresh_snapshots():
 # -----------------------
 def run_alpr():
     try:
-        ALPR.main()
+        ALPR.start()
     except Exception as e:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} Ошибка запуска ALPR: {e}\n")
+        log(f"⚠️ Ошибка запуска ALPR: {e}")
 
 # -----------------------
 # API: Перезапуск службы ALPR
@@ -479,9 +1054,14 @@ def api_restart():
         return jsonify({"status": "error", "error": str(e)}), 500
 
 if __name__ == "__main__":
+    import sys
+    if "--profile-startup" in sys.argv:
+        # отчёт о холодном старте (в чистом процессе) вместо запуска сервера
+        from backend import startup_profile
+        sys.exit(startup_profile.main([a for a in sys.argv[1:] if a != "--profile-startup"]))
+
     import logging
-    log = logging.getLogger("werkzeug")
-    log.setLevel(logging.ERROR)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
     threading.Thread(target=run_alpr, daemon=True).start()
     app.run(host="0.0.0.0", port=8081)
@@ -0,0 +1,292 @@
+# backend/access.py
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from backend.config import DB_BASE_PATH
+from backend.logger import log
+from backend.text_utils import normalize_text, parse_plate_parts
+
+# -----------------------
+# Разрешения на проезд (allowlist в памяти)
+# -----------------------
+# Источник — base.db веб-админки:
+#   people(car_number)              — жильцы; без правил проезжают везде и всегда
+#   access_rules(car_number, point, days, time_from, time_to)
+#                                   — если у номера есть правила, проезд только по ним
+# days — строка из цифр дней недели (1=пн … 7=вс), пусто/NULL — все дни;
+# time_from/time_to — "HH:MM", окно через полночь (22:00–06:00) допускается.
+# Решение принимается только по словарям в памяти, без обращения к SQLite.
+
+# Как часто (сек) проверять, не изменилась ли base.db другим процессом
+RELOAD_CHECK_INTERVAL = 5.0
+
+ACCESS_RULES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS access_rules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    car_number TEXT NOT NULL,
+    point TEXT,
+    days TEXT,
+    time_from TEXT,
+    time_to TEXT
+)
+"""
+
+
+def _hhmm_to_min(value: str | None, default: int) -> int:
+    if not value:
+        return default
+    try:
+        h, m = str(value).split(":")[:2]
+        return int(h) * 60 + int(m)
+    except Exception:
+        return default
+
+
+class AccessEngine:
+    """
+    Снимок allowlist в памяти. reload() строит новые словари и подменяет их
+    одной операцией присваивания, поэтому decide() работает без блокировок.
+    """
+
+    def __init__(self, db_path: str = DB_BASE_PATH):
+        self.db_path = db_path
+        # plate -> None (без ограничений) | list[(point|None, days|None, from_min, to_min, rule_id)]
+        self._plates: dict[str, list[tuple] | None] = {}
+        # base (без региона) -> полный номер, для достройки региона
+        self._by_base: dict[str, str] = {}
+        # номера из people (жильцы) — для агрегатов stats, независимо от правил
+        self._residents: frozenset[str] = frozenset()
+        self._reload_lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._data_version: int | None = None
+        self._next_check = 0.0
+        self.loaded_at = 0.0
+        self.decisions = 0
+        self.denied = 0
+
+    # -----------------------
+    # Загрузка
+    # -----------------------
+    def _version_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        return self._conn
+
+    def set_db_path(self, path: str) -> int:
+        """
+        Переключает движок на другую base.db (смена путей в настройках) и перечитывает её.
+        """
+        with self._reload_lock:
+            if path != self.db_path:
+                conn, self._conn = self._conn, None
+                self.db_path = path
+                self._data_version = None
+                if conn is not None:
+                    conn.close()
+        return self.reload()
+
+    def reload(self) -> int:
+        """
+        Перечитывает people и access_rules. Возвращает количество номеров в allowlist.
+        """
+        with self._reload_lock:
+            plates: dict[str, list[tuple] | None] = {}
+            by_base: dict[str, str] = {}
+            residents: set[str] = set()
+            try:
+                self._load_into(plates, residents)
+            except Exception as e:
+                # оставляем предыдущий снимок — лучше старый список, чем пустой
+                log(f"⚠️ Доступ: ошибка загрузки allowlist: {e}")
+                self.loaded_at = self.loaded_at or time.time()
+                return len(self._plates)
+            for plate in plates:
+                base, region = parse_plate_parts(plate)
+                if base and region:
+                    prev = by_base.get(base)
+                    if prev is None or len(plate) > len(prev):
+                        by_base[base] = plate
+
+            self._plates, self._by_base, self._residents = plates, by_base, frozenset(residents)
+            self.loaded_at = time.time()
+            try:
+                self._data_version = self._version_conn().execute("PRAGMA data_version").fetchone()[0]
+            except Exception:
+                self._data_version = None
+        log(f"🔐 Доступ: загружено {len(plates)} номеров", debug=True)
+        return len(plates)
+
+    def _load_into(self, plates: dict[str, list[tuple] | None], residents: set[str]) -> None:
+        if not os.path.exists(self.db_path):
+            return
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.execute(ACCESS_RULES_SCHEMA)
+            for (car_number,) in conn.execute("SELECT car_number FROM people WHERE car_number IS NOT NULL"):
+                plate = normalize_text(car_number)
+                if plate:
+                    plates[plate] = None
+                    residents.add(plate)
+            for rid, car_number, point, days, t_from, t_to in conn.execute(
+                "SELECT id, car_number, point, days, time_from, time_to FROM access_rules"
+            ):
+                plate = normalize_text(car_number)
+                if not plate:
+                    continue
+                rule = (
+                    point or None,
+                    frozenset(int(d) for d in str(days) if d.isdigit()) if days else None,
+                    _hhmm_to_min(t_from, 0),
+                    _hhmm_to_min(t_to, 24 * 60),
+                    rid,
+                )
+                plates[plate] = (plates.get(plate) or []) + [rule]
+        finally:
+            conn.close()
+
+    def _maybe_reload(self, now: float) -> None:
+        """
+        Ловит правки base.db из другого процесса (PRAGMA data_version меняется
+        после чужого COMMIT). Проверка не чаще раза в RELOAD_CHECK_INTERVAL.
+        """
+        if now < self._next_check:
+            return
+        self._next_check = now + RELOAD_CHECK_INTERVAL
+        try:
+            v = self._version_conn().execute("PRAGMA data_version").fetchone()[0]
+        except Exception:
+            return
+        if v != self._data_version:
+            self.reload()
+
+    # -----------------------
+    # Решения
+    # -----------------------
+    def decide(self, point: str, plate: str, now: float | None = None) -> dict:
+        """
+        Разрешён ли проезд номера через точку. Возвращает {"allow": bool, "reason": str}.
+        """
+        now = time.time() if now is None else now
+        if not self.loaded_at:
+            self.reload()
+        else:
+            self._maybe_reload(now)
+        self.decisions += 1
+
+        if plate not in self._plates:
+            self.denied += 1
+            return {"allow": False, "reason": "not_in_allowlist"}
+        rules = self._plates[plate]
+        if rules is None:
+            return {"allow": True, "reason": "resident"}
+
+        lt = time.localtime(now)
+        minute = lt.tm_hour * 60 + lt.tm_min
+        weekday = lt.tm_wday + 1
+        reason = "point_not_permitted"
+        for r_point, r_days, r_from, r_to, rid in rules:
+            if r_point and r_point != point:
+                continue
+            reason = "outside_time_window"
+            if r_days and weekday not in r_days:
+                continue
+            in_window = r_from <= minute < r_to if r_from <= r_to else (minute >= r_from or minute < r_to)
+            if in_window:
+                return {"allow": True, "reason": f"rule:{rid}"}
+        self.denied += 1
+        return {"allow": False, "reason": reason}
+
+    def is_allowed(self, plate: str) -> bool:
+        if not self.loaded_at:
+            self.reload()
+        return plate in self._plates
+
+    def is_resident(self, plate: str) -> bool:
+        """
+        Номер есть в people (жилец), даже если у него есть правила доступа.
+        """
+        if not self.loaded_at:
+            self.reload()
+        else:
+            self._maybe_reload(time.time())
+        return plate in self._residents
+
+    def resident_plates(self) -> frozenset[str]:
+        if not self.loaded_at:
+            self.reload()
+        return self._residents
+
+    def complete_plate(self, base: str) -> str | None:
+        """
+        Достройка региона по allowlist в памяти (аналог db.get_plate_from_db).
+        """
+        if not base:
+            return None
+        if not self.loaded_at:
+            self.reload()
+        if base in self._plates:
+            return base
+        return self._by_base.get(base)
+
+    def stats(self) -> dict:
+        return {
+            "plates": len(self._plates),
+            "restricted": sum(1 for r in self._plates.values() if r is not None),
+            "loaded_at": self.loaded_at,
+            "decisions": self.decisions,
+            "denied": self.denied,
+        }
+
+
+engine = AccessEngine()
+
+
+# -----------------------
+# Латентность «кадр → команда OPEN»
+# -----------------------
+_open_latency_ms: deque[float] = deque(maxlen=1000)
+_open_latency_lock = threading.Lock()
+
+
+def record_open_latency(capture_ts: float | None) -> None:
+    if not capture_ts:
+        return
+    with _open_latency_lock:
+        _open_latency_ms.append((time.time() - capture_ts) * 1000.0)
+
+
+def open_latency_stats() -> dict:
+    with _open_latency_lock:
+        vals = sorted(_open_latency_ms)
+    if not vals:
+        return {"count": 0}
+
+    def _q(q: float) -> float:
+        return round(vals[min(len(vals) - 1, int(q * len(vals)))], 1)
+
+    return {"count": len(vals), "p50_ms": _q(0.5), "p95_ms": _q(0.95), "max_ms": round(vals[-1], 1)}
+
+
+# -----------------------
+# Функции-обёртки
+# -----------------------
+def decide(point: str, plate: str) -> dict:
+    return engine.decide(point, plate)
+
+
+def reload() -> int:
+    return engine.reload()
+
+
+def complete_plate(base: str) -> str | None:
+    return engine.complete_plate(base)
+
+
+def is_resident(plate: str) -> bool:
+    return engine.is_resident(plate)
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+# backend/bench.py
+# Запуск: python -m backend.bench [--frames 2000] [--rate 50] [--points 4] [--cpai-ms 40]
+#                                 [--source кадры/ | видео.mp4] [--json out.json]
+#                                 [--thresholds bench_thresholds.json] [--threshold e2e.p95=250]
+#
+# Сквозной стенд конвейера в одном процессе: источник кадров (папка JPEG,
+# видео или синтетика) → MQTT (внутрипроцессная замена брокера) → MQTTWrap →
+# ALPR.process_snapshot → mock CPAI → history во временной SQLite → публикация
+# plates. Считает кадры/с, события/с, p50/p95/p99 по стадиям (из трасс
+# backend/tracing) и сквозную задержку, CPU и RSS. Пороги регрессии — из
+# файла и/или --threshold; при нарушении код возврата 1.
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+
+from backend import config
+
+# Метка кадра стенда: дописывается после JPEG (после EOI декодеры её игнорируют)
+_FRAME_TAG = b"BENCH"
+_LETTERS = "АВЕКМНОРСТУХ"
+
+
+# -----------------------
+# Источник кадров
+# -----------------------
+def _load_frames(source: str | None, limit: int) -> list[bytes]:
+    """
+    Папка с *.jpg, видеофайл (через OpenCV) или синтетические JPEG-подобные кадры.
+    """
+    if source and os.path.isdir(source):
+        names = sorted(n for n in os.listdir(source) if n.lower().endswith((".jpg", ".jpeg")))
+        frames = []
+        for n in names[:limit]:
+            with open(os.path.join(source, n), "rb") as f:
+                frames.append(f.read())
+        if not frames:
+            raise SystemExit(f"[bench] в {source} нет JPEG")
+        return frames
+    if source:
+        import cv2
+        cap = cv2.VideoCapture(source)
+        frames = []
+        while len(frames) < limit:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            ok, enc = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), 92])
+            if ok:
+                frames.append(enc.tobytes())
+        cap.release()
+        if not frames:
+            raise SystemExit(f"[bench] не удалось прочитать кадры из {source}")
+        return frames
+    rnd = random.Random(0)
+    return [b"\xff\xd8" + rnd.randbytes(150_000) + b"\xff\xd9" for _ in range(min(limit, 16))]
+
+
+def _plate_for(seq: int) -> str:
+    # уникальный номер на каждый кадр, чтобы подавление повторов не искажало счёт
+    num = seq % 999 + 1
+    rest = seq // 999
+    a, b, c = rest % 12, (rest // 12) % 12, (rest // 144) % 12
+    return f"{_LETTERS[a]}{num:03d}{_LETTERS[b]}{_LETTERS[c]}77"
+
+
+# -----------------------
+# Внутрипроцессный «брокер»
+# -----------------------
+class LoopbackBroker:
+    """
+    Доставляет публикации подписчикам синхронно, в потоке публикующего —
+    как сетевой поток paho вызывает on_message.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: list[tuple[str, "LoopbackClient"]] = []
+
+    def subscribe(self, topic_filter: str, client: "LoopbackClient") -> None:
+        with self._lock:
+            self._subs.append((topic_filter, client))
+
+    def unsubscribe(self, topic_filter: str, client: "LoopbackClient") -> None:
+        with self._lock:
+            self._subs = [(f, c) for f, c in self._subs if not (f == topic_filter and c is client)]
+
+    def deliver(self, topic: str, payload, qos: int = 0, retain: bool = False) -> None:
+        from paho.mqtt.client import topic_matches_sub
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        with self._lock:
+            targets = [c for f, c in self._subs if topic_matches_sub(f, topic)]
+        msg = types.SimpleNamespace(topic=topic, payload=payload, qos=qos, retain=retain)
+        for c in targets:
+            if c.on_message:
+                c.on_message(c, None, msg)
+
+
+class LoopbackClient:
+    """
+    Минимальная замена paho.mqtt.client.Client для MQTTWrap.
+    """
+
+    def __init__(self, broker: LoopbackBroker):
+        self.broker = broker
+        self.on_connect = self.on_disconnect = self.on_message = self.on_publish = None
+        self._mid = 0
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def connect(self, host, port=1883, keepalive=60):
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0)
+        return 0
+
+    connect_async = connect
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        if self.on_disconnect:
+            self.on_disconnect(self, None, 0)
+
+    def subscribe(self, topic, qos=0):
+        self.broker.subscribe(topic, self)
+        return 0, 0
+
+    def unsubscribe(self, topic):
+        self.broker.unsubscribe(topic, self)
+        return 0, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self._mid += 1
+        self.broker.deliver(topic, payload, qos, retain)
+        if self.on_publish:
+            self.on_publish(self, None, self._mid)
+        return types.SimpleNamespace(rc=0, mid=self._mid)
+
+
+# -----------------------
+# Статистика
+# -----------------------
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"n": 0}
+    v = sorted(values)
+
+    def pct(p):
+        return round(v[min(len(v) - 1, int(len(v) * p / 100.0))], 2)
+
+    return {"n": len(v), "p50": pct(50), "p95": pct(95), "p99": pct(99), "max": round(v[-1], 2)}
+
+
+def _rusage():
+    try:
+        import resource
+    except ImportError:
+        return None
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    rss_mb = ru.ru_maxrss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+    return ru.ru_utime + ru.ru_stime, rss_mb
+
+
+# -----------------------
+# Прогон
+# -----------------------
+def run(frames_total: int = 2000, rate: float = 50.0, points: int = 4, cpai_ms: float = 40.0,
+        cpai_jitter_ms: float = 10.0, source: str | None = None, workers: int | None = None,
+        timeout: float = 60.0, verbose: bool = False) -> dict:
+    tmp = tempfile.mkdtemp(prefix="alpr_bench_")
+    # временные базы, лог и спул — до импорта модулей, которые читают эти пути
+    config.DB_HISTORY_PATH = os.path.join(tmp, "history.db")
+    config.DB_PEOPLE_PATH = os.path.join(tmp, "people.db")
+    config.DB_BASE_PATH = os.path.join(tmp, "base.db")
+    config.LOG_FILE = os.path.join(tmp, "alpr.log")
+    config.MQTT_SPOOL_PATH = os.path.join(tmp, "mqtt_spool.jsonl")
+    config.EVIDENCE_DIR = os.path.join(tmp, "evidence")
+    config.TRACE_RING_SIZE = frames_total + 100
+    # каждый кадр — отдельное событие: синтетические номера соседних кадров похожи,
+    # и трекер склеил бы их в один проезд
+    config.TRACKER_ENABLED = False
+    if workers:
+        config.MQTT_WORKERS = workers
+
+    from backend import logger
+    if not verbose:
+        # консоль не засоряем; запись в файл (временный) остаётся — её стоимость часть конвейера
+        logger.set_console(False)
+
+    from backend import cpai, db, mqtt_wrap, tracing
+    import ALPR
+
+    class MockCPAIClient(cpai.CPAIClient):
+        """
+        Отвечает номером, вычисленным из метки кадра, с заданной задержкой.
+        """
+
+        def _recognize(self, image_bytes):
+            time.sleep(max(0.0, random.gauss(cpai_ms, cpai_jitter_ms)) / 1000.0)
+            tail = bytes(image_bytes[-len(_FRAME_TAG) - 8:])
+            if not tail.startswith(_FRAME_TAG):
+                return {"ok": True, "plate": None, "err": None}
+            return {"ok": True, "plate": _plate_for(int.from_bytes(tail[-8:], "big")), "err": None}
+
+    cpai._shared_client = MockCPAIClient("mock://cpai")
+
+    broker = LoopbackBroker()
+    wrap = mqtt_wrap.start_mqtt(on_message_cb=ALPR.on_mqtt_message, client=LoopbackClient(broker))
+    db.init_db()
+
+    sent_at: dict[str, float] = {}
+    received: dict[str, float] = {}
+    done = threading.Event()
+    recv_lock = threading.Lock()
+
+    def on_plate(client, userdata, msg):
+        now = time.time()
+        plate = json.loads(msg.payload).get("plate")
+        with recv_lock:
+            received[plate] = now
+            if len(received) >= frames_total:
+                done.set()
+
+    sink = LoopbackClient(broker)
+    sink.on_message = on_plate
+    sink.subscribe(f"{config.TOPIC_PREFIX}/plates")
+    feeder = LoopbackClient(broker)
+
+    frames = _load_frames(source, frames_total)
+    base = _rusage()
+    interval = 1.0 / rate if rate > 0 else 0.0
+    t_start = time.time()
+    next_at = time.perf_counter()
+    for seq in range(frames_total):
+        payload = frames[seq % len(frames)] + _FRAME_TAG + seq.to_bytes(8, "big")
+        point = f"bench{seq % points}"
+        sent_at[_plate_for(seq)] = time.time()
+        feeder.publish(f"{config.TOPIC_PREFIX}/{point}/snapshot", payload)
+        if interval:
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    t_fed = time.time()
+    # ждём, пока каждый кадр не даст событие или не будет отброшен очередью приёма
+    # (под перегрузкой, напр. --rate 0, часть кадров отбрасывается — событий от них не будет)
+    deadline = time.time() + timeout
+    complete = False
+    while not complete and time.time() < deadline:
+        done.wait(0.05)
+        with recv_lock:
+            n_events = len(received)
+        complete = n_events + wrap.stats().get("dropped", 0) >= frames_total
+    t_end = time.time()
+    usage = _rusage()
+    with recv_lock:
+        # темп — до последнего события, без времени ожидания после него
+        t_last = max(received.values()) if received else t_end
+
+    # задержки по стадиям — из трасс конвейера
+    stages: dict[str, list[float]] = {"mqtt_in": [], "e2e": []}
+    for tr in tracing.find(limit=frames_total + 100):
+        plate = tr["attrs"].get("plate")
+        if plate in sent_at:
+            stages["mqtt_in"].append((tr["capture_ts"] - sent_at[plate]) * 1000.0)
+        for sp in tr["spans"]:
+            stages.setdefault(sp["name"], []).append(sp["duration_ms"])
+    for plate, t in received.items():
+        if plate in sent_at:
+            stages["e2e"].append((t - sent_at[plate]) * 1000.0)
+
+    ingest = wrap.stats()
+    wall = max(t_end - t_start, 1e-9)
+    active = max(t_last - t_start, 1e-9)
+    result = {
+        "config": {"frames": frames_total, "rate": rate, "points": points, "cpai_ms": cpai_ms,
+                   "cpai_jitter_ms": cpai_jitter_ms, "workers": ingest.get("workers"),
+                   "source": source or "synthetic"},
+        "frames_sent": frames_total,
+        "frames_processed": ingest.get("processed", 0),
+        "frames_dropped": ingest.get("dropped", 0),
+        "events": len(received),
+        "duration_s": round(active, 3),
+        "feed_s": round(t_fed - t_start, 3),
+        "frames_per_s": round(ingest.get("processed", 0) / active, 2),
+        "events_per_s": round(len(received) / active, 2),
+        "latency_ms": {name: _percentiles(v) for name, v in stages.items()},
+        "cpu_percent": round((usage[0] - base[0]) / wall * 100.0, 1) if usage and base else None,
+        "rss_mb": round(usage[1], 1) if usage else None,
+        "timed_out": not complete,
+    }
+    wrap.stop()
+    shutil.rmtree(tmp, ignore_errors=True)
+    return result
+
+
+# -----------------------
+# Пороги регрессии
+# -----------------------
+def check_thresholds(result: dict, thresholds: dict) -> list[str]:
+    """
+    thresholds: {"frames_per_s": мин, "events_per_s": мин, "<стадия>.p95": макс мс, ...}
+    """
+    failures = []
+    for key, limit in thresholds.items():
+        if key in ("frames_per_s", "events_per_s"):
+            if result[key] < limit:
+                failures.append(f"{key} = {result[key]} < {limit}")
+            continue
+        stage, _, pct = key.rpartition(".")
+        value = result["latency_ms"].get(stage, {}).get(pct)
+        if value is None:
+            failures.append(f"{key}: нет данных")
+        elif value > limit:
+            failures.append(f"{key} = {value} мс > {limit} мс")
+    if result["timed_out"]:
+        failures.append(f"получено {result['events']} событий из {result['frames_sent']} (таймаут)")
+    return failures
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Сквозной бенчмарк конвейера распознавания.")
+    p.add_argument("--frames", type=int, default=2000, help="Сколько кадров подать")
+    p.add_argument("--rate", type=float, default=50.0, help="Кадров в секунду суммарно (0 — без ограничения)")
+    p.add_argument("--points", type=int, default=4, help="Число точек (камер)")
+    p.add_argument("--cpai-ms", type=float, default=40.0, help="Задержка mock CPAI, мс")
+    p.add_argument("--cpai-jitter-ms", type=float, default=10.0, help="Разброс задержки mock CPAI, мс")
+    p.add_argument("--workers", type=int, help="Число обработчиков MQTT (по умолчанию из настроек)")
+    p.add_argument("--source", help="Папка с JPEG или видеофайл; по умолчанию синтетические кадры")
+    p.add_argument("--timeout", type=float, default=60.0, help="Сколько ждать последних событий, сек")
+    p.add_argument("--json", dest="json_out", help="Записать результат в JSON-файл ('-' — в stdout)")
+    p.add_argument("--thresholds", help="JSON-файл порогов")
+    p.add_argument("--threshold", action="append", default=[], metavar="КЛЮЧ=ЗНАЧЕНИЕ",
+                   help="Порог, напр. e2e.p95=250 или events_per_s=40 (можно несколько)")
+    p.add_argument("--verbose", action="store_true", help="Не глушить лог в консоли")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    thresholds = {}
+    if args.thresholds:
+        with open(args.thresholds, "r", encoding="utf-8") as f:
+            thresholds.update(json.load(f))
+    for item in args.threshold:
+        key, _, value = item.partition("=")
+        thresholds[key.strip()] = float(value)
+
+    result = run(args.frames, args.rate, args.points, args.cpai_ms, args.cpai_jitter_ms,
+                 args.source, args.workers, args.timeout, args.verbose)
+    failures = check_thresholds(result, thresholds)
+    result["thresholds"] = thresholds
+    result["failures"] = failures
+
+    if args.json_out == "-":
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        if args.json_out:
+            with open(args.json_out, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"[bench] кадров {result['frames_processed']}/{result['frames_sent']} "
+              f"(отброшено {result['frames_dropped']}), событий {result['events']} за {result['duration_s']} с: "
+              f"{result['frames_per_s']} кадр/с, {result['events_per_s']} соб/с, "
+              f"CPU {result['cpu_percent']}%, RSS {result['rss_mb']} МБ")
+        for name, st in result["latency_ms"].items():
+            if st.get("n"):
+                print(f"  {name:<14} n={st['n']:<6} p50={st['p50']:<8} p95={st['p95']:<8} p99={st['p99']:<8} max={st['max']}")
+        for f in failures:
+            print(f"❌ {f}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
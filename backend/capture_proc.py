@@ -0,0 +1,288 @@
+# backend/capture_proc.py
+from __future__ import annotations
+
+import multiprocessing as mp
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from backend import capture_reader, config, metrics
+from backend.capture_reader import SharedFrameRing
+from backend.logger import log
+
+# -----------------------
+# Захват «процесс на камеру» с передачей кадров через shared memory
+# -----------------------
+# Включается настройкой capture.mode = "process" (см. video.cameras). Каждый
+# RTSP-читатель — отдельный процесс со своим GIL и своими потоками OpenCV.
+# Кадры он пишет в кольцо слотов в multiprocessing.shared_memory; пакетный
+# препроцессинг (preprocess.batch_from_buffers) читает numpy-view прямо на слот
+# (без копии и pickle). Сам читатель и кольцо — backend/capture_reader.py.
+#
+# Раскладка блока: заголовок int64[8] + метаданные слотов int64[slots, 2]
+# (seq, ts_ns) + сами слоты (slots × H × W × C, uint8). Запись слота —
+# «seqlock»: seq слота на время записи делается отрицательным, поэтому
+# читатель может проверить, что слот не перезаписали, пока он его читал.
+#
+# Кольцо создаёт дочерний процесс по первому кадру (разрешение заранее
+# неизвестно) и сообщает его имя супервизору; при смене разрешения создаётся
+# новое поколение. Супервизор (поток в основном процессе) перезапускает
+# упавшие и зависшие (нет heartbeat) читатели с нарастающей паузой.
+
+# Читатель считается зависшим, если heartbeat не обновлялся столько секунд.
+# Больше таймаута открытия FFmpeg по умолчанию (30 с) — на случай OpenCV без
+# параметров таймаутов (см. capture_reader.OPEN_TIMEOUT_MS): недоступную
+# камеру не убиваем посреди открытия.
+STALE_S = 45.0
+
+_spawn_lock = threading.Lock()
+
+
+@contextmanager
+def _light_main():
+    """
+    spawn-процесс перед запуском target импортирует __main__ родителя (app.py:
+    Flask, ensure_tables, ALPR и весь backend). На время Process.start()
+    __main__ подменяется лёгким capture_reader — его и импортирует дочерний процесс.
+    """
+    with _spawn_lock:
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = capture_reader
+        try:
+            yield
+        finally:
+            sys.modules["__main__"] = main
+
+
+# -----------------------
+# Основной процесс
+# -----------------------
+class SharedFrameBuffer:
+    """
+    Замена video.FrameBuffer для процесса-читателя: объект постоянный, а
+    кольцо под ним меняется при перезапуске/смене разрешения.
+    """
+
+    def __init__(self):
+        self._ring: SharedFrameRing | None = None
+
+    def get(self):
+        ring = self._ring
+        if ring is None:
+            return None, 0.0
+        return ring.copy_latest()
+
+    def view(self):
+        """
+        Без копии: (view только для чтения, ts, token). Кадр годен, если после
+        использования still_valid(token) — слот не перезаписан и кольцо то же.
+        """
+        ring = self._ring
+        if ring is None:
+            return None, 0.0, None
+        try:
+            frame, ts, seq = ring.view()
+        except TypeError:
+            return None, 0.0, None  # кольцо закрыто при смене поколения
+        return frame, ts, ((ring, seq) if frame is not None else None)
+
+    def still_valid(self, token) -> bool:
+        if token is None:
+            return False
+        ring, seq = token
+        try:
+            return ring is self._ring and ring.still_valid(seq)
+        except TypeError:
+            return False
+
+
+class _Reader:
+    __slots__ = ("url", "fb", "proc", "stop_evt", "heartbeat", "restarts", "next_start", "last_seq", "last_seq_ts")
+
+    def __init__(self, url: str, fb: SharedFrameBuffer):
+        self.url = url
+        self.fb = fb
+        self.proc = None
+        self.stop_evt = None
+        self.heartbeat = None
+        self.restarts = 0
+        self.next_start = 0.0
+        self.last_seq = 0
+        self.last_seq_ts = time.time()
+
+
+class ProcessCameraManager:
+    """
+    Тот же интерфейс, что у video.CameraManager (start/stop/buffer/running/sync),
+    но каждый читатель — отдельный процесс под надзором.
+    """
+
+    def __init__(self, slots: int | None = None):
+        self.slots = max(2, slots or config.CAPTURE_RING_SLOTS)
+        self._ctx = mp.get_context("spawn")
+        self._ctrl = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._readers: dict[tuple[str, str], _Reader] = {}
+        self._supervisor: threading.Thread | None = None
+
+    # --- управление ---
+    def start(self, name: str, direction: str, rtsp_url: str) -> SharedFrameBuffer:
+        key = (name, direction)
+        with self._lock:
+            r = self._readers.get(key)
+            if r and r.url == rtsp_url:
+                return r.fb
+            if r:
+                self._kill(r)
+                r.url = rtsp_url
+                r.restarts = 0
+            else:
+                r = self._readers[key] = _Reader(rtsp_url, SharedFrameBuffer())
+            self._spawn(key, r)
+        self._ensure_supervisor()
+        return r.fb
+
+    def stop(self, name: str, direction: str) -> None:
+        with self._lock:
+            r = self._readers.pop((name, direction), None)
+        if r:
+            self._kill(r)
+            self._swap_ring(r, None)
+            metrics.CAMERA_FPS.remove(camera=f"{name}/{direction}")
+
+    def buffer(self, name: str, direction: str) -> SharedFrameBuffer | None:
+        with self._lock:
+            r = self._readers.get((name, direction))
+        return r.fb if r else None
+
+    def buffers(self) -> dict[tuple[str, str], SharedFrameBuffer]:
+        with self._lock:
+            return {k: r.fb for k, r in self._readers.items()}
+
+    def running(self) -> bool:
+        with self._lock:
+            return bool(self._readers)
+
+    def sync(self, desired: dict[tuple[str, str], str]) -> dict:
+        desired = {k: v for k, v in desired.items() if v}
+        with self._lock:
+            current = {k: r.url for k, r in self._readers.items()}
+        report = {"started": [], "restarted": [], "stopped": []}
+        for key in current.keys() - desired.keys():
+            self.stop(*key)
+            report["stopped"].append("/".join(key))
+        for key, url in desired.items():
+            if current.get(key) == url:
+                continue
+            self.start(key[0], key[1], url)
+            report["restarted" if key in current else "started"].append("/".join(key))
+        return report
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "/".join(k): {"alive": bool(r.proc and r.proc.is_alive()), "restarts": r.restarts,
+                              "pid": r.proc.pid if r.proc else None, "frames": r.last_seq}
+                for k, r in self._readers.items()
+            }
+
+    # --- внутреннее ---
+    def _spawn(self, key: tuple[str, str], r: _Reader) -> None:
+        r.stop_evt = self._ctx.Event()
+        r.heartbeat = self._ctx.Value("d", time.time(), lock=False)
+        r.proc = self._ctx.Process(
+            target=capture_reader.reader_main,
+            args=(r.url, key[0], key[1], self.slots, self._ctrl, r.heartbeat, r.stop_evt),
+            name=f"camera-{key[0]}-{key[1]}", daemon=True,
+        )
+        with _light_main():
+            r.proc.start()
+
+    @staticmethod
+    def _kill(r: _Reader) -> None:
+        if r.stop_evt is not None:
+            r.stop_evt.set()
+        if r.proc is not None:
+            r.proc.join(timeout=2.0)
+            if r.proc.is_alive():
+                r.proc.terminate()
+                r.proc.join(timeout=2.0)
+        r.proc = None
+
+    @staticmethod
+    def _swap_ring(r: _Reader, ring: SharedFrameRing | None) -> None:
+        old = r.fb._ring
+        r.fb._ring = ring
+        r.last_seq = 0
+        if old is not None:
+            # владелец — дочерний процесс, но после его смерти освобождать некому
+            old.close(unlink=True)
+
+    def _ensure_supervisor(self) -> None:
+        if self._supervisor is None or not self._supervisor.is_alive():
+            self._supervisor = threading.Thread(target=self._supervise, name="camera-supervisor", daemon=True)
+            self._supervisor.start()
+
+    def _supervise(self) -> None:
+        while True:
+            try:
+                name, direction, shm_name = self._ctrl.get(timeout=0.5)
+                with self._lock:
+                    r = self._readers.get((name, direction))
+                ring = SharedFrameRing.attach(shm_name)
+                if r is None:
+                    # читатель уже остановлен — кольцо больше никому не нужно
+                    ring.close(unlink=True)
+                else:
+                    self._swap_ring(r, ring)
+                    log(f"🎥 {name}/{direction}: кадры через shared memory {shm_name}", debug=True)
+                continue
+            except queue.Empty:
+                pass
+            except Exception as e:
+                log(f"⚠️ Супервизор камер: {e}", debug=True)
+
+            now = time.time()
+            with self._lock:
+                items = list(self._readers.items())
+            for key, r in items:
+                try:
+                    self._check(key, r, now)
+                except Exception as e:
+                    log(f"⚠️ Супервизор камер ({'/'.join(key)}): {e}", debug=True)
+
+    def _check(self, key: tuple[str, str], r: _Reader, now: float) -> None:
+        camera = "/".join(key)
+        alive = r.proc is not None and r.proc.is_alive()
+        if alive and now - r.heartbeat.value > STALE_S:
+            log(f"⚠️ Камера {camera}: процесс чтения завис, перезапуск")
+            proc = r.proc
+            self._kill(r)
+            r.proc = proc  # ниже — как упавший: счётчик и пауза перед перезапуском
+            alive = False
+        if not alive:
+            metrics.CAMERA_FPS.remove(camera=camera)
+            if r.proc is not None:
+                r.restarts += 1
+                metrics.CAPTURE_RESTARTS.inc(camera=camera)
+                log(f"⚠️ Камера {camera}: процесс чтения завершился (код {r.proc.exitcode}), "
+                    f"перезапуск #{r.restarts}")
+                r.proc = None
+                r.next_start = now + min(30.0, 2.0 ** min(r.restarts, 5))
+            if now >= r.next_start:
+                with self._lock:
+                    if self._readers.get(key) is r:
+                        self._spawn(key, r)
+            return
+        # FPS по приросту seq кольца
+        ring = r.fb._ring
+        if ring is not None:
+            seq = ring.latest_seq()
+            dt = now - r.last_seq_ts
+            if dt >= 1.0:
+                if r.last_seq:
+                    metrics.CAMERA_FPS.set((seq - r.last_seq) / dt, camera=camera)
+                    metrics.FRAMES_TOTAL.inc(max(0, seq - r.last_seq), camera=camera)
+                r.last_seq, r.last_seq_ts = seq, now
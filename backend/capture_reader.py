@@ -0,0 +1,192 @@
+# backend/capture_reader.py
+from __future__ import annotations
+
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# -----------------------
+# Процесс-читатель камеры: кольцо кадров и точка входа
+# -----------------------
+# Отдельный лёгкий модуль: spawn-процесс импортирует только его (numpy, cv2),
+# а не app.py/ALPR.py со всем backend — см. capture_proc._light_main().
+# Поэтому здесь нет импортов backend.* (config, logger) — только print.
+
+_HDR_SLOTS, _HDR_H, _HDR_W, _HDR_C, _HDR_LATEST = 0, 1, 2, 3, 4
+_HDR_LEN = 8
+
+# Таймауты FFmpeg на открытие и чтение RTSP, мс (по умолчанию открытие ждёт 30 с)
+OPEN_TIMEOUT_MS = 10000
+READ_TIMEOUT_MS = 10000
+
+
+class SharedFrameRing:
+    """
+    Кольцо кадров одинакового размера в shared memory.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        hdr = np.ndarray((_HDR_LEN,), dtype=np.int64, buffer=shm.buf)
+        self.slots = int(hdr[_HDR_SLOTS])
+        self.shape = (int(hdr[_HDR_H]), int(hdr[_HDR_W]), int(hdr[_HDR_C]))
+        self._hdr = hdr
+        self._meta = np.ndarray((self.slots, 2), dtype=np.int64, buffer=shm.buf, offset=_HDR_LEN * 8)
+        self._data = np.ndarray((self.slots,) + self.shape, dtype=np.uint8, buffer=shm.buf,
+                                offset=self._data_offset(self.slots))
+
+    @staticmethod
+    def _data_offset(slots: int) -> int:
+        raw = (_HDR_LEN + 2 * slots) * 8
+        return (raw + 63) // 64 * 64
+
+    @classmethod
+    def create(cls, shape: tuple[int, int, int], slots: int) -> "SharedFrameRing":
+        size = cls._data_offset(slots) + slots * shape[0] * shape[1] * shape[2]
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        hdr = np.ndarray((_HDR_LEN,), dtype=np.int64, buffer=shm.buf)
+        hdr[:] = 0
+        hdr[_HDR_SLOTS], hdr[_HDR_H], hdr[_HDR_W], hdr[_HDR_C] = slots, shape[0], shape[1], shape[2]
+        np.ndarray((slots, 2), dtype=np.int64, buffer=shm.buf, offset=_HDR_LEN * 8)[:] = 0
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedFrameRing":
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    # --- запись (дочерний процесс) ---
+    def write(self, frame: np.ndarray) -> int:
+        seq = int(self._hdr[_HDR_LATEST]) + 1
+        slot = seq % self.slots
+        self._meta[slot, 0] = -seq
+        self._data[slot] = frame
+        self._meta[slot, 1] = time.time_ns()
+        self._meta[slot, 0] = seq
+        self._hdr[_HDR_LATEST] = seq
+        return seq
+
+    # --- чтение (основной процесс) ---
+    def latest_seq(self) -> int:
+        return int(self._hdr[_HDR_LATEST])
+
+    def view(self):
+        """
+        (кадр-view на слот, ts, seq) без копии; (None, 0.0, 0), если кадров ещё нет.
+        View действителен, пока still_valid(seq) — писатель обгоняет читателя
+        только через slots кадров.
+        """
+        seq = self.latest_seq()
+        if seq <= 0:
+            return None, 0.0, 0
+        slot = seq % self.slots
+        if int(self._meta[slot, 0]) != seq:
+            return None, 0.0, 0
+        frame = self._data[slot]
+        frame.flags.writeable = False  # view на чужой слот: только чтение
+        return frame, self._meta[slot, 1] / 1e9, seq
+
+    def still_valid(self, seq: int) -> bool:
+        return int(self._meta[seq % self.slots, 0]) == seq
+
+    def copy_latest(self):
+        for _ in range(3):
+            frame, ts, seq = self.view()
+            if frame is None:
+                return None, 0.0
+            out = frame.copy()
+            if self.still_valid(seq):
+                return out, ts
+        return None, 0.0
+
+    def close(self, unlink: bool = False) -> None:
+        self._hdr = self._meta = self._data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # на слот ещё держат view — отображение уйдёт вместе с ним
+        if unlink:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _open(cv2, rtsp_url: str):
+    try:
+        return cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG, [
+            cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, OPEN_TIMEOUT_MS,
+            cv2.CAP_PROP_READ_TIMEOUT_MSEC, READ_TIMEOUT_MS,
+        ])
+    except (AttributeError, TypeError, cv2.error):
+        # OpenCV < 4.5.2: параметров таймаутов нет — остаётся запас capture_proc.STALE_S
+        return cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
+
+
+def reader_main(rtsp_url: str, name: str, direction: str, slots: int, ctrl, heartbeat, stop_evt) -> None:
+    """
+    Точка входа процесса-читателя (spawn): читает RTSP и пишет кадры в кольцо.
+    """
+    import cv2
+    try:
+        cv2.setNumThreads(1)  # ядра делятся между процессами, а не внутри OpenCV
+    except Exception:
+        pass
+    cap = None
+    ring: SharedFrameRing | None = None
+    last_log = 0.0
+    try:
+        while not stop_evt.is_set():
+            heartbeat.value = time.time()
+            try:
+                if cap is None or not cap.isOpened():
+                    if cap:
+                        cap.release()
+                    cap = _open(cv2, rtsp_url)
+                    try:
+                        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                    except Exception:
+                        pass
+                    if not cap.isOpened():
+                        now = time.time()
+                        if now - last_log > 2.0:
+                            print(f"❌ Не удалось открыть RTSP {name}/{direction}")
+                            last_log = now
+                        time.sleep(1.0)
+                        continue
+                    print(f"✅ RTSP поток {name}/{direction} открыт (процесс)")
+                ok, frame = cap.read()
+                if not ok or frame is None:
+                    time.sleep(0.01)
+                    continue
+                if frame.ndim == 2:
+                    frame = frame[:, :, None]
+                if ring is None or ring.shape != frame.shape:
+                    # новое поколение кольца: супервизор переключится и освободит старое
+                    if ring is not None:
+                        ring.close()
+                    ring = SharedFrameRing.create(frame.shape, slots)
+                    ctrl.put((name, direction, ring.name))
+                ring.write(frame)
+            except Exception as e:
+                print(f"⚠️ reader process exception {name}/{direction}: {e}")
+                try:
+                    if cap:
+                        cap.release()
+                except Exception:
+                    pass
+                cap = None
+                time.sleep(0.5)
+    finally:
+        try:
+            if cap:
+                cap.release()
+        except Exception:
+            pass
+        if ring is not None:
+            ring.close()
@@ -0,0 +1,307 @@
+# backend/cluster.py
+from __future__ import annotations
+
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from backend import config, metrics
+from backend.logger import log
+
+# -----------------------
+# Несколько узлов ALPR: владение точками через аренды
+# -----------------------
+# Узлы делят общий SQLite-файл (cluster.db на общем диске или локальная
+# заглушка для одного хоста). Каждая точка из points арендуется одним узлом
+# на CLUSTER_LEASE_TTL секунд; владелец продлевает аренду каждые
+# CLUSTER_HEARTBEAT секунд. Упавший узел перестаёт продлевать — по истечении
+# аренды его точки забирают остальные. Доля узла — ceil(точек * вес / сумма
+# весов живых узлов): новый узел получает точки за счёт того, что перегруженные
+# отпускают лишнее.
+#
+# Событие обрабатывает только владелец точки (owns()), поэтому история и
+# события пишутся один раз. Локально аренда считается действующей на один
+# такт продления меньше, чем в базе: узел перестаёт писать раньше, чем точку
+# может забрать другой (при расхождении часов узлов меньше CLUSTER_HEARTBEAT).
+# Журнал SQLite — DELETE, а не WAL: WAL не работает на сетевых дисках.
+# Список точек у каждого узла свой (локальная base.db), поэтому по нему узел
+# трогает только свои аренды: чужие, даже на неизвестные ему точки, истекают
+# сами. Пока список точек ни разу не прочитан, такт не выполняется.
+
+_lock = threading.Lock()
+_owned: dict[str, float] = {}       # точка -> monotonic, до которого аренда действительна локально
+_leader_until = 0.0                 # узел отвечает за кадры без известной точки
+_subscribers: list = []
+_thread: threading.Thread | None = None
+_stop_evt = threading.Event()
+_conn: sqlite3.Connection | None = None
+_points_provider = None
+_last_points: list[str] = []
+_points_read = False                # список точек прочитан хотя бы раз
+
+NODE_ID = config.CLUSTER_NODE_ID or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def enabled() -> bool:
+    return config.CLUSTER_ENABLED
+
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(config.CLUSTER_DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(config.CLUSTER_DB_PATH, timeout=10.0, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=DELETE;")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS nodes(
+          node_id      TEXT PRIMARY KEY,
+          host         TEXT,
+          pid          INTEGER,
+          weight       REAL NOT NULL DEFAULT 1,
+          started_ts   REAL NOT NULL,
+          heartbeat_ts REAL NOT NULL
+        );
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leases(
+          point       TEXT PRIMARY KEY,
+          node_id     TEXT,
+          epoch       INTEGER NOT NULL DEFAULT 0,
+          acquired_ts REAL,
+          expires_ts  REAL NOT NULL DEFAULT 0
+        );
+        """
+    )
+    return conn
+
+
+def _points_from_base_db() -> list[str]:
+    """
+    Точки из base.db веб-админки (таблица points).
+    """
+    conn = sqlite3.connect(config.DB_BASE_PATH, timeout=5.0)
+    try:
+        return sorted({r[0] for r in conn.execute("SELECT name FROM points") if r[0]})
+    finally:
+        conn.close()
+
+
+# -----------------------
+# Такт: пульс, продление, балансировка
+# -----------------------
+def _tick(conn: sqlite3.Connection, points: list[str]) -> tuple[set[str], bool]:
+    """
+    Одна транзакция BEGIN IMMEDIATE: пульс узла, продление своих аренд,
+    отдача лишнего сверх доли и захват свободных/просроченных точек.
+    Возвращает (свои точки, лидер ли узел).
+    """
+    now = time.time()
+    ttl = config.CLUSTER_LEASE_TTL
+    weight = max(0.0, float(config.CLUSTER_WEIGHT))
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            """
+            INSERT INTO nodes(node_id, host, pid, weight, started_ts, heartbeat_ts) VALUES(?, ?, ?, ?, ?, ?)
+            ON CONFLICT(node_id) DO UPDATE SET weight=excluded.weight, heartbeat_ts=excluded.heartbeat_ts
+            """,
+            (NODE_ID, socket.gethostname(), os.getpid(), weight, now, now),
+        )
+        conn.execute("DELETE FROM nodes WHERE heartbeat_ts < ?", (now - 10 * ttl,))
+        live = conn.execute(
+            "SELECT node_id, weight FROM nodes WHERE heartbeat_ts >= ? ORDER BY node_id", (now - ttl,)
+        ).fetchall()
+        total_w = sum(w for _, w in live) or 1.0
+        share = math.ceil(len(points) * weight / total_w) if weight > 0 else 0
+
+        # удалённых (по локальному списку) точек узел не держит — но отпускает только свои аренды;
+        # строки, которые никто не продлевал 10 TTL, убираются по времени, а не по списку
+        marks = ",".join("?" * len(points))
+        conn.execute(
+            f"UPDATE leases SET node_id=NULL, expires_ts=0 WHERE node_id=? AND point NOT IN ({marks})",
+            [NODE_ID] + list(points),
+        )
+        conn.execute("DELETE FROM leases WHERE expires_ts < ?", (now - 10 * ttl,))
+
+        conn.execute("UPDATE leases SET expires_ts=? WHERE node_id=? AND expires_ts >= ?", (now + ttl, NODE_ID, now))
+        mine = sorted(r[0] for r in conn.execute(
+            "SELECT point FROM leases WHERE node_id=? AND expires_ts >= ?", (NODE_ID, now)
+        ))
+
+        # ребалансировка: лишнее отдаём (за такт — не больше излишка)
+        while len(mine) > share:
+            conn.execute("UPDATE leases SET node_id=NULL, expires_ts=0 WHERE point=? AND node_id=?", (mine.pop(), NODE_ID))
+
+        if len(mine) < share:
+            held = {r[0] for r in conn.execute(
+                "SELECT point FROM leases WHERE node_id IS NOT NULL AND expires_ts >= ?", (now,)
+            )}
+            for p in points:
+                if len(mine) >= share:
+                    break
+                if p in held or p in mine:
+                    continue
+                conn.execute("INSERT OR IGNORE INTO leases(point, expires_ts) VALUES(?, 0)", (p,))
+                cur = conn.execute(
+                    """
+                    UPDATE leases SET node_id=?, epoch=epoch + 1, acquired_ts=?, expires_ts=?
+                    WHERE point=? AND (node_id IS NULL OR expires_ts < ?)
+                    """,
+                    (NODE_ID, now, now + ttl, p, now),
+                )
+                if cur.rowcount == 1:
+                    mine.append(p)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    leader = bool(live) and live[0][0] == NODE_ID
+    return set(mine), leader
+
+
+def _run() -> None:
+    global _conn, _last_points, _leader_until, _points_read
+    while not _stop_evt.is_set():
+        t0 = time.monotonic()
+        try:
+            try:
+                _last_points = list(_points_provider())
+                _points_read = True
+            except Exception as e:
+                # дальше работаем по прошлому списку; без него такт пропускаем —
+                # пустой список отпустил бы все аренды узла
+                log(f"⚠️ Кластер: не удалось прочитать список точек: {e}", debug=_points_read)
+                if not _points_read:
+                    _stop_evt.wait(config.CLUSTER_HEARTBEAT)
+                    continue
+            if _conn is None:
+                _conn = _connect()
+            mine, leader = _tick(_conn, _last_points)
+        except Exception as e:
+            # без продления аренды истекут сами — точки заберут другие узлы
+            log(f"⚠️ Кластер: ошибка такта аренды: {e}")
+            try:
+                if _conn is not None:
+                    _conn.close()
+            except Exception:
+                pass
+            _conn = None
+        else:
+            valid_until = t0 + config.CLUSTER_LEASE_TTL - config.CLUSTER_HEARTBEAT
+            with _lock:
+                before = {p for p, t in _owned.items() if t > t0}
+                _owned.clear()
+                _owned.update({p: valid_until for p in mine})
+                _leader_until = valid_until if leader else 0.0
+            acquired, lost = mine - before, before - mine
+            if acquired or lost:
+                log(f"🧭 Кластер {NODE_ID}: точки {sorted(mine)} (+{sorted(acquired)} −{sorted(lost)})")
+                for cb in list(_subscribers):
+                    try:
+                        cb(set(mine), acquired, lost)
+                    except Exception as e:
+                        log(f"⚠️ Кластер: ошибка обработчика смены точек: {e}")
+        _stop_evt.wait(max(0.1, config.CLUSTER_HEARTBEAT - (time.monotonic() - t0)))
+
+
+# -----------------------
+# Публичные функции
+# -----------------------
+def start(points_provider=None) -> None:
+    """
+    Запускает поток аренд (только при cluster.enabled). points_provider() — список
+    имён точек; по умолчанию читается таблица points из base.db.
+    """
+    global _thread, _points_provider
+    if not enabled() or (_thread is not None and _thread.is_alive()):
+        return
+    _points_provider = points_provider or _points_from_base_db
+    _stop_evt.clear()
+    _thread = threading.Thread(target=_run, name="cluster-leases", daemon=True)
+    _thread.start()
+    log(f"🧭 Кластер: узел {NODE_ID}, аренда {config.CLUSTER_LEASE_TTL:.0f} с, общий файл {config.CLUSTER_DB_PATH}")
+
+
+def stop(release: bool = True) -> None:
+    """
+    Останавливает продление; release=True — сразу отдаёт аренды, чтобы точки
+    подхватили без ожидания TTL.
+    """
+    global _conn, _leader_until
+    _stop_evt.set()
+    if _thread is not None:
+        _thread.join(timeout=config.CLUSTER_HEARTBEAT + 1)
+    with _lock:
+        _owned.clear()
+        _leader_until = 0.0
+    if release and enabled():
+        try:
+            conn = _conn or _connect()
+            conn.execute("UPDATE leases SET node_id=NULL, expires_ts=0 WHERE node_id=?", (NODE_ID,))
+            conn.execute("DELETE FROM nodes WHERE node_id=?", (NODE_ID,))
+            conn.close()
+        except Exception as e:
+            log(f"⚠️ Кластер: не удалось отдать аренды: {e}")
+    _conn = None
+
+
+def subscribe(callback) -> None:
+    """
+    callback(owned, acquired, lost) — после такта, в котором набор точек узла изменился.
+    """
+    _subscribers.append(callback)
+
+
+def owns(point: str | None) -> bool:
+    """
+    Обрабатывает ли этот узел события точки. Без кластера — всегда True.
+    Кадры неизвестной точки (не из points) обрабатывает узел-лидер.
+    """
+    if not enabled():
+        return True
+    now = time.monotonic()
+    with _lock:
+        if point in _owned:
+            return _owned[point] > now
+        return point not in _last_points and _leader_until > now
+
+
+def owned_points() -> list[str]:
+    now = time.monotonic()
+    with _lock:
+        return sorted(p for p, t in _owned.items() if t > now)
+
+
+def status() -> dict:
+    """
+    Узлы и аренды из общего файла (для /api/cluster), плюс взгляд этого процесса.
+    """
+    if not enabled():
+        return {"enabled": False}
+    now = time.time()
+    conn = _connect()
+    try:
+        nodes = [
+            {"node_id": n, "host": h, "pid": pid, "weight": w, "started_ts": st,
+             "heartbeat_age_s": round(now - hb, 1), "alive": now - hb <= config.CLUSTER_LEASE_TTL}
+            for n, h, pid, w, st, hb in conn.execute(
+                "SELECT node_id, host, pid, weight, started_ts, heartbeat_ts FROM nodes ORDER BY node_id"
+            )
+        ]
+        leases = [
+            {"point": p, "node_id": n if exp >= now else None, "epoch": ep,
+             "acquired_ts": acq, "expires_in_s": round(exp - now, 1) if exp >= now else None}
+            for p, n, ep, acq, exp in conn.execute(
+                "SELECT point, node_id, epoch, acquired_ts, expires_ts FROM leases ORDER BY point"
+            )
+        ]
+    finally:
+        conn.close()
+    return {"enabled": True, "node_id": NODE_ID, "owned": owned_points(), "nodes": nodes, "leases": leases}
+
+
+metrics.register_gauge("alpr_cluster_owned_points", "Points leased by this node", lambda: len(owned_points()))
@@ -2,9 +2,9 @@
 from __future__ import annotations
 import os
 import json
+import threading
 from pathlib import Path
 from urllib.parse import urlparse
-import torch
 
 # -----------------------
 # Корневой каталог
@@ -36,24 +36,7 @@ def _load_settings() -> dict:
 SETTINGS = _load_settings()
 
 # -----------------------
-# Флаги и параметры
-# -----------------------
-DEBUG_MODE = bool(SETTINGS.get("debug", False))
-
-CAPTURE_INTERVAL = float(SETTINGS.get("capture_interval", 2.0))
-CPAI_MIN_INTERVAL = float(SETTINGS.get("cpai_min_interval", 3.0))
-
-# -----------------------
-# MQTT
-# -----------------------
-MQTT_BROKER = SETTINGS.get("mqtt", {}).get("host", "192.168.12.2")
-MQTT_PORT = int(SETTINGS.get("mqtt", {}).get("port", 1883))
-MQTT_USER = SETTINGS.get("mqtt", {}).get("user") or None
-MQTT_PASS = SETTINGS.get("mqtt", {}).get("password") or None
-TOPIC_PREFIX = SETTINGS.get("mqtt", {}).get("base_topic", "ALPR")
-
-# -----------------------
-# Пути к данным
+# Вспомогательные
 # -----------------------
 
 def _resolve_path(value: str | None, default_path: str) -> str:
@@ -62,14 +45,6 @@ def _resolve_path(value: str | None, default_path: str) -> str:
     p = Path(value)
     return str(p if p.is_absolute() else (ROOT_DIR / p))
 
-SNAPSHOT_DIR = _resolve_path(
-    SETTINGS.get("paths", {}).get("snapshots") if SETTINGS.get("paths") else None,
-    SNAPSHOT_DIR_DEFAULT,
-)
-
-# -----------------------
-# CPAI URL
-# -----------------------
 
 def _cpai_url_from_settings(s: dict, fallback: str = "http://192.168.12.11:32168/v1/vision/alpr") -> str:
     cp = (s or {}).get("cpai", {}) if isinstance(s, dict) else {}
@@ -91,11 +66,236 @@ def _cpai_url_from_settings(s: dict, fallback: str = "http://192.168.12.11:32168
         port = 32168
     return f"http://{host}:{port}/v1/vision/alpr"
 
-CPAI_URL = _cpai_url_from_settings(SETTINGS)
+
+def _derive(SETTINGS: dict) -> dict:
+    """
+    Все параметры, вычисляемые из settings.json. Вызывается при импорте и при
+    reload(): модульные константы ниже — её результат.
+    """
+    # -----------------------
+    # Флаги и параметры
+    # -----------------------
+    DEBUG_MODE = bool(SETTINGS.get("debug", False))
+
+    # Лог: ротация по размеру (МБ) или по времени ("midnight", "H", ...), число архивов
+    LOG_MAX_MB = float(SETTINGS.get("log", {}).get("max_mb", 10))
+    LOG_BACKUPS = int(SETTINGS.get("log", {}).get("backups", 5))
+    LOG_ROTATE_WHEN = SETTINGS.get("log", {}).get("rotate_when") or None
+    # Одинаковые сообщения подряд схлопываются; сводка «повторилось N раз» — не реже, чем раз в N сек
+    LOG_REPEAT_SUMMARY_S = float(SETTINGS.get("log", {}).get("repeat_summary_s", 60))
+    # Сколько последних строк держать в памяти для /api/log и потока /api/log/stream
+    LOG_RING_LINES = int(SETTINGS.get("log", {}).get("ring_lines", 5000))
+    # Сколько завершённых трасс событий (кадр → ворота) держать в памяти для /api/trace
+    TRACE_RING_SIZE = int(SETTINGS.get("trace", {}).get("ring_size", 2000))
+    # Бюджет холодного старта (импорт + инициализация), мс — для python -m backend.startup_profile
+    STARTUP_BUDGET_MS = float(SETTINGS.get("startup", {}).get("budget_ms", 2000))
+
+    CAPTURE_INTERVAL = float(SETTINGS.get("capture_interval", 2.0))
+    CPAI_MIN_INTERVAL = float(SETTINGS.get("cpai_min_interval", 3.0))
+
+    # Окно (сек), в котором повтор (точка, номер) не пишется в history повторно
+    HISTORY_DEDUP_WINDOW = float(SETTINGS.get("history_dedup_window", 30.0))
+    # Въезд без выезда дольше N сек (выезд не прочитан) закрывается визитом missed_out; 0 — не закрывать
+    PRESENCE_TTL = float(SETTINGS.get("visits", {}).get("presence_ttl_s", 7 * 86400))
+
+    # Захват RTSP: "thread" — потоки в этом процессе, "process" — процесс на камеру
+    # с передачей кадров через shared memory (backend/capture_proc.py); слотов в кольце
+    CAPTURE_MODE = str(SETTINGS.get("capture", {}).get("mode", "thread"))
+    CAPTURE_RING_SLOTS = int(SETTINGS.get("capture", {}).get("ring_slots", 4))
+
+    # Несколько узлов ALPR (backend/cluster.py): точки делятся арендами в общем SQLite-файле.
+    # node_id по умолчанию — host-pid; weight — относительная ёмкость узла (0 — не брать точки)
+    CLUSTER_ENABLED = bool(SETTINGS.get("cluster", {}).get("enabled", False))
+    CLUSTER_DB_PATH = _resolve_path(SETTINGS.get("cluster", {}).get("db"), str(ROOT_DIR / "cluster.db"))
+    CLUSTER_NODE_ID = SETTINGS.get("cluster", {}).get("node_id") or None
+    CLUSTER_LEASE_TTL = float(SETTINGS.get("cluster", {}).get("lease_ttl_s", 15))
+    CLUSTER_HEARTBEAT = float(SETTINGS.get("cluster", {}).get("heartbeat_s", 5))
+    CLUSTER_WEIGHT = float(SETTINGS.get("cluster", {}).get("weight", 1.0))
+
+    # Трекер машин (backend/tracker.py): одно событие на проезд вместо дедупликации по времени.
+    # max_age — сек без чтений до потери трека; iou_min/sim_min — пороги связывания
+    # (sim_min_iou — похожесть номера, если совпала рамка); событие сразу — при
+    # confidence ≥ confirm_conf или confirm_hits одинаковых чтениях, иначе при потере трека,
+    # но не позже emit_wait_s от первого чтения
+    TRACKER_ENABLED = bool(SETTINGS.get("tracker", {}).get("enabled", True))
+    TRACKER_MAX_AGE = float(SETTINGS.get("tracker", {}).get("max_age_s", 2.0))
+    TRACKER_IOU_MIN = float(SETTINGS.get("tracker", {}).get("iou_min", 0.2))
+    TRACKER_SIM_MIN = float(SETTINGS.get("tracker", {}).get("sim_min", 0.75))
+    TRACKER_SIM_MIN_IOU = float(SETTINGS.get("tracker", {}).get("sim_min_iou", 0.5))
+    TRACKER_MAX_JUMP = float(SETTINGS.get("tracker", {}).get("max_jump", 4.0))
+    TRACKER_CONFIRM_CONF = float(SETTINGS.get("tracker", {}).get("confirm_conf", 0.8))
+    TRACKER_CONFIRM_HITS = int(SETTINGS.get("tracker", {}).get("confirm_hits", 2))
+    TRACKER_EMIT_WAIT = float(SETTINGS.get("tracker", {}).get("emit_wait_s", 3.0))
+    # Пока на точке только подтверждённые треки — кадр на CPAI не чаще раза в N сек
+    TRACKER_CONFIRMED_INTERVAL = float(SETTINGS.get("tracker", {}).get("confirmed_interval_s", 1.0))
+    # Направление по линии точки: мин. смещение поперёк линии (пикс.) и сколько ждать направления, сек
+    TRACKER_DIRECTION_MIN_PX = float(SETTINGS.get("tracker", {}).get("direction_min_px", 20))
+    TRACKER_DIRECTION_WAIT = float(SETTINGS.get("tracker", {}).get("direction_wait_s", 1.0))
+
+    # Кропы и миниатюры событий (backend/evidence.py): поля вокруг номера — в ширинах рамки,
+    # максимальная сторона кропа/миниатюры (пикс.), качество JPEG
+    EVIDENCE_ENABLED = bool(SETTINGS.get("evidence", {}).get("enabled", True))
+    EVIDENCE_DIR = _resolve_path(SETTINGS.get("paths", {}).get("evidence") if SETTINGS.get("paths") else None,
+                                 str(ROOT_DIR / "evidence"))
+    EVIDENCE_MARGIN = float(SETTINGS.get("evidence", {}).get("margin", 1.5))
+    EVIDENCE_CROP_MAX = int(SETTINGS.get("evidence", {}).get("crop_max", 480))
+    EVIDENCE_THUMB_MAX = int(SETTINGS.get("evidence", {}).get("thumb_max", 160))
+    EVIDENCE_JPEG_QUALITY = int(SETTINGS.get("evidence", {}).get("jpeg_quality", 80))
+
+    # Номера под наблюдением (backend/watchlist.py): шаблоны из base.db проверяются на каждом
+    # распознанном номере; совпадение публикуется в <prefix>/<topic> не чаще раза в cooldown_s
+    # на (точку, шаблон, номер). confusables — группы символов, которые OCR путает между собой
+    WATCHLIST_ENABLED = bool(SETTINGS.get("watchlist", {}).get("enabled", True))
+    WATCHLIST_TOPIC = SETTINGS.get("watchlist", {}).get("topic", "watchlist")
+    WATCHLIST_COOLDOWN = float(SETTINGS.get("watchlist", {}).get("cooldown_s", 60))
+    WATCHLIST_CONFUSABLES = list(SETTINGS.get("watchlist", {}).get("confusables")
+                                 or ["0О", "3З", "8В", "4А", "17Т"])
+
+    # Пакетный препроцессинг кадров (backend/preprocess.py); применяется без перезапуска.
+    # use_torch_gpu_prep — считать на torch (GPU, если есть); сам torch импортируется лениво
+    USE_TORCH_GPU_PREP = bool(SETTINGS.get("use_torch_gpu_prep", False))
+    PREP_WIDTH = int(SETTINGS.get("preprocess", {}).get("width", 640))
+    PREP_HEIGHT = int(SETTINGS.get("preprocess", {}).get("height", 360))
+    PREP_GRAY = bool(SETTINGS.get("preprocess", {}).get("gray", False))
+    PREP_DENOISE = bool(SETTINGS.get("preprocess", {}).get("denoise", False))
+    PREP_CLAHE = bool(SETTINGS.get("preprocess", {}).get("clahe", False))
+    PREP_CLAHE_CLIP = float(SETTINGS.get("preprocess", {}).get("clahe_clip", 2.0))
+
+    # -----------------------
+    # MQTT
+    # -----------------------
+    MQTT_BROKER = SETTINGS.get("mqtt", {}).get("host", "192.168.12.2")
+    MQTT_PORT = int(SETTINGS.get("mqtt", {}).get("port", 1883))
+    MQTT_USER = SETTINGS.get("mqtt", {}).get("user") or None
+    MQTT_PASS = SETTINGS.get("mqtt", {}).get("password") or None
+    TOPIC_PREFIX = SETTINGS.get("mqtt", {}).get("base_topic", "ALPR")
+    # Входящие топики (относительно TOPIC_PREFIX). Собственные публикации (plates и т.п.) сюда не входят.
+    MQTT_SUBSCRIBE = list(SETTINGS.get("mqtt", {}).get("subscribe") or ["snapshot", "+/snapshot"])
+    # Очередь входящих сообщений на каждого обработчика и число обработчиков
+    MQTT_QUEUE_SIZE = int(SETTINGS.get("mqtt", {}).get("queue_size", 64))
+    MQTT_WORKERS = int(SETTINGS.get("cpai_workers", 4))
+    # Исходящие: QoS, очередь в памяти, дисковый спул на время обрыва и скорость его досылки (сообщ./сек)
+    MQTT_QOS = int(SETTINGS.get("mqtt", {}).get("qos", 1))
+    MQTT_OUT_QUEUE_SIZE = int(SETTINGS.get("mqtt", {}).get("out_queue_size", 1000))
+    MQTT_SPOOL_PATH = str(ROOT_DIR / "mqtt_spool.jsonl")
+    MQTT_SPOOL_MAX_MB = float(SETTINGS.get("mqtt", {}).get("spool_max_mb", 100))
+    MQTT_REPLAY_RATE = float(SETTINGS.get("mqtt", {}).get("replay_rate", 50))
+
+    # -----------------------
+    # Пути к данным
+    # -----------------------
+    SNAPSHOT_DIR = _resolve_path(
+        SETTINGS.get("paths", {}).get("snapshots") if SETTINGS.get("paths") else None,
+        SNAPSHOT_DIR_DEFAULT,
+    )
+
+    # base.db веб-админки (people, points, access_rules)
+    DB_BASE_PATH = _resolve_path(
+        SETTINGS.get("paths", {}).get("base_db") if SETTINGS.get("paths") else None,
+        str(ROOT_DIR / "base.db"),
+    )
+
+    # -----------------------
+    # CPAI URL
+    # -----------------------
+    CPAI_URL = _cpai_url_from_settings(SETTINGS)
+
+    return {k: v for k, v in locals().items() if k.isupper() and k != "SETTINGS"}
+
+
+globals().update(_derive(SETTINGS))
+
+# -----------------------
+# Живая перезагрузка: версия + подписки
+# -----------------------
+# Кому нужно актуальное значение на каждом вызове — читает через модуль
+# (config.CPAI_URL), а не через from-import. Компоненты с состоянием (клиент
+# CPAI, MQTT-клиент, логгер) подписываются на свои ключи и пересобираются
+# только при их изменении; остальные продолжают работать без перерыва.
+
+# Применяются только при старте (размеры очередей, файл лога и т.п.)
+RESTART_REQUIRED = frozenset({
+    "LOG_MAX_MB", "LOG_BACKUPS", "LOG_ROTATE_WHEN", "LOG_REPEAT_SUMMARY_S", "LOG_RING_LINES",
+    "TRACE_RING_SIZE", "MQTT_QUEUE_SIZE", "MQTT_WORKERS", "MQTT_OUT_QUEUE_SIZE",
+    "MQTT_SPOOL_MAX_MB", "MQTT_REPLAY_RATE", "CAPTURE_MODE", "CAPTURE_RING_SLOTS",
+    "CLUSTER_ENABLED", "CLUSTER_DB_PATH", "CLUSTER_NODE_ID",
+})
+
+VERSION = 1
+_subscribers: list[tuple[frozenset, object]] = []
+_reload_lock = threading.Lock()
+
+
+def subscribe(keys, callback) -> None:
+    """
+    callback(changed) вызывается после reload(), если изменился хотя бы один
+    из keys; changed = {ключ: (старое, новое)} только по этим ключам.
+    """
+    with _reload_lock:
+        _subscribers.append((frozenset(keys), callback))
+
+
+def reload() -> dict:
+    """
+    Перечитывает settings.json, обновляет константы модуля и уведомляет
+    подписчиков изменившихся ключей. Возвращает версию и списки изменений.
+    """
+    global SETTINGS, VERSION
+    with _reload_lock:
+        new_settings = _load_settings()
+        fresh = _derive(new_settings)
+        g = globals()
+        changed = {k: (g.get(k), v) for k, v in fresh.items() if g.get(k) != v}
+        SETTINGS = new_settings
+        if changed:
+            g.update(fresh)
+            VERSION += 1
+        subs = list(_subscribers)
+
+    for keys, cb in subs:
+        part = {k: changed[k] for k in keys if k in changed}
+        if not part:
+            continue
+        try:
+            cb(part)
+        except Exception as e:
+            # logger сам импортирует config — здесь только print
+            print(f"⚠️ config: не удалось применить {sorted(part)}: {e}")
+
+    return {
+        "version": VERSION,
+        "changed": sorted(changed),
+        "restart_required": sorted(k for k in changed if k in RESTART_REQUIRED),
+    }
 
 # -----------------------
 # Torch / GPU
 # -----------------------
-USE_TORCH_GPU_PREP = bool(SETTINGS.get("use_torch_gpu_prep", False))
-TORCH_AVAILABLE = torch.cuda.is_available()
-DEVICE = torch.device("cuda" if TORCH_AVAILABLE else "cpu")
+# torch импортируется только при первом обращении к TORCH_AVAILABLE / DEVICE:
+# сам импорт занимает секунды и сотни МБ, а нужен он лишь препроцессингу
+# (USE_TORCH_GPU_PREP — в _derive).
+
+_torch_probe: tuple[bool, object] | None = None
+_torch_lock = threading.Lock()
+
+
+def _probe_torch() -> tuple[bool, object]:
+    global _torch_probe
+    with _torch_lock:
+        if _torch_probe is None:
+            try:
+                import torch
+                available = torch.cuda.is_available()
+                _torch_probe = (available, torch.device("cuda" if available else "cpu"))
+            except ImportError:
+                _torch_probe = (False, "cpu")
+        return _torch_probe
+
+
+def __getattr__(name: str):
+    # PEP 562: и config.DEVICE, и from backend.config import DEVICE попадают сюда
+    if name == "TORCH_AVAILABLE":
+        return _probe_torch()[0]
+    if name == "DEVICE":
+        return _probe_torch()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -7,10 +7,7 @@ import threading
 import requests
 
 from backend.logger import log
-from backend.text_utils import normalize_text
-from backend.db import add_history_record, get_plate_from_db
-from backend.gates import open_gate, can_open_gate, send_open_command
-from backend.config import CPAI_URL
+from backend import config, metrics, tracing
 import backend.state as state  # чтобы менять флаги статуса
 
 
@@ -24,14 +21,26 @@ class CPAIClient:
     {
       "ok": bool,
       "plate": str | None,  # сырая строка от CPAI (до normalize_text)
-      "err": str | None
+      "err": str | None,
+      "confidence": float | None,           # первого (основного) номера
+      "bbox": [x1, y1, x2, y2] | None,
+      "detections": [{"plate", "confidence", "bbox"}, ...]  # все номера кадра
     }
     """
     def __init__(self, base_url: str | None = None):
-        self.base_url = base_url or CPAI_URL
+        self.base_url = base_url or config.CPAI_URL
         self._http = requests.Session()
 
-    def recognize_plate(self, image_bytes: bytes) -> dict:
+    def recognize_plate(self, image_bytes: bytes | memoryview) -> dict:
+        """
+        image_bytes может быть memoryview над payload MQTT — requests/urllib3
+        пишут его в multipart-тело напрямую, без промежуточной копии.
+        """
+        with tracing.span("cpai"):
+            return self._recognize(image_bytes)
+
+    def _recognize(self, image_bytes: bytes | memoryview) -> dict:
+        t0 = time.perf_counter()
         try:
             resp = self._http.post(
                 self.base_url,
@@ -39,7 +48,8 @@ class CPAIClient:
                 timeout=6,
             )
             if resp.status_code != 200:
-                state.CPAI_CONNECTED = False
+                metrics.CPAI_SECONDS.observe(time.perf_counter() - t0, outcome="http_error")
+                state.set_cpai_connected(False)
                 return {"ok": False, "plate": None, "err": f"HTTP {resp.status_code}"}
 
             # CodeProject.AI возвращает разные ключи в разных версиях
@@ -51,20 +61,41 @@ class CPAIClient:
                 data = {}
             preds = data.get("predictions", []) or data.get("results", []) or []
 
-            state.CPAI_CONNECTED = True
+            metrics.CPAI_SECONDS.observe(time.perf_counter() - t0, outcome="ok")
+            state.set_cpai_connected(True)
 
             if not preds:
-                return {"ok": True, "plate": None, "err": None}
+                return {"ok": True, "plate": None, "err": None, "detections": []}
 
-            p = preds[0] if isinstance(preds, list) else preds
-            plate_raw = (p.get("plate") or p.get("text") or "").strip()
-            return {"ok": True, "plate": plate_raw or None, "err": None}
+            dets = [d for d in map(_detection, preds if isinstance(preds, list) else [preds]) if d]
+            first = dets[0] if dets else {}
+            return {"ok": True, "plate": first.get("plate"), "err": None,
+                    "confidence": first.get("confidence"), "bbox": first.get("bbox"), "detections": dets}
 
         except Exception as e:
-            state.CPAI_CONNECTED = False
+            metrics.CPAI_SECONDS.observe(time.perf_counter() - t0, outcome="error")
+            state.set_cpai_connected(False)
             return {"ok": False, "plate": None, "err": str(e)}
 
 
+def _detection(p: dict) -> dict | None:
+    """
+    Предсказание CPAI -> {"plate", "confidence", "bbox"}; рамка — для трекера.
+    """
+    plate_raw = (p.get("plate") or p.get("text") or "").strip()
+    if not plate_raw:
+        return None
+    try:
+        conf = float(p["confidence"]) if p.get("confidence") is not None else None
+    except (TypeError, ValueError):
+        conf = None
+    try:
+        bbox = [float(p[k]) for k in ("x_min", "y_min", "x_max", "y_max")]
+    except (KeyError, TypeError, ValueError):
+        bbox = None
+    return {"plate": plate_raw, "confidence": conf, "bbox": bbox}
+
+
 # -----------------------
 # Функции-обёртки для совместимости со старым кодом
 # -----------------------
@@ -76,80 +107,77 @@ def recognize_plate_bytes(img_bytes: bytes) -> dict:
     return client.recognize_plate(img_bytes)
 
 
+_shared_client: CPAIClient | None = None
+
+
+def _on_cpai_url_changed(changed: dict) -> None:
+    """
+    Новый адрес CPAI: общий клиент пересоздаётся, запросы в полёте дорабатывают на старом сеансе.
+    """
+    global _shared_client
+    _shared_client = CPAIClient(changed["CPAI_URL"][1])
+    log(f"🔁 CPAI: новый адрес {_shared_client.base_url}")
+
+
+config.subscribe(("CPAI_URL",), _on_cpai_url_changed)
+
+
+def send_to_cpai(image: str | bytes | memoryview) -> list[str]:
+    """
+    Распознаёт кадр (путь к файлу или JPEG в памяти) через общий HTTP-сеанс.
+    Возвращает список сырых номеров; при ошибке CPAI бросает RuntimeError.
+    """
+    return [d["plate"] for d in detect_plates(image)]
+
+
+def detect_plates(image: str | bytes | memoryview) -> list[dict]:
+    """
+    Как send_to_cpai, но с уверенностью и рамкой: [{"plate", "confidence", "bbox"}, ...].
+    """
+    global _shared_client
+    client = _shared_client
+    if client is None:
+        client = _shared_client = CPAIClient()
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            image = f.read()
+    res = client.recognize_plate(image)
+    if not res.get("ok"):
+        raise RuntimeError(res.get("err") or "unknown")
+    if "detections" in res:
+        return res["detections"]
+    return [{"plate": res["plate"], "confidence": res.get("confidence"), "bbox": res.get("bbox")}] if res.get("plate") else []
+
+
 def handle_cpai_result(
     res: dict,
     point_name: str,
     direction: str | None = None,
     client=None,
     mqtt_open_topic: str | None = None,
+    capture_ts: float | None = None,
+    image=None,
 ) -> None:
     """
-    Унифицированная обработка результата CPAI:
-    - логирование ошибок;
-    - нормализация номера;
-    - дорешивание региона при необходимости через people.db (совместимость со старым get_plate_from_db);
-    - кэширование «увиденных» номеров;
-    - запись в history.db;
-    - публикация номера в MQTT (если передан клиент);
-    - проверка и открытие ворот (локально + опционально MQTT open-команда).
+    Результат CPAI → общий конвейер номера (processing.handle_recognized_plate):
+    нормализация, трекер, ворота, история, публикация, кроп события.
 
     Параметры:
-      client — paho.mqtt клиент (опционально)
+      direction — направление камеры (IN/OUT), если трекер не определил его по линии точки
+      client — paho.mqtt клиент для OPEN-команды (опционально)
       mqtt_open_topic — топик для OPEN-команды (если нужен MQTT-триггер открытия)
+      capture_ts — время захвата кадра, для замера латентности «кадр → OPEN»
+      image — распознанный кадр (ndarray BGR или JPEG) для кропа события
     """
+    from backend import processing
+
     if not res or not res.get("ok"):
         log(f"❌ CPAI ошибка: {res.get('err') if res else 'unknown'}")
         return
-
-    plate_raw = res.get("plate")
-    if not plate_raw:
+    if not res.get("plate"):
         log(f"⚠️ CPAI не вернул номер для {point_name}")
         return
-
-    # Нормализуем (латиница→кириллица, удаление мусора)
-    normalized = normalize_text(plate_raw)
-
-    # Если регион не распознан, попробуем достроить по базе
-    # Пример: ABC123 -> в БД есть ABC12377 -> тогда используем её
-    full_plate = normalized
-    from backend.text_utils import parse_plate_parts
-    base, region = parse_plate_parts(normalized)
-    if base and not region:
-        from_db = get_plate_from_db(base)
-        if from_db:
-            full_plate = from_db
-
-    # Обновляем кэш «увиденных» номеров
-    with state.seen_plates_lock:
-        if point_name not in state.seen_plates:
-            state.seen_plates[point_name] = {}
-        state.seen_plates[point_name][full_plate] = time.time()
-
-    log(f"✅ Новый номер {full_plate} на точке {point_name}{(' / ' + direction) if direction else ''}")
-
-    # История
-    try:
-        add_history_record(full_plate, point_name)
-    except Exception as e:
-        log(f"⚠️ Ошибка записи в history: {e}", debug=True)
-
-    # Публикация номера в MQTT (совместимо с processing.process_camera)
-    if client:
-        try:
-            topic = f"{point_name}/plate"  # так делает processing.py
-            client.publish(topic, full_plate)
-        except Exception as e:
-            log(f"⚠️ Ошибка публикации MQTT (plate): {e}", debug=True)
-
-    # Открываем ворота, если можно
-    try:
-        if can_open_gate(point_name):
-            open_gate(point_name)
-            # При необходимости — отправка OPEN в MQTT (если дан топик)
-            if client and mqtt_open_topic:
-                try:
-                    send_open_command(client, mqtt_open_topic, point_name)
-                except Exception as e:
-                    log(f"⚠️ Ошибка публикации MQTT (open): {e}", debug=True)
-    except Exception as e:
-        log(f"⚠️ Ошибка логики ворот: {e}", debug=True)
+    processing.handle_recognized_plate(
+        point_name, res["plate"], capture_ts=capture_ts, confidence=res.get("confidence"), bbox=res.get("bbox"),
+        image=image, direction=direction, client=client, open_topic=mqtt_open_topic,
+    )
@@ -7,8 +7,10 @@ import threading
 import time
 from typing import Optional, Dict, Any, Tuple
 
+from backend import config
 from backend.config import DB_HISTORY_PATH, DB_PEOPLE_PATH
 from backend.logger import log
+from backend import metrics
 
 # -----------------------
 # Соединения с БД (ленивые, потокобезопасно)
@@ -64,7 +66,8 @@ def _get_people_conn() -> sqlite3.Connection:
 def _init_history_db(conn: sqlite3.Connection) -> None:
     """
     Таблицы:
-      history(id, plate, point, ts)
+      history(id, plate, point, ts, direction, crop, thumb) — direction: IN/OUT (камера точки или
+        трекер) либо NULL; crop/thumb — хэши JPEG кропа и миниатюры (backend/evidence.py)
       last_seen(plate primary key, ts) — для ускоренного запроса последнего визита
     """
     with conn:
@@ -86,9 +89,92 @@ def _init_history_db(conn: sqlite3.Connection) -> None:
             );
             """
         )
+        # миграция: направление проезда (добавлено вместе с трекером)
+        cols = {r["name"] for r in conn.execute("PRAGMA table_info(history)").fetchall()}
+        if "direction" not in cols:
+            conn.execute("ALTER TABLE history ADD COLUMN direction TEXT;")
+        for col in ("crop", "thumb"):
+            if col not in cols:
+                conn.execute(f"ALTER TABLE history ADD COLUMN {col} TEXT;")
         # Индексы
         conn.execute("CREATE INDEX IF NOT EXISTS idx_history_plate_ts ON history(plate, ts DESC);")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_history_ts ON history(ts);")
+    _init_stats_tables(conn)
+    _init_visit_tables(conn)
+
+
+def _init_stats_tables(conn: sqlite3.Connection) -> None:
+    """
+    Агрегаты для дашборда (обновляются инкрементально в add_history_record):
+      stats(period, point, bucket, total, residents, unknown, uniq)
+        period — 'hour' | 'day', bucket — unix-время начала часа/суток (локальное время)
+      stats_seen(period, point, bucket, plate) — какие номера уже учтены в uniq
+    """
+    with conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS stats(
+              period    TEXT    NOT NULL,
+              point     TEXT    NOT NULL,
+              bucket    INTEGER NOT NULL,
+              total     INTEGER NOT NULL DEFAULT 0,
+              residents INTEGER NOT NULL DEFAULT 0,
+              unknown   INTEGER NOT NULL DEFAULT 0,
+              uniq      INTEGER NOT NULL DEFAULT 0,
+              PRIMARY KEY(period, point, bucket)
+            ) WITHOUT ROWID;
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS stats_seen(
+              period TEXT    NOT NULL,
+              point  TEXT    NOT NULL,
+              bucket INTEGER NOT NULL,
+              plate  TEXT    NOT NULL,
+              PRIMARY KEY(period, point, bucket, plate)
+            ) WITHOUT ROWID;
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_stats_bucket ON stats(period, bucket);")
+
+
+def _init_visit_tables(conn: sqlite3.Connection) -> None:
+    """
+    Присутствие и визиты (обновляются инкрементально в add_history_record по событиям с direction):
+      presence(plate, point, in_ts, last_ts) — кто сейчас внутри (въехал, выезда ещё не было)
+      visits(id, plate, in_point, in_ts, out_point, out_ts, dwell_s, status)
+        status: 'closed' — пара IN→OUT; 'missed_out' — повторный IN без выезда или въезд старше
+                PRESENCE_TTL (выезд не прочитан); 'missed_in' — OUT без въезда (въезд не прочитан).
+                Для пропущенных dwell_s = NULL.
+    """
+    with conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS presence(
+              plate   TEXT PRIMARY KEY,
+              point   TEXT NOT NULL,
+              in_ts   INTEGER NOT NULL,
+              last_ts INTEGER NOT NULL
+            );
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS visits(
+              id        INTEGER PRIMARY KEY AUTOINCREMENT,
+              plate     TEXT NOT NULL,
+              in_point  TEXT,
+              in_ts     INTEGER,
+              out_point TEXT,
+              out_ts    INTEGER,
+              dwell_s   INTEGER,
+              status    TEXT NOT NULL
+            );
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_presence_in_ts ON presence(in_ts DESC);")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_visits_plate ON visits(plate, id DESC);")
 
 
 def _init_people_db(conn: sqlite3.Connection) -> None:
@@ -124,31 +210,440 @@ def init_db() -> None:
     log("🗄️ DB: инициализация завершена")
 
 
-def add_history_record(plate: str, point: str, ts: Optional[int] = None) -> None:
+# -----------------------
+# Дедупликация при вставке
+# -----------------------
+# _dedup_index[(point, plate, direction)] = ts последнего чтения номера на точке.
+# Повтор в пределах HISTORY_DEDUP_WINDOW не создаёт новую строку (раньше это
+# разгребал history_cleaner.py после закрытия ворот).
+# _dedup_lock охраняет только словарь (решение «новая строка или повтор»);
+# запись в SQLite идёт после него под _history_write_lock, который сериализует
+# транзакции на общем соединении и не задерживает решения по другим номерам.
+_dedup_index: Dict[Tuple[str, str, Optional[str]], int] = {}
+_dedup_lock = threading.Lock()
+_history_write_lock = threading.Lock()
+_DEDUP_PRUNE_SIZE = 10000
+
+
+def _prune_dedup_index(now: int, window: float) -> None:
+    stale = [k for k, v in _dedup_index.items() if now - v >= window]
+    for k in stale:
+        del _dedup_index[k]
+
+
+def add_history_record(
+    plate: str, point: str, ts: Optional[int] = None, dedup_window: Optional[float] = None,
+    direction: Optional[str] = None, evidence: Optional[Dict[str, str]] = None,
+) -> Optional[int]:
     """
-    Добавляет запись в историю и обновляет last_seen.
+    Добавляет запись в историю и обновляет last_seen и агрегаты stats.
+    Повтор того же номера на той же точке внутри окна дедупликации не пишется:
+    обновляется только last_seen. Въезд и выезд (direction) — разные события.
+    evidence — {"crop", "thumb"} из evidence.store(), ссылки на кроп события;
+    кроп обычно сохраняют уже после вставки в фоне (evidence.store_later →
+    set_history_evidence), чтобы не писать кропы повторов и не задерживать ворота.
+    Возвращает id добавленной строки или None (повтор).
     """
     if not plate:
-        return
+        return None
     if ts is None:
         ts = int(time.time())
+    direction = direction.upper() if direction else None
+    window = config.HISTORY_DEDUP_WINDOW if dedup_window is None else dedup_window
 
+    t0 = time.perf_counter()
+    resident = is_resident(plate)
     conn = _get_history_conn()
-    with conn:
+    key = (point, plate, direction)
+    with _dedup_lock:
+        prev = _dedup_index.get(key)
+        merged = window > 0 and prev is not None and 0 <= ts - prev < window
+        # окно скользящее: пока номер виден, все чтения сливаются в одну запись
+        _dedup_index[key] = ts
+        if len(_dedup_index) > _DEDUP_PRUNE_SIZE:
+            _prune_dedup_index(ts, window)
+
+    if merged:
+        with _history_write_lock, conn:
+            conn.execute(
+                """
+                INSERT INTO last_seen(plate, ts) VALUES(?, ?)
+                ON CONFLICT(plate) DO UPDATE SET ts=MAX(ts, excluded.ts)
+                """,
+                (plate, ts),
+            )
+            if direction == "IN":
+                conn.execute("UPDATE presence SET last_ts=MAX(last_ts, ?) WHERE plate = ?", (ts, plate))
+        metrics.DB_INSERT_SECONDS.observe(time.perf_counter() - t0, result="merged")
+        log(f"⏩ История: повтор {plate} @ {point} через {ts - prev} с — не записан", debug=True)
+        return None
+    try:
+        with _history_write_lock:
+            row_id = _insert_history_row(conn, plate, point, ts, resident, direction, evidence)
+    except Exception:
+        # строка не записана — следующее чтение не должно считаться её повтором
+        with _dedup_lock:
+            if _dedup_index.get(key) == ts:
+                if prev is None:
+                    del _dedup_index[key]
+                else:
+                    _dedup_index[key] = prev
+        raise
+    metrics.DB_INSERT_SECONDS.observe(time.perf_counter() - t0, result="inserted")
+    # отладка
+    log(f"📝 История: {plate} @ {point}{(' ' + direction) if direction else ''} ({ts})", debug=True)
+    return row_id
+
+
+def set_history_evidence(row_id: int, evidence: Optional[Dict[str, str]]) -> None:
+    """
+    Привязывает кроп и миниатюру (evidence.store) к уже добавленной строке истории.
+    """
+    if not row_id or not evidence:
+        return
+    conn = _get_history_conn()
+    with _history_write_lock, conn:
         conn.execute(
-            "INSERT INTO history(plate, point, ts) VALUES(?, ?, ?)",
-            (plate, point, ts),
+            "UPDATE history SET crop=?, thumb=? WHERE id=?",
+            (evidence.get("crop"), evidence.get("thumb"), row_id),
+        )
+
+
+def _insert_history_row(conn: sqlite3.Connection, plate: str, point: str, ts: int, resident: bool,
+                        direction: Optional[str] = None, evidence: Optional[Dict[str, str]] = None) -> int:
+    evidence = evidence or {}
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO history(plate, point, ts, direction, crop, thumb) VALUES(?, ?, ?, ?, ?, ?)",
+            (plate, point, ts, direction, evidence.get("crop"), evidence.get("thumb")),
         )
         # upsert в last_seen
         conn.execute(
             """
             INSERT INTO last_seen(plate, ts) VALUES(?, ?)
-            ON CONFLICT(plate) DO UPDATE SET ts=excluded.ts
+            ON CONFLICT(plate) DO UPDATE SET ts=MAX(ts, excluded.ts)
             """,
             (plate, ts),
         )
-    # отладка
-    log(f"📝 История: {plate} @ {point} ({ts})", debug=True)
+        _bump_stats(conn, plate, point, ts, resident)
+        _maybe_expire_presence(conn, ts)
+        if direction:
+            _pair_visit(conn, plate, point, ts, direction)
+    return cur.lastrowid
+
+
+# -----------------------
+# Присутствие и визиты
+# -----------------------
+
+PRESENCE_EXPIRE_EVERY = 60      # сек (по времени событий) между проверками устаревшего присутствия
+_presence_next_expire = 0       # под _history_write_lock
+
+
+def _maybe_expire_presence(conn: sqlite3.Connection, now: int) -> int:
+    """
+    Въезды без выезда, не виденные дольше PRESENCE_TTL, закрываются визитом 'missed_out'.
+    Часы — время событий: бэкфилл проигрывает историю так же, как она шла вживую.
+    """
+    global _presence_next_expire
+    ttl = config.PRESENCE_TTL
+    if ttl <= 0 or now < _presence_next_expire:
+        return 0
+    _presence_next_expire = now + PRESENCE_EXPIRE_EVERY
+    cutoff = now - ttl
+    conn.execute(
+        """
+        INSERT INTO visits(plate, in_point, in_ts, status)
+        SELECT plate, point, in_ts, 'missed_out' FROM presence WHERE last_ts < ? ORDER BY in_ts
+        """,
+        (cutoff,),
+    )
+    return conn.execute("DELETE FROM presence WHERE last_ts < ?", (cutoff,)).rowcount
+
+def _pair_visit(conn: sqlite3.Connection, plate: str, point: str, ts: int, direction: str) -> None:
+    """
+    Сводит событие IN/OUT с presence и visits. Вызывается внутри транзакции вставки.
+    """
+    cur = conn.execute("SELECT point, in_ts FROM presence WHERE plate = ?", (plate,)).fetchone()
+    if direction == "IN":
+        if cur:
+            # второй въезд без выезда: прошлый визит закрыт с пропущенным выездом
+            conn.execute(
+                "INSERT INTO visits(plate, in_point, in_ts, status) VALUES(?, ?, ?, 'missed_out')",
+                (plate, cur["point"], cur["in_ts"]),
+            )
+        conn.execute(
+            """
+            INSERT INTO presence(plate, point, in_ts, last_ts) VALUES(?, ?, ?, ?)
+            ON CONFLICT(plate) DO UPDATE SET point=excluded.point, in_ts=excluded.in_ts, last_ts=excluded.last_ts
+            """,
+            (plate, point, ts, ts),
+        )
+    elif direction == "OUT":
+        if cur:
+            conn.execute(
+                """
+                INSERT INTO visits(plate, in_point, in_ts, out_point, out_ts, dwell_s, status)
+                VALUES(?, ?, ?, ?, ?, ?, 'closed')
+                """,
+                (plate, cur["point"], cur["in_ts"], point, ts, max(0, ts - int(cur["in_ts"]))),
+            )
+            conn.execute("DELETE FROM presence WHERE plate = ?", (plate,))
+        else:
+            conn.execute(
+                "INSERT INTO visits(plate, out_point, out_ts, status) VALUES(?, ?, ?, 'missed_in')",
+                (plate, point, ts),
+            )
+
+
+def rebuild_visits(batch: int = 5000) -> int:
+    """
+    Пересобирает presence и visits по всей истории с direction (backfill).
+    Таблицы очищаются, события проигрываются по возрастанию времени.
+    Всё — одной транзакцией BEGIN IMMEDIATE: живые вставки (в этом процессе —
+    _history_write_lock, в других — блокировка записи SQLite) ждут её конца и не
+    сводятся с наполовину пересобранными таблицами. batch — размер пачки чтения.
+    Возвращает количество обработанных событий.
+    """
+    global _presence_next_expire
+    conn = _get_history_conn()
+    done = 0
+    last = (-1, 0)
+    with _history_write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM presence")
+            conn.execute("DELETE FROM visits")
+            _presence_next_expire = 0
+            while True:
+                rows = conn.execute(
+                    """
+                    SELECT id, plate, point, ts, direction FROM history
+                    WHERE direction IS NOT NULL AND (ts > ? OR (ts = ? AND id > ?))
+                    ORDER BY ts, id LIMIT ?
+                    """,
+                    (last[0], last[0], last[1], batch),
+                ).fetchall()
+                if not rows:
+                    break
+                for r in rows:
+                    _maybe_expire_presence(conn, int(r["ts"]))
+                    _pair_visit(conn, r["plate"], r["point"], int(r["ts"]), r["direction"].upper())
+                done += len(rows)
+                last = (int(rows[-1]["ts"]), rows[-1]["id"])
+            # хвост: въезды, устаревшие к текущему моменту
+            _presence_next_expire = 0
+            _maybe_expire_presence(conn, int(time.time()))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    log(f"🚗 Визиты: пересобрано по {done} событиям истории")
+    return done
+
+
+def fetch_presence(point: Optional[str] = None, limit: int = 500) -> Dict[str, Any]:
+    """
+    Кто сейчас внутри (свежие въезды первыми) и сколько всего.
+    """
+    conn = _get_history_conn()
+    if point:
+        rows = conn.execute(
+            "SELECT plate, point, in_ts, last_ts FROM presence WHERE point = ? ORDER BY in_ts DESC LIMIT ?",
+            (point, int(limit)),
+        ).fetchall()
+        total = conn.execute("SELECT COUNT(*) AS n FROM presence WHERE point = ?", (point,)).fetchone()["n"]
+    else:
+        rows = conn.execute(
+            "SELECT plate, point, in_ts, last_ts FROM presence ORDER BY in_ts DESC LIMIT ?",
+            (int(limit),),
+        ).fetchall()
+        total = conn.execute("SELECT COUNT(*) AS n FROM presence").fetchone()["n"]
+    return {"total": total, "items": rows or []}
+
+
+def fetch_visits(plate: Optional[str] = None, limit: int = 100, before_id: Optional[int] = None) -> list[Dict[str, Any]]:
+    """
+    Последние визиты (новые первыми), опционально по номеру. before_id — курсор следующей страницы.
+    """
+    where = []
+    args: list[Any] = []
+    if plate:
+        where.append("plate = ?")
+        args.append(plate)
+    if before_id is not None:
+        where.append("id < ?")
+        args.append(int(before_id))
+    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+    rows = _get_history_conn().execute(
+        f"""
+        SELECT id, plate, in_point, in_ts, out_point, out_ts, dwell_s, status
+        FROM visits{where_sql}
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        args + [int(limit)],
+    ).fetchall()
+    return rows or []
+
+
+# -----------------------
+# Агрегаты (stats)
+# -----------------------
+
+STATS_PERIODS = ("hour", "day")
+
+
+def parse_ts(value: Optional[str], end_of_day: bool = False) -> Optional[int]:
+    """
+    Граница интервала stats: unix-время или дата/время (YYYY-MM-DD[ HH:MM:SS]) в локальной зоне.
+    Пустое значение — None; некорректное — ValueError.
+    """
+    value = (value or "").strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    if len(value) == 10:
+        ts = int(time.mktime(time.strptime(value, "%Y-%m-%d")))
+        return ts + 86399 if end_of_day else ts
+    return int(time.mktime(time.strptime(value, "%Y-%m-%d %H:%M:%S")))
+
+
+def _bucket_start(period: str, ts: int) -> int:
+    """
+    Начало часа/суток (по локальному времени), в который попадает ts.
+    """
+    lt = time.localtime(ts)
+    if period == "hour":
+        return int(time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, lt.tm_hour, 0, 0, 0, 0, -1)))
+    return int(time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, 0, 0, 0, 0, 0, -1)))
+
+
+def _bump_stats(conn: sqlite3.Connection, plate: str, point: str, ts: int, resident: bool) -> None:
+    """
+    Инкрементально обновляет stats для одного события. Вызывается внутри транзакции вставки.
+    """
+    res_inc = 1 if resident else 0
+    for period in STATS_PERIODS:
+        bucket = _bucket_start(period, ts)
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO stats_seen(period, point, bucket, plate) VALUES(?, ?, ?, ?)",
+            (period, point, bucket, plate),
+        )
+        uniq_inc = 1 if cur.rowcount == 1 else 0
+        conn.execute(
+            """
+            INSERT INTO stats(period, point, bucket, total, residents, unknown, uniq)
+            VALUES(?, ?, ?, 1, ?, ?, ?)
+            ON CONFLICT(period, point, bucket) DO UPDATE SET
+              total=total + 1,
+              residents=residents + excluded.residents,
+              unknown=unknown + excluded.unknown,
+              uniq=uniq + excluded.uniq
+            """,
+            (period, point, bucket, res_inc, 1 - res_inc, uniq_inc),
+        )
+
+
+def rebuild_stats(since: Optional[int] = None, until: Optional[int] = None, batch: int = 5000) -> int:
+    """
+    Пересчитывает stats по существующей истории (backfill).
+    Затронутые корзины [since, until] предварительно очищаются, чтобы повторный запуск не удваивал счётчики.
+    Границы расширяются до целых суток: корзина очищается целиком — целиком и пересчитывается.
+    Очистка и пересчёт — одна транзакция BEGIN IMMEDIATE под _history_write_lock
+    (как rebuild_visits): живая вставка не попадёт в корзину дважды.
+    Возвращает количество обработанных записей.
+    """
+    conn = _get_history_conn()
+    if since is not None:
+        since = _bucket_start("day", int(since))
+    if until is not None:
+        day = _bucket_start("day", int(until))
+        until = _bucket_start("day", day + 36 * 3600) - 1  # конец суток (с учётом перехода на летнее время)
+    where = []
+    args: list[Any] = []
+    if since is not None:
+        where.append("ts >= ?")
+        args.append(int(since))
+    if until is not None:
+        where.append("ts <= ?")
+        args.append(int(until))
+    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+
+    residents = _all_resident_plates()
+    done = 0
+    last_id = 0
+    with _history_write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for period in STATS_PERIODS:
+                for table in ("stats", "stats_seen"):
+                    sql = f"DELETE FROM {table} WHERE period = ?"
+                    sargs: list[Any] = [period]
+                    if since is not None:
+                        sql += " AND bucket >= ?"
+                        sargs.append(since)
+                    if until is not None:
+                        sql += " AND bucket <= ?"
+                        sargs.append(until)
+                    conn.execute(sql, sargs)
+            while True:
+                rows = conn.execute(
+                    f"SELECT id, plate, point, ts FROM history{where_sql}"
+                    f"{' AND' if where_sql else ' WHERE'} id > ? ORDER BY id LIMIT ?",
+                    args + [last_id, batch],
+                ).fetchall()
+                if not rows:
+                    break
+                for r in rows:
+                    _bump_stats(conn, r["plate"], r["point"], int(r["ts"]), r["plate"] in residents)
+                done += len(rows)
+                last_id = rows[-1]["id"]
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    log(f"📊 Stats: пересчитано {done} записей истории")
+    return done
+
+
+def fetch_stats(
+    period: str = "hour",
+    point: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    limit: int = 744,
+) -> list[Dict[str, Any]]:
+    """
+    Возвращает ряды агрегатов для графиков (по возрастанию bucket).
+    Читает только из stats, поэтому не зависит от размера history.
+    """
+    if period not in STATS_PERIODS:
+        period = "hour"
+    where = ["period = ?"]
+    args: list[Any] = [period]
+    if point:
+        where.append("point = ?")
+        args.append(point)
+    if since is not None:
+        where.append("bucket >= ?")
+        args.append(_bucket_start(period, int(since)))
+    if until is not None:
+        where.append("bucket <= ?")
+        args.append(int(until))
+    conn = _get_history_conn()
+    rows = conn.execute(
+        f"""
+        SELECT point, bucket, total, residents, unknown, uniq
+        FROM stats
+        WHERE {' AND '.join(where)}
+        ORDER BY bucket ASC, point ASC
+        LIMIT ?
+        """,
+        args + [int(limit)],
+    ).fetchall()
+    return rows or []
 
 
 def get_last_seen(plate: str) -> Optional[int]:
@@ -213,6 +708,21 @@ def get_plate_from_db(base: str) -> Optional[str]:
     return best[0] if best else None
 
 
+def is_resident(plate: str) -> bool:
+    """
+    Номер есть среди жильцов (base.db people.car_number — тот же снимок, что у access).
+    """
+    if not plate:
+        return False
+    from backend import access
+    return access.is_resident(plate)
+
+
+def _all_resident_plates() -> frozenset[str]:
+    from backend import access
+    return access.engine.resident_plates()
+
+
 # -----------------------
 # Вспомогательные функции (могут пригодиться веб-интерфейсу)
 # -----------------------
@@ -225,7 +735,7 @@ def fetch_history(plate: Optional[str] = None, limit: int = 100, offset: int = 0
     if plate:
         rows = conn.execute(
             """
-            SELECT plate, point, ts
+            SELECT plate, point, ts, direction, crop, thumb
             FROM history
             WHERE plate = ?
             ORDER BY ts DESC
@@ -236,7 +746,7 @@ def fetch_history(plate: Optional[str] = None, limit: int = 100, offset: int = 0
     else:
         rows = conn.execute(
             """
-            SELECT plate, point, ts
+            SELECT plate, point, ts, direction, crop, thumb
             FROM history
             ORDER BY ts DESC
             LIMIT ? OFFSET ?
@@ -246,6 +756,16 @@ def fetch_history(plate: Optional[str] = None, limit: int = 100, offset: int = 0
     return rows or []
 
 
+def evidence_digests() -> set[str]:
+    """
+    Хэши кропов и миниатюр, на которые ссылается история (для evidence.gc).
+    """
+    rows = _get_history_conn().execute(
+        "SELECT crop, thumb FROM history WHERE crop IS NOT NULL OR thumb IS NOT NULL"
+    ).fetchall()
+    return {v for r in rows or [] for v in (r["crop"], r["thumb"]) if v}
+
+
 def upsert_person_plate(plate: str, fio: Optional[str] = None, brand: Optional[str] = None, address: Optional[str] = None) -> None:
     """
     Утилита для добавления/обновления записи в people.db (может использоваться из админки).
@@ -0,0 +1,84 @@
+# backend/events.py
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import deque
+
+# -----------------------
+# Шина событий для веб-интерфейса (SSE)
+# -----------------------
+# Источники — сам конвейер распознавания, а не база:
+#   status — смена состояния подключений MQTT/CPAI (state.set_*_connected)
+#   plate  — новое событие номера (после записи в history)
+#   gate   — переход ворот OPEN/CLOSED (state.mark_gate)
+#   log    — новая строка лога (logger)
+# Подписчики не регистрируются: каждый ведёт свой курсор по общему кольцу и
+# ждёт на Condition, поэтому в простое нагрузка нулевая, а медленный клиент
+# не тормозит остальных (отставший получает reset).
+# Модуль ничего не импортирует из backend и ничего не логирует — его зовёт и logger.
+
+_HISTORY = 2000
+
+_ring: deque[tuple[int, str, str]] = deque(maxlen=_HISTORY)
+_cv = threading.Condition()
+_seq = 0
+
+
+def publish(event_type: str, data: dict | str) -> int:
+    """
+    Публикует событие. data сериализуется один раз, а не для каждого подписчика.
+    """
+    global _seq
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    with _cv:
+        _seq += 1
+        _ring.append((_seq, event_type, payload))
+        _cv.notify_all()
+        return _seq
+
+
+def cursor() -> int:
+    with _cv:
+        return _seq
+
+
+def since(cur: int, types: set[str] | None = None, limit: int = 500) -> dict:
+    """
+    События новее курсора. reset=True — курсор устарел, часть событий потеряна.
+    """
+    with _cv:
+        last = _seq
+        first = _ring[0][0] if _ring else last + 1
+        if cur > last or cur < first - 1:
+            return {"events": [], "cursor": last, "reset": True}
+        items = list(_ring)[cur - first + 1:]
+    out = []
+    new_cur = cur
+    for seq, etype, payload in items:
+        if len(out) >= limit:
+            break
+        new_cur = seq
+        if types is None or etype in types:
+            out.append((seq, etype, payload))
+    return {"events": out, "cursor": new_cur, "reset": False}
+
+
+def wait(cur: int, timeout: float) -> bool:
+    with _cv:
+        return _cv.wait_for(lambda: _seq > cur, timeout=timeout)
+
+
+# -----------------------
+# Удобные обёртки для конвейера
+# -----------------------
+def plate_event(point: str, plate: str, ts: int | None = None, **extra) -> None:
+    ts = ts or int(time.time())
+    publish("plate", {
+        "point": point,
+        "plate": plate,
+        "ts": ts,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)),
+        **extra,
+    })
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# backend/evidence.py
+# Обслуживание: python -m backend.evidence --gc [--min-age-h 24] [--dry-run]
+#
+# Доказательство события: кроп лучшего кадра вокруг номера и миниатюра.
+# Файлы адресуются содержимым (sha256 JPEG): evidence/ab/abcdef….jpg —
+# одинаковые кадры хранятся один раз, а URL никогда не меняет содержимое,
+# поэтому веб отдаёт их с вечным кэшем и ETag = хэш (app.py, /evidence/…).
+# В history пишутся только хэши (столбцы crop, thumb).
+# Декодирование и два JPEG-кодирования не должны задерживать ворота: конвейер
+# ставит кроп в очередь (store_later) уже после открытия и публикации, фоновый
+# поток сохраняет его и привязывает к строке истории (db.set_history_evidence).
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import queue
+import sys
+import threading
+import time
+
+from backend import config
+from backend.logger import log
+
+QUEUE_SIZE = 256
+
+_cv2_missing_logged = False
+_queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+_worker: threading.Thread | None = None
+_worker_lock = threading.Lock()
+
+
+def path_for(digest: str) -> str:
+    return os.path.join(config.EVIDENCE_DIR, digest[:2], digest + ".jpg")
+
+
+def is_digest(value: str) -> bool:
+    return len(value) == 32 and all(c in "0123456789abcdef" for c in value)
+
+
+def _put(data: bytes) -> str:
+    """
+    Сохраняет JPEG по хэшу содержимого (если такого ещё нет). Возвращает хэш.
+    """
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    path = path_for(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return digest
+
+
+def _decode(image):
+    """
+    Кадр BGR из ndarray (камера), JPEG в памяти (MQTT) или пути к файлу.
+    """
+    import cv2
+    import numpy as np
+    if isinstance(image, str):
+        return cv2.imread(image, cv2.IMREAD_COLOR)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return image
+
+
+def _fit(cv2, img, max_side: int):
+    h, w = img.shape[:2]
+    k = max_side / float(max(h, w))
+    if k >= 1.0:
+        return img
+    return cv2.resize(img, (max(1, int(w * k)), max(1, int(h * k))), interpolation=cv2.INTER_AREA)
+
+
+def store(image, bbox=None) -> dict | None:
+    """
+    Кроп вокруг рамки номера (с полями EVIDENCE_MARGIN ширин рамки; без рамки —
+    весь кадр) и миниатюра. Возвращает {"crop": хэш, "thumb": хэш} или None,
+    если кадра нет или его не удалось обработать — событие пишется и без них.
+    """
+    global _cv2_missing_logged
+    if image is None or not config.EVIDENCE_ENABLED:
+        return None
+    try:
+        import cv2
+    except ImportError:
+        if not _cv2_missing_logged:
+            log("⚠️ Кропы событий не сохраняются: OpenCV не установлен")
+            _cv2_missing_logged = True
+        return None
+    try:
+        frame = _decode(image)
+        if frame is None or not getattr(frame, "size", 0):
+            return None
+        crop = frame
+        if bbox:
+            h, w = frame.shape[:2]
+            x1, y1, x2, y2 = bbox
+            pad = (x2 - x1) * config.EVIDENCE_MARGIN
+            cx1, cy1 = max(0, int(x1 - pad)), max(0, int(y1 - pad))
+            cx2, cy2 = min(w, int(x2 + pad)), min(h, int(y2 + pad))
+            if cx2 > cx1 and cy2 > cy1:
+                crop = frame[cy1:cy2, cx1:cx2]
+        crop = _fit(cv2, crop, config.EVIDENCE_CROP_MAX)
+        thumb = _fit(cv2, crop, config.EVIDENCE_THUMB_MAX)
+        q = [int(cv2.IMWRITE_JPEG_QUALITY), config.EVIDENCE_JPEG_QUALITY]
+        ok1, crop_jpg = cv2.imencode(".jpg", crop, q)
+        ok2, thumb_jpg = cv2.imencode(".jpg", thumb, q)
+        if not (ok1 and ok2):
+            return None
+        return {"crop": _put(crop_jpg.tobytes()), "thumb": _put(thumb_jpg.tobytes())}
+    except Exception as e:
+        log(f"⚠️ Ошибка сохранения кропа события: {e}", debug=True)
+        return None
+
+
+def store_later(row_id: int | None, image, bbox=None) -> bool:
+    """
+    Кроп для уже записанной строки истории — в фоновом потоке. Очередь полна —
+    кроп пропускается (событие записано и опубликовано и без него).
+    """
+    if not row_id or image is None or not config.EVIDENCE_ENABLED:
+        return False
+    _ensure_worker()
+    try:
+        _queue.put_nowait((row_id, image, bbox))
+    except queue.Full:
+        log(f"⚠️ Очередь кропов переполнена — кроп строки {row_id} пропущен", debug=True)
+        return False
+    return True
+
+
+def _run() -> None:
+    from backend import db
+    while True:
+        row_id, image, bbox = _queue.get()
+        try:
+            db.set_history_evidence(row_id, store(image, bbox))
+        except Exception as e:
+            log(f"⚠️ Ошибка привязки кропа к строке {row_id}: {e}", debug=True)
+
+
+def _ensure_worker() -> None:
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        with _worker_lock:
+            if _worker is None or not _worker.is_alive():
+                _worker = threading.Thread(target=_run, name="evidence", daemon=True)
+                _worker.start()
+
+
+def pending() -> int:
+    return _queue.qsize()
+
+
+def gc(min_age_s: float = 86400.0, dry_run: bool = False) -> tuple[int, int]:
+    """
+    Удаляет файлы, на которые не ссылается history (старше min_age_s — чтобы
+    не задеть кропы событий, чья строка ещё пишется). Возвращает (удалено, байт).
+    """
+    from backend import db
+    referenced = db.evidence_digests()
+    now = time.time()
+    removed = freed = 0
+    if not os.path.isdir(config.EVIDENCE_DIR):
+        return 0, 0
+    for sub in os.listdir(config.EVIDENCE_DIR):
+        d = os.path.join(config.EVIDENCE_DIR, sub)
+        if not os.path.isdir(d):
+            continue
+        for name in os.listdir(d):
+            digest = name[:-4]
+            path = os.path.join(d, name)
+            if not name.endswith(".jpg") or digest in referenced:
+                continue
+            st = os.stat(path)
+            if now - st.st_mtime < min_age_s:
+                continue
+            removed += 1
+            freed += st.st_size
+            if not dry_run:
+                os.remove(path)
+    return removed, freed
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Обслуживание кропов событий (evidence/).")
+    p.add_argument("--gc", action="store_true", help="Удалить файлы, на которые не ссылается history")
+    p.add_argument("--min-age-h", type=float, default=24.0, help="Не трогать файлы моложе N часов")
+    p.add_argument("--dry-run", action="store_true", help="Только посчитать")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.gc:
+        print(f"[evidence] каталог {config.EVIDENCE_DIR}; для чистки — --gc")
+        return 0
+    removed, freed = gc(args.min_age_h * 3600.0, dry_run=args.dry_run)
+    print(f"[evidence] {'к удалению' if args.dry_run else 'удалено'}: {removed} файлов, {freed / 1048576.0:.1f} МБ")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,64 +1,156 @@
+import heapq
+import itertools
 import threading
 import time
-import subprocess
-import sys
-import os
 from backend.logger import log
-from backend.config import HISTORY_DB
-from backend.state import gate_lock  # отдельный lock для ворот
+from backend import access, metrics, tracing
+import backend.state as state
 import paho.mqtt.client as mqtt
 
-_gate_state: dict[str, str] = {}
-_gate_cycle_start_ts: dict[str, str] = {}
+# Время удержания ворот открытыми по умолчанию (сек)
+GATE_HOLD_S = 30
 
-def _find_history_cleaner_path() -> str | None:
-    root = os.path.dirname(os.path.dirname(__file__))
-    c1 = os.path.join(root, "backend", "history_cleaner.py")
-    c2 = os.path.join(root, "history_cleaner.py")
-    if os.path.exists(c1):
-        return c1
-    if os.path.exists(c2):
-        return c2
-    return None
 
-def call_history_cleaner(point_name: str, start_ts: str, end_ts: str):
-    try:
-        script = _find_history_cleaner_path()
-        if not script:
-            log("⚠️ history_cleaner.py не найден.", debug=True)
-            return
-        cmd = [sys.executable, script, "--db", HISTORY_DB, "--point", point_name,
-               "--since", start_ts, "--until", end_ts]
-        subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        log(f"▶️ Запущен history_cleaner для {point_name} [{start_ts} → {end_ts}]")
-    except Exception as e:
-        log(f"❌ Не удалось запустить history_cleaner: {e}", debug=True)
-
-def mark_gate_open(point_name: str, hold_s: int = 30):
-    _gate_state[point_name] = "OPEN"
-    start_ts = time.strftime("%Y-%m-%d %H:%M:%S")
-    _gate_cycle_start_ts[point_name] = start_ts
-    log(f"Статус ворот {point_name}: OPEN")
-
-    def _close():
-        with gate_lock:
-            _gate_state[point_name] = "CLOSED"
-            end_ts = time.strftime("%Y-%m-%d %H:%M:%S")
+# -----------------------
+# Планировщик автозакрытия
+# -----------------------
+class GateScheduler:
+    """
+    Один поток на все точки: куча дедлайнов (monotonic, seq, point).
+    Повторное чтение номера при открытых воротах переносит дедлайн —
+    старые записи в куче не удаляются, а пропускаются по несовпадению seq.
+    Состояние ворот хранится только в state.gates_state; переходы OPEN/CLOSED
+    делаются под тем же _cv, что и проверка seq, поэтому закрытие по старому
+    дедлайну не может затереть открытие с новым.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, str]] = []
+        self._deadline_seq: dict[str, int] = {}
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="gate-scheduler", daemon=True)
+            self._thread.start()
+
+    def arm(self, point_name: str, hold_s: float) -> float:
+        """
+        Ставит (или переносит) автозакрытие точки через hold_s. Возвращает wall-clock время закрытия.
+        """
+        with self._cv:
+            seq = next(self._seq)
+            self._deadline_seq[point_name] = seq
+            heapq.heappush(self._heap, (time.monotonic() + hold_s, seq, point_name))
+            self._ensure_thread()
+            self._cv.notify()
+        return time.time() + hold_s
+
+    def open(self, point_name: str, hold_s: float) -> bool:
+        """
+        Отмечает ворота открытыми и ставит (переносит) автозакрытие — атомарно
+        относительно закрытия в _run. Возвращает, были ли ворота уже открыты.
+        """
+        with self._cv:
+            st = state.get_gate_state(point_name)
+            was_open = bool(st and st.get("is_open"))
+            close_at = self.arm(point_name, hold_s)
+            state.mark_gate(point_name, True, close_at=close_at)
+        return was_open
+
+    def cancel(self, point_name: str):
+        with self._cv:
+            self._deadline_seq.pop(point_name, None)
+
+    def pending(self) -> int:
+        with self._cv:
+            return len(self._deadline_seq)
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while not self._heap:
+                    self._cv.wait()
+                deadline, seq, point_name = self._heap[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._cv.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                if self._deadline_seq.get(point_name) != seq:
+                    continue  # дедлайн был перенесён
+                del self._deadline_seq[point_name]
+                try:
+                    state.mark_gate(point_name, False)
+                except Exception as e:
+                    log(f"⚠️ Ошибка закрытия ворот {point_name}: {e}", debug=True)
+                    continue
             log(f"Статус ворот {point_name}: CLOSED")
-            start_for_clean = _gate_cycle_start_ts.pop(point_name, start_ts)
-            call_history_cleaner(point_name, start_for_clean, end_ts)
 
-    threading.Timer(hold_s, _close).start()
+
+_scheduler = GateScheduler()
+metrics.register_gauge("alpr_gate_close_pending", "Gates waiting for scheduled close",
+                       lambda: _scheduler.pending())
+
+
+# -----------------------
+# Управление воротами
+# -----------------------
+def mark_gate_open(point_name: str, hold_s: int = GATE_HOLD_S):
+    # Дубли в history отсекаются при вставке (db.add_history_record),
+    # поэтому по закрытию ворот больше ничего не чистим.
+    was_open = _scheduler.open(point_name, hold_s)
+    if was_open:
+        log(f"Статус ворот {point_name}: OPEN (продлено на {hold_s} с)", debug=True)
+    else:
+        log(f"Статус ворот {point_name}: OPEN")
 
 # псевдонимы для совместимости
 open_gate = mark_gate_open
 
+def is_gate_open(point_name: str) -> bool:
+    st = state.get_gate_state(point_name)
+    return bool(st and st.get("is_open"))
+
 def can_open_gate(point_name: str) -> bool:
-    return _gate_state.get(point_name) == "CLOSED"
+    return not is_gate_open(point_name)
+
+def handle_plate(
+    point_name: str,
+    plate: str,
+    ts: int | None = None,
+    client: mqtt.Client | None = None,
+    open_topic: str | None = None,
+    capture_ts: float | None = None,
+) -> dict:
+    """
+    Реакция ворот на распознанный номер: проверка allowlist, затем открыть
+    (с OPEN-командой в MQTT, если дан топик) либо продлить удержание,
+    если машина ещё в проезде. Возвращает решение access.decide().
+    """
+    with tracing.span("access") as sp:
+        decision = access.decide(point_name, plate)
+        sp.set(allow=decision["allow"], reason=decision["reason"])
+    tracing.annotate(gate=decision["reason"] if not decision["allow"] else "open")
+    if not decision["allow"]:
+        log(f"⛔ {plate} на {point_name}: проезд запрещён ({decision['reason']})")
+        return decision
+    with tracing.span("gate"):
+        if is_gate_open(point_name):
+            mark_gate_open(point_name)
+        elif client and open_topic:
+            send_open_command(client, open_topic, point_name, capture_ts=capture_ts)
+        else:
+            mark_gate_open(point_name)
+            access.record_open_latency(capture_ts)
+    return decision
 
-def send_open_command(client: mqtt.Client, topic: str, point_name: str):
+def send_open_command(client: mqtt.Client, topic: str, point_name: str, capture_ts: float | None = None):
     try:
         client.publish(topic, "1")
+        access.record_open_latency(capture_ts)
         log(f"Отправлена команда OPEN на {point_name}")
         mark_gate_open(point_name)
     except Exception as e:
@@ -1,24 +1,44 @@
 # -*- coding: utf-8 -*-
+# Пакетная чистка дублей в history за произвольный интервал.
+# В рабочем цикле больше не вызывается: повторы отсекаются при вставке
+# (db.add_history_record). Скрипт нужен для старых данных и ручного обслуживания.
 import argparse
 import sqlite3
 import os
 import sys
+import time
 
 def parse_args():
     p = argparse.ArgumentParser(description="Удаление дублей номеров в history за указанный интервал.")
     p.add_argument("--db", required=True, help="Путь к history.db")
-    p.add_argument("--point", required=True, help="Имя точки (без \\in/\\out), например 'Ворота'")
-    p.add_argument("--since", required=True, help="Начало интервала (YYYY-MM-DD HH:MM:SS)")
-    p.add_argument("--until", required=True, help="Конец интервала (YYYY-MM-DD HH:MM:SS)")
-    # режим: по умолчанию удаляем дубли по (plate, point_name) — оставляем самую раннюю запись
+    p.add_argument("--point", help="Имя точки; без параметра — все точки")
+    p.add_argument("--since", help="Начало интервала (unix ts для новой схемы / YYYY-MM-DD HH:MM:SS для старой)")
+    p.add_argument("--until", help="Конец интервала (в том же формате, что и --since)")
+    p.add_argument("--window", type=float, default=0,
+                   help="Окно дублей, сек: повтор (plate, point) в пределах окна удаляется. "
+                        "0 — оставить только первую запись за весь интервал (старое поведение)")
+    p.add_argument("--dry-run", action="store_true", help="Только посчитать, ничего не удалять")
+    # режим: по умолчанию удаляем дубли по (plate, point) — оставляем самую раннюю запись
     return p.parse_args()
 
+def _detect_columns(c):
+    """
+    Новая схема (backend/db.py): history(plate, point, ts INTEGER).
+    Старая схема: history(timestamp TEXT, plate, point_name), точки вида 'Ворота\\in'.
+    """
+    cols = {r[1] for r in c.execute("PRAGMA table_info(history)")}
+    if "ts" in cols and "point" in cols:
+        return "ts", "point", False
+    return "timestamp", "point_name", True
+
+def _to_seconds(value, legacy):
+    if not legacy:
+        return float(value)
+    return time.mktime(time.strptime(str(value)[:19], "%Y-%m-%d %H:%M:%S"))
+
 def main():
     args = parse_args()
     db_path = args.db
-    point_base = args.point
-    ts_from = args.since
-    ts_to = args.until
 
     if not os.path.exists(db_path):
         print(f"[history_cleaner] DB not found: {db_path}", file=sys.stderr)
@@ -26,39 +46,62 @@ def main():
 
     conn = sqlite3.connect(db_path)
     c = conn.cursor()
+    ts_col, point_col, legacy = _detect_columns(c)
+
+    where = []
+    params = []
+    if args.since:
+        where.append(f"{ts_col} >= ?")
+        params.append(args.since if legacy else int(args.since))
+    if args.until:
+        where.append(f"{ts_col} <= ?")
+        params.append(args.until if legacy else int(args.until))
+    if args.point:
+        if legacy:
+            # Берем записи для point_name начинающихся с "point\"
+            where.append(f"({point_col} = ? OR {point_col} LIKE ?)")
+            params += [args.point, args.point + "\\%"]
+        else:
+            where.append(f"{point_col} = ?")
+            params.append(args.point)
+    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
 
-    # Берем записи для point_name начинающихся с "point_base\"
-    like_prefix = point_base + "\\%"
-    c.execute("""
-        SELECT id, timestamp, plate, point_name
+    c.execute(f"""
+        SELECT id, {ts_col}, plate, {point_col}
         FROM history
-        WHERE timestamp >= ? AND timestamp <= ?
-          AND point_name LIKE ?
-        ORDER BY timestamp ASC, id ASC
-    """, (ts_from, ts_to, like_prefix))
-    rows = c.fetchall()
+        {where_sql}
+        ORDER BY {ts_col} ASC, id ASC
+    """, params)
 
-    seen = set()           # (plate, point_name)
+    last = {}              # (plate, point) -> время последнего чтения
     to_delete = []
 
-    for rid, ts, plate, pnt in rows:
+    # курсор читаем потоково — интервал может быть сколь угодно большим
+    for rid, ts, plate, pnt in c:
         key = (plate, pnt)
-        if key in seen:
+        t = _to_seconds(ts, legacy)
+        prev = last.get(key)
+        if prev is not None and (args.window <= 0 or t - prev < args.window):
             to_delete.append(rid)  # дубликат — удаляем
+        if args.window <= 0:
+            last.setdefault(key, t)    # первую оставляем
         else:
-            seen.add(key)          # первую оставляем
+            last[key] = t              # окно скользящее, как в db.add_history_record
 
     deleted = 0
-    if to_delete:
+    if to_delete and not args.dry_run:
         # Чистим батчами по 500 на всякий
         for i in range(0, len(to_delete), 500):
             chunk = to_delete[i:i+500]
-            c.execute(f"DELETE FROM history WHERE id IN ({','.join('?'*len(chunk))})", chunk)
+            conn.execute(f"DELETE FROM history WHERE id IN ({','.join('?'*len(chunk))})", chunk)
         conn.commit()
         deleted = len(to_delete)
 
     conn.close()
-    print(f"[history_cleaner] point='{point_base}' window=[{ts_from}..{ts_to}] deleted={deleted}")
+    print(f"[history_cleaner] point='{args.point or '*'}' window=[{args.since or '-∞'}..{args.until or '+∞'}] "
+          f"dup_window={args.window}s found={len(to_delete)} deleted={deleted}")
+    if deleted and not legacy:
+        print("[history_cleaner] агрегаты stats устарели: запустите python -m backend.stats_backfill за тот же интервал")
     return 0
 
 if __name__ == "__main__":
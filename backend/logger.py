@@ -1,19 +1,210 @@
 from __future__ import annotations
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
 import time
-from backend.config import LOG_FILE, DEBUG_MODE
+from collections import deque
+from backend import config, events
+from backend.config import (
+    LOG_FILE, DEBUG_MODE, LOG_MAX_MB, LOG_BACKUPS, LOG_ROTATE_WHEN, LOG_REPEAT_SUMMARY_S,
+    LOG_RING_LINES,
+)
 
+# -----------------------
+# Неблокирующий лог
+# -----------------------
+# log() только кладёт запись в очередь; запись в файл (с ротацией) и в консоль
+# делает отдельный поток QueueListener. Формат строк прежний:
+#   "YYYY-MM-DD HH:MM:SS сообщение", отладочные — с префиксом "[DEBUG] ".
 
-def log(msg: str, debug: bool = False):
-    if debug and not DEBUG_MODE:
-        return
-    ts = time.strftime("%Y-%m-%d %H:%M:%S")
-    line = f"{ts} {msg}"
-    try:
-        print(line, flush=True)
-    except Exception:
-        pass
+_debug_enabled = DEBUG_MODE
+_console_enabled = True
+
+_logger = logging.getLogger("alpr")
+_logger.setLevel(logging.DEBUG)
+_logger.propagate = False
+
+
+class _Formatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        prefix = "[DEBUG] " if record.levelno <= logging.DEBUG else ""
+        return f"{ts} {prefix}{record.getMessage()}"
+
+
+def _make_file_handler() -> logging.Handler:
+    if LOG_ROTATE_WHEN:
+        h = logging.handlers.TimedRotatingFileHandler(
+            LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUPS, encoding="utf-8", delay=True
+        )
+    else:
+        h = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=int(LOG_MAX_MB * 1024 * 1024), backupCount=LOG_BACKUPS,
+            encoding="utf-8", delay=True,
+        )
+    return h
+
+
+# -----------------------
+# Кольцевой буфер последних строк (для веб-интерфейса)
+# -----------------------
+# Каждая строка получает сквозной номер (курсор). Клиент передаёт последний
+# увиденный курсор и получает только новые строки — размер alpr.log не важен.
+_ring: deque[tuple[int, str]] = deque(maxlen=max(100, LOG_RING_LINES))
+_ring_cv = threading.Condition()
+_ring_seq = 0
+
+
+def _ring_append(line: str) -> None:
+    global _ring_seq
+    with _ring_cv:
+        _ring_seq += 1
+        _ring.append((_ring_seq, line))
+        _ring_cv.notify_all()
+
+
+class _RingHandler(logging.Handler):
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            line = self.format(record)
+            _ring_append(line)
+            events.publish("log", line)
+        except Exception:
+            self.handleError(record)
+
+
+def _prefill_ring(max_bytes: int = 256 * 1024) -> None:
+    """
+    Подхватывает хвост существующего alpr.log, чтобы после рестарта лог в UI не был пустым.
+    """
     try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(line + "\n")
+        with open(LOG_FILE, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - max_bytes))
+            chunk = f.read()
+    except FileNotFoundError:
+        return
     except Exception:
-        pass
\ No newline at end of file
+        return
+    lines = chunk.decode("utf-8", errors="replace").splitlines()
+    if size > max_bytes and lines:
+        lines = lines[1:]  # первая строка, скорее всего, обрезана
+    for line in lines[-_ring.maxlen:]:
+        if line.strip():
+            _ring_append(line.rstrip())
+
+
+def tail(cursor: int | None = None, limit: int = 500) -> dict:
+    """
+    Строки после курсора (не больше limit). Без курсора — последние limit строк.
+    reset=True — курсор слишком старый (строки вытеснены из буфера), клиенту
+    стоит перерисовать лог целиком.
+    """
+    with _ring_cv:
+        last = _ring_seq
+        first = _ring[0][0] if _ring else last + 1
+        items = list(_ring)
+    reset = cursor is None or cursor > last or cursor < first - 1
+    if reset:
+        lines = [line for _, line in items[-limit:]]
+    else:
+        # номера в буфере идут подряд, поэтому индекс вычисляется напрямую
+        start = cursor - first + 1
+        lines = [line for _, line in items[start:start + limit]]
+        last = items[start + len(lines) - 1][0] if lines else cursor
+    return {"lines": lines, "cursor": last, "reset": reset}
+
+
+def wait_for_lines(cursor: int, timeout: float) -> bool:
+    """
+    Ждёт появления строк новее cursor. True — есть новые строки.
+    """
+    with _ring_cv:
+        return _ring_cv.wait_for(lambda: _ring_seq > cursor, timeout=timeout)
+
+
+def _start_listener() -> logging.handlers.QueueListener:
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    _logger.addHandler(logging.handlers.QueueHandler(q))
+    _prefill_ring()
+    handlers = []
+    console = logging.StreamHandler()
+    console.addFilter(lambda record: _console_enabled)
+    for h in (_make_file_handler(), console, _RingHandler()):
+        h.setFormatter(_Formatter())
+        handlers.append(h)
+    listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=False)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener: logging.handlers.QueueListener) -> None:
+    # дописать хвост очереди при выходе
+    if getattr(listener, "_thread", None) is not None:
+        listener.stop()
+
+
+_listener = _start_listener()
+
+
+# -----------------------
+# Подавление повторов
+# -----------------------
+_repeat_lock = threading.Lock()
+_last_msg: str | None = None
+_last_level = logging.INFO
+_repeat_count = 0
+_repeat_since = 0.0
+
+
+def _flush_repeats_locked() -> None:
+    global _repeat_count
+    if _repeat_count:
+        _logger.log(_last_level, f"… последнее сообщение повторилось ещё {_repeat_count} раз")
+        _repeat_count = 0
+
+
+def set_debug(enabled: bool) -> None:
+    """
+    Включает/выключает отладочные сообщения без перезапуска.
+    """
+    global _debug_enabled
+    _debug_enabled = bool(enabled)
+
+
+def set_console(enabled: bool) -> None:
+    """
+    Включает/выключает вывод в консоль; файл и кольцо для веба пишутся всегда.
+    """
+    global _console_enabled
+    _console_enabled = bool(enabled)
+
+
+config.subscribe(("DEBUG_MODE",), lambda changed: set_debug(changed["DEBUG_MODE"][1]))
+
+
+def log(msg: str, debug: bool = False, level: int | None = None):
+    global _last_msg, _last_level, _repeat_count, _repeat_since
+    if debug and not _debug_enabled:
+        return
+    if level is None:
+        level = logging.DEBUG if debug else logging.INFO
+    now = time.time()
+    with _repeat_lock:
+        if msg == _last_msg:
+            if not _repeat_count:
+                _repeat_since = now
+            _repeat_count += 1
+            if now - _repeat_since < LOG_REPEAT_SUMMARY_S:
+                return
+            _flush_repeats_locked()
+            return
+        _flush_repeats_locked()
+        _last_msg = msg
+        _last_level = level
+        _logger.log(level, msg)
@@ -0,0 +1,218 @@
+# backend/metrics.py
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+
+# -----------------------
+# Метрики в формате Prometheus (без внешних зависимостей)
+# -----------------------
+# Счётчики/гистограммы обновляются под коротким lock метрики (O(log бакетов)),
+# поэтому сбор можно держать включённым постоянно. Текст для /metrics
+# собирается только при запросе; «живые» gauge (очереди и т.п.) считаются
+# колбэками в момент скрейпа.
+
+# Бакеты (сек): от долей миллисекунды (JPEG, БД) до секунд (CPAI, сквозная задержка)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: list["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _fmt_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: dict | None) -> tuple[str, ...]:
+        if not self.label_names:
+            return ()
+        labels = labels or {}
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        return []
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, n: float = 1, **labels) -> None:
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0) + n
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(self.label_names, k)} {_fmt_num(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, doc, labels=(), fn=None):
+        """
+        fn — необязательный колбэк без аргументов, вызываемый при скрейпе:
+        возвращает число или dict {tuple(значения меток): число}.
+        """
+        super().__init__(name, doc, labels)
+        self._values: dict[tuple, float] = {}
+        self._fn = fn
+
+    def set(self, v: float, **labels) -> None:
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = v
+
+    def remove(self, **labels) -> None:
+        """
+        Убирает ряд (например, остановленной камеры), чтобы скрейп не видел старое значение.
+        """
+        k = self._key(labels)
+        with self._lock:
+            self._values.pop(k, None)
+
+    def _samples(self):
+        if self._fn is not None:
+            try:
+                v = self._fn()
+            except Exception:
+                return []
+            items = list(v.items()) if isinstance(v, dict) else [((), v)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(self.label_names, k)} {_fmt_num(v)}" for k, v in items]
+
+
+class _Timer:
+    __slots__ = ("_h", "_labels", "_t0")
+
+    def __init__(self, h: "Histogram", labels: dict):
+        self._h = h
+        self._labels = labels
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._h.observe(time.perf_counter() - self._t0, **self._labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [counts по бакетам (не кумулятивно)..., +Inf, sum]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, v: float, **labels) -> None:
+        k = self._key(labels)
+        i = bisect.bisect_left(self.buckets, v)
+        with self._lock:
+            row = self._values.get(k)
+            if row is None:
+                row = self._values[k] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += v
+
+    def time(self, **labels) -> _Timer:
+        return _Timer(self, labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(k, list(row)) for k, row in self._values.items()]
+        out = []
+        for k, row in items:
+            acc = 0
+            for b, c in zip(self.buckets + (float("inf"),), row[:-1]):
+                acc += c
+                le = 'le="%s"' % _fmt_num(b)
+                out.append(f"{self.name}_bucket{_fmt_labels(self.label_names, k, le)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.label_names, k)} {_fmt_num(row[-1])}")
+            out.append(f"{self.name}_count{_fmt_labels(self.label_names, k)} {acc}")
+        return out
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    lines: list[str] = []
+    for m in metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------
+# Метрики конвейера
+# -----------------------
+DECODE_SECONDS = Histogram("alpr_decode_seconds", "RTSP frame read+decode time (reader_loop)", ("camera",))
+FRAMES_TOTAL = Counter("alpr_frames_total", "Decoded frames", ("camera",))
+CAPTURE_RESTARTS = Counter("alpr_capture_restarts_total", "Camera reader process restarts", ("camera",))
+CAMERA_FPS = Gauge("alpr_camera_fps", "Decoded frames per second", ("camera",))
+JPEG_ENCODE_SECONDS = Histogram("alpr_jpeg_encode_seconds", "JPEG encode time (to_jpeg_bytes)")
+CPAI_SECONDS = Histogram("alpr_cpai_request_seconds", "CPAI round-trip time", ("outcome",))
+DB_INSERT_SECONDS = Histogram("alpr_db_insert_seconds", "History insert time (add_history_record)", ("result",))
+MQTT_PUBLISH_SECONDS = Histogram("alpr_mqtt_publish_seconds", "MQTT publish hand-off time", ("result",))
+EVENT_LATENCY_SECONDS = Histogram("alpr_event_latency_seconds", "Frame capture to plate event latency")
+PREPROCESS_SECONDS = Histogram("alpr_preprocess_seconds", "Batch frame preprocessing time", ("backend",))
+PLATES_TOTAL = Counter("alpr_plate_events_total", "Plate events emitted", ("point",))
+WATCHLIST_HITS = Counter("alpr_watchlist_hits_total", "Watchlist alerts published", ("point",))
+
+
+def register_gauge(name: str, doc: str, fn, labels: tuple[str, ...] = ()) -> Gauge:
+    """
+    Gauge, значение которого считается колбэком при каждом скрейпе.
+    Повторная регистрация с тем же именем заменяет колбэк.
+    """
+    with _registry_lock:
+        for m in _registry:
+            if m.name == name and isinstance(m, Gauge):
+                m._fn = fn
+                return m
+    return Gauge(name, doc, labels, fn=fn)
+
+
+def observe_event(point: str, capture_ts: float | None) -> None:
+    """
+    Отмечает выпущенное событие номера и, если известно время захвата кадра, сквозную задержку.
+    """
+    PLATES_TOTAL.inc(point=point)
+    if capture_ts:
+        EVENT_LATENCY_SECONDS.observe(max(0.0, time.time() - capture_ts))
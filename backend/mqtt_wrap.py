@@ -1,30 +1,327 @@
 # backend/mqtt_wrap.py
 from __future__ import annotations
 
+import json
+import os
+import queue
 import threading
+import time
+import zlib
+from collections import deque
 import paho.mqtt.client as mqtt
 
 from backend.logger import log
-from backend.config import MQTT_BROKER, MQTT_PORT, MQTT_USER, MQTT_PASS, TOPIC_PREFIX
+from backend.config import (
+    MQTT_QUEUE_SIZE, MQTT_WORKERS,
+    MQTT_OUT_QUEUE_SIZE, MQTT_SPOOL_PATH, MQTT_SPOOL_MAX_MB, MQTT_REPLAY_RATE,
+)
 import backend.state as state
+from backend import config, metrics
+
+# Ключи настроек, которые MQTTWrap применяет на лету (переподключение / переподписка)
+LIVE_KEYS = ("MQTT_BROKER", "MQTT_PORT", "MQTT_USER", "MQTT_PASS", "TOPIC_PREFIX", "MQTT_SUBSCRIBE")
+
+
+# -----------------------
+# Исходящие сообщения
+# -----------------------
+class OutboundPublisher:
+    """
+    Исходящая очередь с отдельным потоком-отправителем.
+    Пока брокер недоступен (или ещё не досланы старые сообщения), всё пишется
+    в дисковый спул (JSONL) — порядок сохраняется. После переподключения спул
+    досылается с ограничением скорости, затем обнуляется. Доставка
+    «хотя бы один раз»: при падении посреди досылки возможны повторы.
+    Переполнение очереди в памяти: всё новое пишется в отдельный файл
+    <спул>.overflow, пока очередь не разберётся; затем он дописывается в конец
+    спула — так более новые сообщения не обгоняют ещё стоящие в очереди.
+    """
+
+    def __init__(self, client: mqtt.Client, lock: threading.Lock,
+                 spool_path: str = MQTT_SPOOL_PATH, queue_size: int = MQTT_OUT_QUEUE_SIZE,
+                 replay_rate: float = MQTT_REPLAY_RATE, spool_max_mb: float = MQTT_SPOOL_MAX_MB):
+        self.client = client
+        self._client_lock = lock
+        self.spool_path = spool_path
+        self.replay_interval = 1.0 / replay_rate if replay_rate > 0 else 0.0
+        self.spool_max_bytes = int(spool_max_mb * 1024 * 1024)
+        self._q: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._spool_offset = 0          # сколько байт спула уже дослано
+        self.overflow_path = spool_path + ".overflow"
+        self._overflow = False          # очередь переполнялась и ещё не разобрана
+        self._overflow_pending = 0
+        self._spool_pending = 0
+        self._thread: threading.Thread | None = None
+        self._spool_lock = threading.RLock()  # submit() может писать в спул из чужого потока
+        self._stats_lock = threading.Lock()
+        self._latency_ms: deque[float] = deque(maxlen=1000)
+        self._stats = {"sent": 0, "acked": 0, "spooled": 0, "replayed": 0, "failed": 0, "spool_full": 0}
+        self._merge_overflow()          # остаток после падения процесса
+        self._spool_pending = self._count_spool()
+
+    def _count_spool(self) -> int:
+        try:
+            with open(self.spool_path, "rb") as f:
+                return sum(1 for _ in f)
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            log(f"⚠️ MQTT спул: не удалось прочитать {self.spool_path}: {e}")
+            return 0
+
+    def _bump(self, key: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[key] += n
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="mqtt-publisher", daemon=True)
+            self._thread.start()
+        if self._spool_pending:
+            log(f"📦 MQTT спул: {self._spool_pending} неотправленных сообщений ждут переподключения")
+
+    def submit(self, topic: str, payload, qos: int, retain: bool) -> bool:
+        item = (topic, payload, qos, retain, time.time())
+        with self._spool_lock:
+            if not self._overflow:
+                try:
+                    self._q.put_nowait(item)
+                    return True
+                except queue.Full:
+                    # очередь в памяти переполнена — на диск, не теряем; всё следующее
+                    # туда же, пока очередь не разберётся (порядок сохраняется)
+                    self._overflow = True
+            return self._spool([item], overflow=True)
+
+    def _merge_overflow(self) -> None:
+        """
+        Дописывает <спул>.overflow в конец спула (вызывается, когда очередь разобрана).
+        """
+        with self._spool_lock:
+            try:
+                with open(self.overflow_path, "rb") as src:
+                    data = src.read()
+                if data:
+                    with open(self.spool_path, "ab") as dst:
+                        dst.write(data)
+                    self._spool_pending += data.count(b"\n")
+                os.remove(self.overflow_path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                log(f"❌ MQTT спул: не удалось перенести {self.overflow_path}: {e}")
+                return
+            self._overflow = False
+            self._overflow_pending = 0
+
+    def on_publish(self, client, userdata, mid):
+        self._bump("acked")
+
+    # -----------------------
+    # Отправка
+    # -----------------------
+    def _send(self, topic: str, payload, qos: int, retain: bool, enq_ts: float) -> bool:
+        t0 = time.perf_counter()
+        try:
+            with self._client_lock:
+                info = self.client.publish(topic, payload, qos=qos, retain=retain)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                metrics.MQTT_PUBLISH_SECONDS.observe(time.perf_counter() - t0, result="fail")
+                return False
+        except Exception as e:
+            metrics.MQTT_PUBLISH_SECONDS.observe(time.perf_counter() - t0, result="fail")
+            log(f"⚠️ Ошибка публикации MQTT: {e}", debug=True)
+            return False
+        metrics.MQTT_PUBLISH_SECONDS.observe(time.perf_counter() - t0, result="ok")
+        with self._stats_lock:
+            self._stats["sent"] += 1
+            self._latency_ms.append((time.time() - enq_ts) * 1000.0)
+        return True
+
+    def _spool(self, items, overflow: bool = False) -> bool:
+        path = self.overflow_path if overflow else self.spool_path
+        try:
+            size = sum(os.path.getsize(p) for p in (self.spool_path, self.overflow_path) if os.path.exists(p))
+            if self.spool_max_bytes and size >= self.spool_max_bytes:
+                self._bump("spool_full", len(items))
+                log(f"❌ MQTT спул переполнен ({self.spool_path}), сообщения потеряны: {len(items)}")
+                return False
+            with self._spool_lock, open(path, "a", encoding="utf-8") as f:
+                for topic, payload, qos, retain, enq_ts in items:
+                    if isinstance(payload, (bytes, bytearray, memoryview)):
+                        payload = bytes(payload).decode("utf-8", errors="replace")
+                    f.write(json.dumps({"topic": topic, "payload": payload, "qos": qos,
+                                        "retain": retain, "ts": enq_ts}, ensure_ascii=False) + "\n")
+                if overflow:
+                    self._overflow_pending += len(items)
+                else:
+                    self._spool_pending += len(items)
+            self._bump("spooled", len(items))
+            return True
+        except Exception as e:
+            self._bump("failed", len(items))
+            log(f"❌ MQTT спул: ошибка записи: {e}")
+            return False
+
+    def _replay(self) -> None:
+        """
+        Досылает спул по порядку, не быстрее replay_rate. Прерывается при обрыве связи.
+        """
+        try:
+            f = open(self.spool_path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            self._spool_pending = 0
+            self._spool_offset = 0
+            return
+        sent = 0
+        with f:
+            f.seek(self._spool_offset)
+            while state.MQTT_CONNECTED:
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    self._spool_offset = f.tell()
+                    with self._spool_lock:
+                        self._spool_pending -= 1
+                    continue
+                if not self._send(rec["topic"], rec["payload"], rec.get("qos", config.MQTT_QOS),
+                                  rec.get("retain", False), rec.get("ts") or time.time()):
+                    return
+                self._spool_offset = f.tell()
+                with self._spool_lock:
+                    self._spool_pending -= 1
+                sent += 1
+                if self.replay_interval:
+                    time.sleep(self.replay_interval)
+        self._bump("replayed", sent)
+        if not state.MQTT_CONNECTED:
+            return  # связь пропала — продолжим с того же смещения
+        # всё дослано — обнуляем спул (если за время досылки не дописали новое)
+        with self._spool_lock:
+            try:
+                if os.path.getsize(self.spool_path) > self._spool_offset:
+                    return
+                os.remove(self.spool_path)
+            except FileNotFoundError:
+                pass
+            self._spool_offset = 0
+            self._spool_pending = 0
+        log("📦 MQTT спул дослан", debug=True)
+
+    def _run(self):
+        while True:
+            # очередь разобрана (прошлая пачка уже отправлена или в спуле) —
+            # переполнение, т.е. более новые сообщения, встаёт в конец спула
+            if self._overflow and self._q.empty():
+                self._merge_overflow()
+            try:
+                batch = [self._q.get(timeout=0.5)]
+            except queue.Empty:
+                batch = []
+            # забираем всё, что накопилось, одной пачкой
+            while batch and len(batch) < 256:
+                try:
+                    batch.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+
+            if state.MQTT_CONNECTED and self._spool_pending:
+                self._replay()
+
+            if not batch:
+                continue
+            if not state.MQTT_CONNECTED or self._spool_pending:
+                self._spool(batch)
+                continue
+            for i, item in enumerate(batch):
+                if not self._send(*item):
+                    # связь оборвалась посреди пачки — остаток в спул, порядок сохраняется
+                    self._spool(batch[i:])
+                    break
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            out = dict(self._stats)
+            lat = sorted(self._latency_ms)
+        out["queue_depth"] = self._q.qsize()
+        out["backlog"] = self._spool_pending + self._overflow_pending
+        if lat:
+            out["latency_p50_ms"] = round(lat[len(lat) // 2], 1)
+            out["latency_p95_ms"] = round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 1)
+        return out
 
 
 class MQTTWrap:
     """
     Обёртка над paho-mqtt для совместимости со старым модулем ALPR_OLD.py.
+
+    Входящие сообщения не обрабатываются в сетевом потоке paho: _on_message
+    только находит обработчик по фильтру топика и кладёт сообщение в очередь
+    одного из воркеров (воркер выбирается по хэшу топика, так что сообщения
+    одной точки обрабатываются по порядку). Медленное распознавание не
+    задерживает keepalive. При переполнении очереди выбрасывается самое
+    старое сообщение — свежий кадр важнее.
     """
 
-    def __init__(self, on_message_cb=None):
-        self.client = mqtt.Client()
+    def __init__(self, on_message_cb=None, workers: int = MQTT_WORKERS, queue_size: int = MQTT_QUEUE_SIZE,
+                 client=None):
+        # client — подмена paho.Client (стенд backend/bench.py); по умолчанию настоящий
+        self.client = client or mqtt.Client()
         self.on_message_cb = on_message_cb
         self._lock = threading.Lock()
 
-        if MQTT_USER:
-            self.client.username_pw_set(MQTT_USER, MQTT_PASS or "")
+        # (фильтр относительно TOPIC_PREFIX, полный фильтр, обработчик)
+        self._handlers: list[tuple[str, str, object]] = []
+        if on_message_cb:
+            for flt in config.MQTT_SUBSCRIBE:
+                self.add_handler(flt, on_message_cb)
+
+        self._queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(max(1, workers))]
+        self._workers: list[threading.Thread] = []
+        self._stats_lock = threading.Lock()
+        self._stats = {"received": 0, "processed": 0, "dropped": 0, "unrouted": 0, "errors": 0}
+        self._per_topic: dict[str, int] = {}
+
+        if config.MQTT_USER:
+            self.client.username_pw_set(config.MQTT_USER, config.MQTT_PASS or "")
+
+        self.outbound = OutboundPublisher(self.client, self._lock)
 
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
+        self.client.on_publish = self.outbound.on_publish
+
+    # -----------------------
+    # Маршрутизация
+    # -----------------------
+
+    def add_handler(self, topic_filter: str, handler) -> None:
+        """
+        Регистрирует обработчик handler(client, userdata, msg) для фильтра
+        (относительно TOPIC_PREFIX, допускаются + и #). Подписка оформляется
+        при подключении; если уже подключены — сразу.
+        """
+        full = f"{config.TOPIC_PREFIX}/{topic_filter}"
+        self._handlers.append((topic_filter, full, handler))
+        if state.MQTT_CONNECTED:
+            try:
+                self.client.subscribe(full)
+            except Exception as e:
+                log(f"⚠️ Ошибка подписки на {full}: {e}")
+
+    def _route(self, topic: str):
+        for flt, full, handler in self._handlers:
+            if mqtt.topic_matches_sub(full, topic):
+                return flt, handler
+        return None, None
+
+    def _bump(self, key: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[key] += n
 
     # -----------------------
     # Внутренние коллбеки
@@ -32,14 +329,14 @@ class MQTTWrap:
 
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            log(f"🔌 MQTT подключен ({MQTT_BROKER}:{MQTT_PORT})")
+            log(f"🔌 MQTT подключен ({config.MQTT_BROKER}:{config.MQTT_PORT})")
             state.set_mqtt_connected(True)
-            try:
-                topic = f"{TOPIC_PREFIX}/#"
-                client.subscribe(topic)
-                log(f"📡 Подписка на {topic}")
-            except Exception as e:
-                log(f⚠️ Ошибка подписки: {e}")
+            for _, full, _ in self._handlers:
+                try:
+                    client.subscribe(full)
+                    log(f"📡 Подписка на {full}")
+                except Exception as e:
+                    log(f"⚠️ Ошибка подписки: {e}")
         else:
             log(f"❌ MQTT ошибка подключения: rc={rc}")
             state.set_mqtt_connected(False)
@@ -49,11 +346,54 @@ class MQTTWrap:
         log("🔌 MQTT отключен")
 
     def _on_message(self, client, userdata, msg):
-        if self.on_message_cb:
+        # Сетевой поток paho: только маршрутизация и постановка в очередь
+        self._bump("received")
+        flt, handler = self._route(msg.topic)
+        if handler is None:
+            self._bump("unrouted")
+            return
+        q = self._queues[zlib.crc32(msg.topic.encode("utf-8")) % len(self._queues)]
+        item = (handler, client, userdata, msg)
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            try:
+                q.get_nowait()
+                q.task_done()
+            except queue.Empty:
+                pass
+            self._bump("dropped")
+            log(f"⚠️ MQTT: очередь переполнена, отброшено старое сообщение ({msg.topic})", debug=True)
             try:
-                self.on_message_cb(client, userdata, msg)
+                q.put_nowait(item)
+            except queue.Full:
+                self._bump("dropped")
+        with self._stats_lock:
+            self._per_topic[flt] = self._per_topic.get(flt, 0) + 1
+
+    def _worker(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            if item is None:
+                q.task_done()
+                return
+            handler, client, userdata, msg = item
+            try:
+                handler(client, userdata, msg)
+                self._bump("processed")
             except Exception as e:
+                self._bump("errors")
                 log(f"⚠️ Ошибка обработки MQTT-сообщения: {e}", debug=True)
+            finally:
+                q.task_done()
+
+    def _start_workers(self):
+        if self._workers:
+            return
+        for i, q in enumerate(self._queues):
+            t = threading.Thread(target=self._worker, args=(q,), name=f"mqtt-worker-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
 
     # -----------------------
     # Публичные методы
@@ -63,41 +403,102 @@ class MQTTWrap:
         """
         Запускает MQTT loop (по умолчанию в отдельном потоке).
         """
+        self._start_workers()
+        self.outbound.start()
         try:
-            self.client.connect(MQTT_BROKER, MQTT_PORT, keepalive=30)
+            self.client.connect(config.MQTT_BROKER, config.MQTT_PORT, keepalive=30)
         except Exception as e:
             log(f"❌ Ошибка подключения к MQTT: {e}")
             state.set_mqtt_connected(False)
-            return
+            # paho сам переподключится в loop, а исходящие пока копятся в спуле
+            try:
+                self.client.connect_async(config.MQTT_BROKER, config.MQTT_PORT, keepalive=30)
+            except Exception:
+                return
 
         if loop_async:
             self.client.loop_start()
         else:
             self.client.loop_forever()
 
-    def publish(self, topic: str, payload: str, retain: bool = False) -> bool:
+    def publish(self, topic: str, payload: str, retain: bool = False, qos: int | None = None) -> bool:
         """
-        Публикация в MQTT. Возвращает True при успехе.
+        Публикация в MQTT через исходящую очередь. Возвращает True, если сообщение
+        принято (отправлено или сохранено в спул до восстановления связи).
         """
-        try:
+        full_topic = f"{config.TOPIC_PREFIX}/{topic}"
+        ok = self.outbound.submit(full_topic, payload, config.MQTT_QOS if qos is None else qos, retain)
+        log(f"➡️ MQTT {full_topic} = {payload}", debug=True)
+        return ok
+
+    def apply_config(self, changed: dict) -> None:
+        """
+        Подписчик config.reload(): смена префикса/списка топиков — переподписка
+        без разрыва; смена брокера или учётных данных — переподключение только
+        MQTT-клиента. Очереди, воркеры и спул не трогаются: исходящие на время
+        переподключения копятся в спуле.
+        """
+        if "TOPIC_PREFIX" in changed or "MQTT_SUBSCRIBE" in changed:
+            old_full = [full for _, full, _ in self._handlers]
+            handlers = []
+            for flt, _, handler in self._handlers:
+                if handler is self.on_message_cb:
+                    continue  # фильтры из настроек пересобираются ниже
+                handlers.append((flt, f"{config.TOPIC_PREFIX}/{flt}", handler))
+            if self.on_message_cb:
+                for flt in config.MQTT_SUBSCRIBE:
+                    handlers.append((flt, f"{config.TOPIC_PREFIX}/{flt}", self.on_message_cb))
+            self._handlers = handlers  # атомарная замена списка для _route
+            if state.MQTT_CONNECTED:
+                new_full = [full for _, full, _ in handlers]
+                for full in old_full:
+                    if full not in new_full:
+                        self.client.unsubscribe(full)
+                for full in new_full:
+                    if full not in old_full:
+                        self.client.subscribe(full)
+            log(f"🔁 MQTT: подписки обновлены ({', '.join(full for _, full, _ in handlers)})")
+
+        if any(k in changed for k in ("MQTT_BROKER", "MQTT_PORT", "MQTT_USER", "MQTT_PASS")):
+            log(f"🔁 MQTT: переподключение к {config.MQTT_BROKER}:{config.MQTT_PORT}")
             with self._lock:
-                full_topic = f"{TOPIC_PREFIX}/{topic}"
-                self.client.publish(full_topic, payload, retain=retain)
-            log(f"➡️ MQTT {full_topic} = {payload}", debug=True)
-            return True
-        except Exception as e:
-            log(f"⚠️ Ошибка публикации MQTT: {e}")
-            return False
+                if config.MQTT_USER:
+                    self.client.username_pw_set(config.MQTT_USER, config.MQTT_PASS or "")
+                else:
+                    self.client.username_pw_set(None)
+            try:
+                self.client.disconnect()
+                self.client.loop_stop()
+            except Exception:
+                pass
+            # _on_connect переподпишет все фильтры
+            self.client.connect_async(config.MQTT_BROKER, config.MQTT_PORT, keepalive=30)
+            self.client.loop_start()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            out = dict(self._stats)
+            out["per_topic"] = dict(self._per_topic)
+        out["queue_depth"] = sum(q.qsize() for q in self._queues)
+        out["workers"] = len(self._queues)
+        out["outbound"] = self.outbound.stats()
+        return out
 
     def stop(self):
         """
-        Останавливает MQTT loop.
+        Останавливает MQTT loop и воркеры.
         """
         try:
             self.client.loop_stop()
             self.client.disconnect()
         except Exception:
             pass
+        for q in self._queues:
+            try:
+                q.put_nowait(None)
+            except queue.Full:
+                pass
+        self._workers = []
 
 
 # -----------------------
@@ -107,18 +508,45 @@ class MQTTWrap:
 _mqtt_wrap: MQTTWrap | None = None
 
 
-def start_mqtt(on_message_cb=None) -> MQTTWrap:
+def start_mqtt(on_message_cb=None, client=None) -> MQTTWrap:
     global _mqtt_wrap
     if _mqtt_wrap is None:
-        _mqtt_wrap = MQTTWrap(on_message_cb=on_message_cb)
+        _mqtt_wrap = MQTTWrap(on_message_cb=on_message_cb, client=client)
         _mqtt_wrap.start()
+        config.subscribe(LIVE_KEYS, _mqtt_wrap.apply_config)
     return _mqtt_wrap
 
 
-def publish_message(topic: str, payload: str, retain: bool = False) -> bool:
+def publish_message(topic: str, payload: str, retain: bool = False, qos: int | None = None) -> bool:
     """
     Упрощённая публикация без явного доступа к объекту.
     """
     if _mqtt_wrap:
-        return _mqtt_wrap.publish(topic, payload, retain)
+        return _mqtt_wrap.publish(topic, payload, retain, qos=qos)
     return False
+
+
+def mqtt_stats() -> dict:
+    """
+    Счётчики входящей и исходящей очередей (для /api/status).
+    """
+    return _mqtt_wrap.stats() if _mqtt_wrap else {}
+
+
+def _ingest_depth() -> dict:
+    if _mqtt_wrap is None:
+        return {}
+    return {(str(i),): q.qsize() for i, q in enumerate(_mqtt_wrap._queues)}
+
+
+def _outbound_depth() -> dict:
+    if _mqtt_wrap is None:
+        return {}
+    out = _mqtt_wrap.outbound.stats()
+    return {("memory",): out["queue_depth"], ("spool",): out["backlog"]}
+
+
+metrics.register_gauge("alpr_mqtt_ingest_queue_depth", "Inbound MQTT messages waiting per worker",
+                       _ingest_depth, ("worker",))
+metrics.register_gauge("alpr_mqtt_outbound_queue_depth", "Outbound MQTT messages not yet sent",
+                       _outbound_depth, ("queue",))
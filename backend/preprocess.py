@@ -0,0 +1,405 @@
+# backend/preprocess.py
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+
+from backend import config, metrics
+
+# -----------------------
+# Пакетный препроцессинг кадров (все полосы за один проход)
+# -----------------------
+# Кадры с нескольких камер собираются в один массив (N, H, W, C) и
+# обрабатываются векторно: crop → resize → BGR→GRAY → шумоподавление → CLAHE.
+# Питоновские накладные расходы (таблицы индексов, весов) считаются один раз
+# на сочетание размеров и кэшируются, а не на каждый кадр.
+#
+# Вся арифметика целочисленная с фиксированной точкой (как INTER_LINEAR в
+# OpenCV), поэтому бэкенды numpy и torch (CPU/GPU) дают побитово одинаковый
+# результат. torch используется, только если включён use_torch_gpu_prep и
+# он установлен; импортируется лениво.
+#
+# Модуль тянет numpy — импортировать его из функций, которым он нужен, а не
+# при старте (см. backend/startup_profile.py).
+
+_FP_BITS = 11                 # веса интерполяции: 0..2048
+_FP_ONE = 1 << _FP_BITS
+_FP_ROUND2 = 1 << (2 * _FP_BITS - 1)
+
+# BGR → GRAY: коэффициенты OpenCV в 14-битной фиксированной точке (сумма 16384)
+_GRAY_B, _GRAY_G, _GRAY_R = 1868, 9617, 4899
+
+
+# -----------------------
+# Бэкенды: numpy и torch с одинаковым набором операций
+# -----------------------
+class _NumpyOps:
+    name = "numpy"
+
+    def asarray(self, a):
+        return a
+
+    def table(self, a: np.ndarray):
+        return a
+
+    def i32(self, a):
+        return a.astype(np.int32)
+
+    def u8(self, a):
+        return a.astype(np.uint8)
+
+    def idx(self, a):
+        return a.astype(np.int64)
+
+    def permute(self, a, axes):
+        return a.transpose(axes)
+
+    def bincount(self, a, minlength: int):
+        return np.bincount(a.reshape(-1), minlength=minlength)
+
+    def cumsum(self, a, axis: int):
+        return np.cumsum(a, axis=axis)
+
+    def sum(self, a, axis: int):
+        return a.sum(axis=axis)
+
+    def clip_max(self, a, hi):
+        return np.minimum(a, hi)
+
+    def clip_min(self, a, lo):
+        return np.maximum(a, lo)
+
+    def arange(self, n: int):
+        return np.arange(n)
+
+    def numpy(self, a) -> np.ndarray:
+        return a
+
+
+class _TorchOps:
+    name = "torch"
+
+    def __init__(self, device):
+        import torch
+        self.torch = torch
+        self.device = device
+
+    def asarray(self, a):
+        return self.torch.from_numpy(np.ascontiguousarray(a)).to(self.device)
+
+    def table(self, a: np.ndarray):
+        return self.torch.from_numpy(np.ascontiguousarray(a)).to(self.device)
+
+    def i32(self, a):
+        return a.to(self.torch.int32)
+
+    def u8(self, a):
+        return a.to(self.torch.uint8)
+
+    def idx(self, a):
+        return a.to(self.torch.int64)
+
+    def permute(self, a, axes):
+        return a.permute(*axes)
+
+    def bincount(self, a, minlength: int):
+        return self.torch.bincount(a.reshape(-1), minlength=minlength)
+
+    def cumsum(self, a, axis: int):
+        return self.torch.cumsum(a, dim=axis)
+
+    def sum(self, a, axis: int):
+        return a.sum(dim=axis)
+
+    def clip_max(self, a, hi):
+        return a.clamp(max=hi)
+
+    def clip_min(self, a, lo):
+        return a.clamp(min=lo)
+
+    def arange(self, n: int):
+        return self.torch.arange(n, device=self.device)
+
+    def numpy(self, a) -> np.ndarray:
+        return a.cpu().numpy()
+
+
+def get_backend(name: str = "auto"):
+    """
+    "numpy", "torch" или "auto" (torch, если включён use_torch_gpu_prep и он установлен).
+    """
+    if name == "numpy":
+        return _NumpyOps()
+    if name == "torch" or (name == "auto" and config.USE_TORCH_GPU_PREP):
+        try:
+            return _TorchOps(config.DEVICE if config.TORCH_AVAILABLE else "cpu")
+        except ImportError:
+            if name == "torch":
+                raise
+    return _NumpyOps()
+
+
+# -----------------------
+# Таблицы индексов/весов (кэш по размерам)
+# -----------------------
+_tables: dict[tuple, tuple] = {}
+_tables_lock = threading.Lock()
+
+
+def _axis_table(src: int, dst: int):
+    """
+    Билинейная выборка по одной оси (центры пикселей, как в OpenCV):
+    индексы i0/i1 и веса w0/w1 в фиксированной точке.
+    """
+    pos = (np.arange(dst, dtype=np.float64) + 0.5) * (src / dst) - 0.5
+    pos = np.clip(pos, 0.0, src - 1)
+    i0 = np.floor(pos).astype(np.int64)
+    i1 = np.minimum(i0 + 1, src - 1)
+    w1 = np.rint((pos - i0) * _FP_ONE).astype(np.int32)
+    return i0, i1, (_FP_ONE - w1).astype(np.int32), w1
+
+
+def _tile_table(size: int, tile: int, tiles: int):
+    """
+    Для CLAHE: соседние тайлы каждого пикселя и веса между их центрами.
+    """
+    pos = (np.arange(size, dtype=np.float64) + 0.5) / tile - 0.5
+    pos = np.clip(pos, 0.0, tiles - 1)
+    t0 = np.floor(pos).astype(np.int64)
+    t1 = np.minimum(t0 + 1, tiles - 1)
+    w1 = np.rint((pos - t0) * _FP_ONE).astype(np.int32)
+    return t0, t1, (_FP_ONE - w1).astype(np.int32), w1
+
+
+def _cached(key: tuple, build):
+    with _tables_lock:
+        t = _tables.get(key)
+        if t is None:
+            t = _tables[key] = build()
+        return t
+
+
+# -----------------------
+# Векторные операции над пакетом
+# -----------------------
+def _resize(ops, batch, dst_w: int, dst_h: int):
+    """
+    batch: (N, H, W, C) uint8 → (N, dst_h, dst_w, C) uint8.
+    """
+    _, h, w, _ = batch.shape
+    if (h, w) == (dst_h, dst_w):
+        return batch
+    (y0, y1, wy0, wy1), (x0, x1, wx0, wx1) = _cached(
+        ("resize", ops.name, h, w, dst_h, dst_w),
+        lambda: tuple(tuple(ops.table(a) for a in t) for t in (_axis_table(h, dst_h), _axis_table(w, dst_w))),
+    )
+    src = ops.i32(batch)
+    rows = src[:, y0] * wy0[None, :, None, None] + src[:, y1] * wy1[None, :, None, None]
+    out = rows[:, :, x0] * wx0[None, None, :, None] + rows[:, :, x1] * wx1[None, None, :, None]
+    return ops.u8((out + _FP_ROUND2) >> (2 * _FP_BITS))
+
+
+def _to_gray(ops, batch):
+    """
+    (N, H, W, 3) BGR → (N, H, W, 1).
+    """
+    src = ops.i32(batch)
+    g = (src[..., 0] * _GRAY_B + src[..., 1] * _GRAY_G + src[..., 2] * _GRAY_R + (1 << 13)) >> 14
+    return ops.u8(g)[..., None]
+
+
+def _denoise(ops, batch):
+    """
+    Гаусс 3×3 ([1,2,1]⊗[1,2,1]/16), края — повтор крайнего пикселя.
+    """
+    _, h, w, _ = batch.shape
+    ys, xs = _cached(
+        ("pad", ops.name, h, w),
+        lambda: (ops.table(np.clip(np.arange(-1, h + 1), 0, h - 1)), ops.table(np.clip(np.arange(-1, w + 1), 0, w - 1))),
+    )
+    p = ops.i32(batch)[:, ys][:, :, xs]
+    v = p[:, :-2] + 2 * p[:, 1:-1] + p[:, 2:]
+    hsum = v[:, :, :-2] + 2 * v[:, :, 1:-1] + v[:, :, 2:]
+    return ops.u8((hsum + 8) >> 4)
+
+
+def _clahe(ops, batch, clip: float, grid: tuple[int, int]):
+    """
+    CLAHE по каждому каналу: гистограммы всех тайлов всех кадров — одним
+    bincount, клиппинг с равномерным перераспределением, LUT по CDF и
+    билинейная интерполяция между четырьмя соседними тайлами.
+    """
+    n, h, w, c = batch.shape
+    gy, gx = grid
+    th, tw = -(-h // gy), -(-w // gx)
+    area = th * tw
+    limit = max(1, int(clip * area / 256))
+
+    def build():
+        py = np.clip(np.arange(gy * th), 0, h - 1)
+        px = np.clip(np.arange(gx * tw), 0, w - 1)
+        return (ops.table(py), ops.table(px)) + tuple(ops.table(a) for a in _tile_table(h, th, gy)) \
+            + tuple(ops.table(a) for a in _tile_table(w, tw, gx))
+
+    py, px, ty0, ty1, wy0, wy1, tx0, tx1, wx0, wx1 = _cached(("clahe", ops.name, h, w, gy, gx), build)
+
+    m = n * c
+    planes = ops.permute(batch, (0, 3, 1, 2)).reshape(m, h, w)            # (M, H, W)
+    padded = ops.idx(planes[:, py][:, :, px])                             # (M, gy*th, gx*tw)
+    tiles = ops.permute(padded.reshape(m, gy, th, gx, tw), (0, 1, 3, 2, 4)).reshape(m * gy * gx, area)
+    keys = tiles + (ops.arange(m * gy * gx) * 256)[:, None]
+    hist = ops.bincount(keys, minlength=m * gy * gx * 256).reshape(m * gy * gx, 256)
+
+    excess = ops.sum(ops.clip_min(hist - limit, 0), axis=1)
+    hist = ops.clip_max(hist, limit) + (excess // 256)[:, None]
+    # остаток — по одному в каждый step-й бин, как в OpenCV
+    rem = (excess % 256)[:, None]
+    step = ops.clip_min(256 // ops.clip_min(rem, 1), 1)
+    bins = ops.arange(256)[None, :]
+    hist = hist + ((bins % step == 0) & (bins // step < rem))
+    cdf = ops.cumsum(hist, axis=1)
+    lut = ((cdf * 255 + area // 2) // area).reshape(m, gy, gx, 256)
+    lut = ops.i32(ops.clip_max(lut, 255))
+
+    mi = ops.arange(m)[:, None, None]
+    v = ops.idx(planes)
+    a = ty0[None, :, None]
+    b = ty1[None, :, None]
+    l = tx0[None, None, :]
+    r = tx1[None, None, :]
+    top = lut[mi, a, l, v] * wx0[None, None, :] + lut[mi, a, r, v] * wx1[None, None, :]
+    bot = lut[mi, b, l, v] * wx0[None, None, :] + lut[mi, b, r, v] * wx1[None, None, :]
+    out = (top * wy0[None, :, None] + bot * wy1[None, :, None] + _FP_ROUND2) >> (2 * _FP_BITS)
+    return ops.permute(ops.u8(out).reshape(n, c, h, w), (0, 2, 3, 1))
+
+
+# -----------------------
+# Публичный интерфейс
+# -----------------------
+class Preprocessor:
+    """
+    Пакетный препроцессор кадров со всех камер.
+
+    size       — (ширина, высота) результата
+    gray       — BGR → оттенки серого (C=1)
+    denoise    — гауссово сглаживание 3×3
+    clahe      — выравнивание контраста (для цветных кадров — по каждому каналу)
+    backend    — "auto" | "numpy" | "torch"
+    """
+
+    def __init__(self, size: tuple[int, int] | None = None, gray: bool | None = None,
+                 denoise: bool | None = None, clahe: bool | None = None,
+                 clahe_clip: float | None = None, clahe_grid: tuple[int, int] = (8, 8),
+                 backend: str = "auto"):
+        self.size = tuple(size or (config.PREP_WIDTH, config.PREP_HEIGHT))
+        self.gray = config.PREP_GRAY if gray is None else gray
+        self.denoise = config.PREP_DENOISE if denoise is None else denoise
+        self.clahe = config.PREP_CLAHE if clahe is None else clahe
+        self.clahe_clip = config.PREP_CLAHE_CLIP if clahe_clip is None else clahe_clip
+        self.clahe_grid = tuple(clahe_grid)
+        self.ops = get_backend(backend)
+
+    def run(self, frames: list, rois: list | None = None, as_numpy: bool = True):
+        """
+        frames — список кадров (H, W, 3) BGR или (H, W) uint8, размеры могут различаться;
+        rois — необязательный список (x, y, w, h) или None на каждый кадр.
+        Возвращает (N, высота, ширина, C) uint8; порядок кадров сохраняется.
+        """
+        if not frames:
+            return np.zeros((0, self.size[1], self.size[0], 1 if self.gray else 3), dtype=np.uint8)
+        with metrics.PREPROCESS_SECONDS.time(backend=self.ops.name):
+            # crop — срез без копии; кадры одного размера обрабатываются одним пакетом
+            groups: dict[tuple, list[int]] = {}
+            views = []
+            for i, f in enumerate(frames):
+                if f.ndim == 2:
+                    f = f[:, :, None]
+                roi = rois[i] if rois else None
+                if roi:
+                    x, y, w, h = roi
+                    f = f[y:y + h, x:x + w]
+                views.append(f)
+                groups.setdefault(f.shape, []).append(i)
+
+            dst_w, dst_h = self.size
+            out_c = 1 if self.gray else max(v.shape[2] for v in views)
+            resized = [None] * len(frames)
+            for shape, idxs in groups.items():
+                batch = self.ops.asarray(np.stack([views[i] for i in idxs]))
+                batch = _resize(self.ops, batch, dst_w, dst_h)
+                if self.gray and shape[2] == 3:
+                    batch = _to_gray(self.ops, batch)
+                for j, i in enumerate(idxs):
+                    resized[i] = batch[j]
+
+            batch = resized[0][None] if len(resized) == 1 else self._stack(resized, out_c)
+            if self.denoise:
+                batch = _denoise(self.ops, batch)
+            if self.clahe:
+                batch = _clahe(self.ops, batch, self.clahe_clip, self.clahe_grid)
+            return self.ops.numpy(batch) if as_numpy else batch
+
+    def _stack(self, items: list, channels: int):
+        if self.ops.name == "torch":
+            t = self.ops.torch
+            return t.stack([x if x.shape[-1] == channels else x.expand(*x.shape[:-1], channels) for x in items])
+        return np.stack([x if x.shape[-1] == channels else np.repeat(x, channels, axis=-1) for x in items])
+
+
+_default: Preprocessor | None = None
+
+PREP_KEYS = ("USE_TORCH_GPU_PREP", "PREP_WIDTH", "PREP_HEIGHT", "PREP_GRAY", "PREP_DENOISE", "PREP_CLAHE",
+             "PREP_CLAHE_CLIP")
+
+
+def preprocess(frames: list, rois: list | None = None):
+    """
+    Пакет кадров через препроцессор с параметрами из настроек.
+    """
+    global _default
+    pre = _default
+    if pre is None:
+        pre = _default = Preprocessor()
+    return pre.run(frames, rois)
+
+
+def _reset_default(changed) -> None:
+    # следующий пакет соберёт препроцессор с новыми настройками (и бэкендом)
+    global _default
+    _default = None
+
+
+config.subscribe(PREP_KEYS, _reset_default)
+
+
+def batch_from_buffers(buffers: dict) -> tuple[list, list, np.ndarray | None]:
+    """
+    Последние кадры из FrameBuffer'ов {ключ: FrameBuffer} → (ключи, ts, пакет).
+    Кадры читаются без копии (view на слот shared memory при capture.mode =
+    "process"): пакет всё равно пишется в новый массив. Если за время обработки
+    кольцо перезаписало слот, пакет пересобирается из копий.
+    """
+    keys, stamps, frames, held = [], [], [], []
+    for key, fb in buffers.items():
+        frame, ts, token = fb.view()
+        if frame is None:
+            continue
+        keys.append(key)
+        stamps.append(ts)
+        frames.append(frame)
+        held.append((fb, token))
+    if not frames:
+        return keys, stamps, None
+    batch = preprocess(frames)
+    if all(fb.still_valid(token) for fb, token in held):
+        return keys, stamps, batch
+    keys, stamps, frames = [], [], []
+    for key, fb in buffers.items():
+        frame, ts = fb.get()
+        if frame is None:
+            continue
+        keys.append(key)
+        stamps.append(ts)
+        frames.append(frame)
+    return keys, stamps, (preprocess(frames) if frames else None)
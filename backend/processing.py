@@ -4,60 +4,114 @@ from __future__ import annotations
 import time
 from datetime import datetime
 
-from backend import db, text_utils, state, gates
+from backend import access, cluster, db, events, evidence, metrics, text_utils, gates, tracing, tracker, watchlist
 from backend.logger import log
 from backend.mqtt_wrap import publish_message
 
 
-def handle_recognized_plate(point: str, plate_raw: str, ts: int | None = None):
+def handle_recognized_plate(point: str, plate_raw: str, ts: int | None = None, capture_ts: float | None = None,
+                            confidence: float | None = None, bbox=None, image=None, direction: str | None = None,
+                            client=None, open_topic: str | None = None):
     """
-    Обрабатывает распознанный номер (от CPAI).
+    Обрабатывает распознанный номер (от CPAI) — единый конвейер для кадров по
+    MQTT (ALPR.py), кадров RTSP-камер (sampler.py) и cpai.handle_cpai_result.
     Включает:
       - нормализацию,
       - достройку региона (по базе people.db),
-      - проверку повторов,
+      - проверку по списку наблюдения (тревога в MQTT — на каждое чтение, не только на событие),
+      - трекер проезда (одно событие на машину; confidence/bbox от CPAI — для связывания чтений),
+      - вызов логики управления воротами (проверка allowlist),
       - сохранение в историю,
       - публикацию в MQTT,
-      - вызов логики управления воротами.
+      - кроп кадра вокруг номера и миниатюру (image — кадр или JPEG, если есть) — в фоне.
+    direction — направление камеры (IN/OUT), если трекер не определил его по линии точки;
+    client/open_topic — OPEN-команда воротам через MQTT (gates.handle_plate).
+    Шаги пишутся span'ами в текущую трассу кадра (или в новую, если её нет).
     """
-    plate = text_utils.normalize_text(plate_raw)
-    if not plate:
-        log(f"⚠️ Пустой или некорректный номер: {plate_raw}")
+    if not cluster.owns(point):
+        log(f"🧭 Номер {plate_raw} @ {point} пропущен: точка арендована другим узлом", debug=True)
         return
+    with tracing.trace(point, capture_ts):
+        _handle_recognized_plate(point, plate_raw, ts, capture_ts, confidence, bbox, image, direction, client,
+                                 open_topic)
+
+
+def _handle_recognized_plate(point: str, plate_raw: str, ts: int | None, capture_ts: float | None,
+                             confidence: float | None, bbox, image, direction: str | None = None, client=None,
+                             open_topic: str | None = None):
+    with tracing.span("normalize"):
+        plate = text_utils.normalize_text(plate_raw)
+        if not plate:
+            log(f"⚠️ Пустой или некорректный номер: {plate_raw}")
+            return
 
-    base, region = text_utils.parse_plate_parts(plate)
+        base, region = text_utils.parse_plate_parts(plate)
 
-    # Если регион не распознан — ищем в базе
-    if base and not region:
-        full_plate = db.get_plate_from_db(base)
-        if full_plate:
-            log(f"✅ Достроен номер: {plate} → {full_plate}")
-            plate = full_plate
+        # Если регион не распознан — ищем в базе
+        if base and not region:
+            full_plate = access.complete_plate(base) or db.get_plate_from_db(base)
+            if full_plate:
+                log(f"✅ Достроен номер: {plate} → {full_plate}")
+                plate = full_plate
 
     if not plate:
         log(f"⚠️ Номер отклонён: {plate_raw}")
         return
 
-    # Проверка повторов (чтобы не дублировать события)
-    if state.is_plate_recent(point, plate):
-        log(f"⏩ Пропуск повтора номера {plate} ({point})")
+    with tracing.span("watchlist"):
+        watchlist.screen(point, plate, ts)
+
+    # Трекер: повторные чтения той же машины не дают новых событий
+    def emit_later(track, read):
+        with tracing.use(read.trace):
+            _emit_plate(point, tracker.emitted_from(track, read), int(read.ts), read.capture_ts, direction, client,
+                        open_topic)
+
+    admitted = tracker.admit(point, plate, emit_later, confidence=confidence, bbox=bbox, capture_ts=capture_ts,
+                             image=image)
+    if admitted is None:
+        # машина ещё в проезде: событие уже выпущено (или будет при потере трека)
+        if gates.is_gate_open(point):
+            gates.mark_gate_open(point)
+        log(f"⏩ Пропуск повтора номера {plate} ({point})", debug=True)
         return
+    _emit_plate(point, admitted, ts or int(time.time()), capture_ts, direction, client, open_topic)
+
 
-    ts = ts or int(time.time())
+def _emit_plate(point: str, ev: tracker.Admitted, ts: int, capture_ts: float | None, direction: str | None = None,
+                client=None, open_topic: str | None = None):
+    plate = ev.plate
+    # направление по линии точки (одна камера на оба потока) важнее направления камеры
+    direction = (ev.direction or direction or "").upper() or None
+    tracing.annotate(plate=plate, track=ev.track_id, direction=direction)
+    log(f"✅ Новый номер {plate} на точке {point}{(' / ' + direction) if direction else ''}")
 
-    # Сохраняем в историю
-    db.add_history_record(plate, point, ts)
+    # Логика ворот — первой: задержка «кадр → OPEN» не включает историю и кроп
+    try:
+        gates.handle_plate(point, plate, ts, client=client, open_topic=open_topic, capture_ts=capture_ts)
+    except Exception as e:
+        log(f"⚠️ Ошибка логики ворот: {e}")
 
-    # Публикация в MQTT
-    publish_plate(point, plate, ts)
+    # Сохраняем в историю; ошибка записи не отменяет ворота — проезд всё равно был
+    row_id = None
+    try:
+        with tracing.span("db"):
+            row_id = db.add_history_record(plate, point, ts, direction=direction)
+    except Exception as e:
+        log(f"⚠️ Ошибка записи в history: {e}")
 
-    # Логика ворот
-    gates.handle_plate(point, plate, ts)
+    # Публикация в MQTT и кроп — только для записанной строки
+    # (повтор внутри окна дедупликации уже опубликован)
+    if row_id:
+        publish_plate(point, plate, ts, track_id=ev.track_id, direction=direction)
+        metrics.observe_event(point, capture_ts)
+        evidence.store_later(row_id, ev.image, ev.bbox)
 
 
-def publish_plate(point: str, plate: str, ts: int):
+def publish_plate(point: str, plate: str, ts: int, track_id: int | None = None, direction: str | None = None):
     """
-    Публикация информации о номере в MQTT.
+    Публикация информации о номере в MQTT. Кроп события сохраняется позже
+    (evidence.store_later) — ссылки на него отдаёт /api/history.
     """
     last_seen = db.get_last_seen(plate)
     data = {
@@ -66,8 +120,13 @@ def publish_plate(point: str, plate: str, ts: int):
         "ts": ts,
         "last_seen": last_seen,
         "iso_time": datetime.fromtimestamp(ts).isoformat(),
+        "trace_id": tracing.current_id(),
+        "track_id": track_id,
+        "direction": direction,
     }
     import json
     payload = json.dumps(data, ensure_ascii=False)
-    publish_message("plates", payload)
+    with tracing.span("mqtt_publish"):
+        publish_message("plates", payload)
+    events.plate_event(point, plate, ts, last_seen=last_seen, trace_id=data["trace_id"], direction=direction)
     log(f"📤 Опубликован номер: {plate} ({point})")
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# backend/sampler.py
+#
+# Выборка кадров RTSP-камер на распознавание. Читатели (video.cameras — потоки
+# или процессы capture_proc) только держат последний кадр; этот поток раз в
+# capture_interval отбирает камеры, чьи точки ждут распознавания
+# (tracker.should_sample), прогоняет их кадры одним пакетом через препроцессор
+# (preprocess.batch_from_buffers: без копий из shared memory, настройки
+# preprocess.* и use_torch_gpu_prep), кодирует каждый результат в JPEG для CPAI
+# и передаёт номера в общий конвейер (processing.handle_recognized_plate) с
+# направлением камеры: "in" → IN, "out" → OUT.
+# Рамки CPAI, линии направления точек и кропы событий — в пикселях кадра после
+# препроцессора (preprocess.width × preprocess.height).
+# Кадр, не сменившийся с прошлой выборки (камера встала), повторно не шлётся.
+from __future__ import annotations
+
+import threading
+import time
+
+from backend import config, cpai, processing, state, tracing, tracker, video
+from backend.logger import log
+
+_worker: threading.Thread | None = None
+_worker_lock = threading.Lock()
+# (точка, направление) -> ts последнего отправленного кадра
+_last_ts: dict[tuple[str, str], float] = {}
+
+
+def sample_cameras(buffers: dict) -> int:
+    """
+    Один проход выборки по камерам {(точка, направление): FrameBuffer}.
+    Возвращает число распознанных номеров.
+    """
+    from backend import preprocess  # numpy — не при старте веб-интерфейса
+
+    due = {}
+    for key, fb in buffers.items():
+        _, ts, _ = fb.view()
+        # should_sample отмечает выборку — спрашиваем только про новые кадры
+        if ts <= _last_ts.get(key, 0.0) or not tracker.should_sample(key[0]):
+            continue
+        due[key] = fb
+    if not due:
+        return 0
+
+    t0 = time.time()
+    keys, stamps, batch = preprocess.batch_from_buffers(due)
+    t1 = time.time()
+    found = 0
+    for i, (key, ts) in enumerate(zip(keys, stamps)):
+        _last_ts[key] = ts
+        # трасса начинается со времени захвата кадра; её ID сопровождает событие до команды ворот
+        trace = tracing.new_trace(key[0], capture_ts=ts)
+        trace.add_span("preprocess", t0, t1, {"batch": len(keys)})
+        with tracing.use(trace, finish=True):
+            found += _recognize(key[0], key[1], batch[i], ts)
+    return found
+
+
+def _recognize(name: str, direction: str, frame, ts: float) -> int:
+    tracing.annotate(camera=f"{name}/{direction}")
+    jpeg = video.to_jpeg_bytes(frame)
+    if not jpeg:
+        return 0
+    try:
+        results = cpai.detect_plates(jpeg)
+    except Exception as e:
+        log(f"❌ Ошибка CPAI ({name}/{direction}): {e}")
+        state.set_cpai_connected(False)
+        return 0
+    state.set_cpai_connected(True)
+    for det in results:
+        processing.handle_recognized_plate(name, det["plate"], capture_ts=ts, confidence=det.get("confidence"),
+                                           bbox=det.get("bbox"), image=frame, direction=direction.upper())
+    return len(results)
+
+
+def _run() -> None:
+    while True:
+        t0 = time.monotonic()
+        buffers = video.cameras.buffers()
+        for key in list(_last_ts):
+            if key not in buffers:
+                del _last_ts[key]
+        try:
+            sample_cameras(buffers)
+        except Exception as e:
+            log(f"⚠️ Ошибка выборки кадров: {e}")
+        time.sleep(max(0.05, config.CAPTURE_INTERVAL - (time.monotonic() - t0)))
+
+
+def start() -> None:
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        with _worker_lock:
+            if _worker is None or not _worker.is_alive():
+                _worker = threading.Thread(target=_run, name="rtsp-sampler", daemon=True)
+                _worker.start()
+
+
+def running() -> bool:
+    """Запущена ли выборка — RTSP-камеры этого процесса читаются для распознавания."""
+    return _worker is not None and _worker.is_alive()
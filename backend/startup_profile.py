@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# backend/startup_profile.py
+# Запуск: python -m backend.startup_profile [--target app|ALPR] [--budget-ms 2000] [--top 15] [--json]
+#     или: python app.py --profile-startup (ALPR.py отдельно не запускается — только --target ALPR)
+#
+# Меряет холодный старт в отдельном чистом процессе (python -X importtime):
+# время импорта по модулям, шаги инициализации и память. Код возврата 1 —
+# бюджет превышен или при старте загрузились тяжёлые модули (torch, cv2),
+# так что проверку можно ставить в CI/скрипт обновления как регрессионную.
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from backend.config import ROOT_DIR, STARTUP_BUDGET_MS
+
+# Модули, которые не должны загружаться при старте (только по требованию)
+HEAVY_MODULES = ("torch", "cv2", "numpy")
+
+# Шаги инициализации после импорта — то, что делает __main__ до начала работы
+INIT_STEPS = {
+    "app": [
+        ("ensure_tables", "app.ensure_tables()"),
+        ("access.reload", "from backend import access; access.reload()"),
+    ],
+    "ALPR": [
+        ("db.init_db", "from backend import db; db.init_db()"),
+        ("access.reload", "from backend import access; access.reload()"),
+    ],
+}
+
+_CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import {target}
+t_import = time.perf_counter() - t0
+steps = []
+for name, code in {steps!r}:
+    t = time.perf_counter()
+    try:
+        exec(code, {{"{target}": {target}}})
+        steps.append((name, (time.perf_counter() - t) * 1000.0, None))
+    except Exception as e:
+        steps.append((name, (time.perf_counter() - t) * 1000.0, str(e)))
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.0 if sys.platform != "darwin" else 1024.0 * 1024.0)
+except ImportError:
+    rss = None
+print("@@PROFILE@@" + json.dumps({{
+    "import_ms": t_import * 1000.0,
+    "steps": steps,
+    "rss_mb": rss,
+    "loaded": sorted(m for m in {heavy!r} if m in sys.modules),
+}}))
+"""
+
+
+def _parse_importtime(stderr: str) -> list[dict]:
+    """
+    Строки вида «import time:  self [us] | cumulative | imported package».
+    Глубина вложенности — по отступу имени.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            _, rest = line.split(":", 1)
+            self_us, cum_us, name = rest.split("|", 2)
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append({
+            "module": name.strip(),
+            "depth": depth,
+            "self_ms": int(self_us) / 1000.0,
+            "cumulative_ms": int(cum_us) / 1000.0,
+        })
+    return rows
+
+
+def profile(target: str) -> dict:
+    code = _CHILD.format(target=target, steps=INIT_STEPS.get(target, []), heavy=HEAVY_MODULES)
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=str(ROOT_DIR), capture_output=True, text=True, encoding="utf-8", errors="replace",
+    )
+    wall_ms = (time.perf_counter() - t0) * 1000.0
+    result = None
+    for line in proc.stdout.splitlines():
+        if line.startswith("@@PROFILE@@"):
+            result = json.loads(line[len("@@PROFILE@@"):])
+    if result is None:
+        tail = "\n".join(l for l in proc.stderr.splitlines() if not l.startswith("import time:"))[-2000:]
+        raise RuntimeError(f"профилируемый процесс завершился с кодом {proc.returncode}:\n{tail}")
+    result["target"] = target
+    result["wall_ms"] = wall_ms
+    result["init_ms"] = sum(ms for _, ms, _ in result["steps"])
+    result["modules"] = _parse_importtime(proc.stderr)
+    return result
+
+
+def _print_report(r: dict, budget_ms: float, top: int) -> None:
+    print(f"[startup_profile] {r['target']}: процесс {r['wall_ms']:.0f} мс "
+          f"(импорт {r['import_ms']:.0f} мс, инициализация {r['init_ms']:.0f} мс), бюджет {budget_ms:.0f} мс")
+    if r.get("rss_mb") is not None:
+        print(f"  память (max RSS): {r['rss_mb']:.0f} МБ")
+    print("  шаги инициализации:")
+    for name, ms, err in r["steps"]:
+        print(f"    {name:<24} {ms:8.1f} мс" + (f"  ⚠️ {err}" if err else ""))
+    mods = sorted((m for m in r["modules"] if m["depth"] <= 2), key=lambda m: m["cumulative_ms"], reverse=True)
+    print(f"  самые долгие импорты (cumulative, top {top}):")
+    for m in mods[:top]:
+        print(f"    {'  ' * m['depth']}{m['module']:<{40 - 2 * m['depth']}} {m['cumulative_ms']:8.1f} мс")
+    if r["loaded"]:
+        print(f"  ⚠️ при старте загружены тяжёлые модули: {', '.join(r['loaded'])}")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Профиль холодного старта (импорт и инициализация).")
+    p.add_argument("--target", default="app", choices=sorted(INIT_STEPS), help="Что запускаем: app (веб) или ALPR (служба)")
+    p.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS, help="Бюджет импорт+инициализация, мс")
+    p.add_argument("--top", type=int, default=15, help="Сколько самых долгих импортов показать")
+    p.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        r = profile(args.target)
+    except RuntimeError as e:
+        print(f"[startup_profile] ❌ {e}")
+        return 2
+    total = r["import_ms"] + r["init_ms"]
+    over = total > args.budget_ms
+    if args.json:
+        print(json.dumps({**r, "budget_ms": args.budget_ms, "over_budget": over}, ensure_ascii=False, indent=2))
+    else:
+        _print_report(r, args.budget_ms, args.top)
+        if over:
+            print(f"❌ бюджет превышен: {total:.0f} мс > {args.budget_ms:.0f} мс")
+    return 1 if over or r["loaded"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,9 @@
 from __future__ import annotations
 import threading
 import time
+from collections import OrderedDict
+
+from backend import events, metrics
 
 # -----------------------
 # Статусы подключений
@@ -12,63 +15,193 @@ CPAI_CONNECTED: bool = False
 # -----------------------
 # Кэш распознанных номеров
 # -----------------------
-# seen_plates[point_name][plate] = timestamp последнего появления
-seen_plates: dict[str, dict[str, float]] = {}
-seen_plates_lock = threading.Lock()
-
 # Минимальный интервал повторного срабатывания CPAI для одного номера (сек)
 CPAI_REPEAT_INTERVAL: float = 5.0
 
+
+class SeenPlatesCache:
+    """
+    Ограниченный кэш «увиденных» номеров с истечением по времени.
+    На каждую точку — свой OrderedDict (plate -> ts, в порядке последнего появления)
+    и свой lock, так что распознавания на разных точках не ждут друг друга.
+    Просроченные записи выметаются с головы при каждом обращении к точке,
+    а при превышении max_per_point вытесняются самые старые — память не растёт.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_per_point: int = 2048):
+        self.ttl = ttl
+        self.max_per_point = max_per_point
+        self._points: dict[str, tuple[threading.Lock, OrderedDict[str, float]]] = {}
+        self._points_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _bucket(self, point: str) -> tuple[threading.Lock, OrderedDict[str, float]]:
+        b = self._points.get(point)
+        if b is None:
+            with self._points_lock:
+                b = self._points.setdefault(point, (threading.Lock(), OrderedDict()))
+        return b
+
+    def _sweep(self, od: OrderedDict[str, float], now: float) -> None:
+        while od:
+            plate, ts = next(iter(od.items()))
+            if now - ts < self.ttl:
+                break
+            od.popitem(last=False)
+            self.expired += 1
+
+    def touch(self, point: str, plate: str, now: float | None = None) -> None:
+        """
+        Запоминает появление номера на точке.
+        """
+        now = time.time() if now is None else now
+        lock, od = self._bucket(point)
+        with lock:
+            self._sweep(od, now)
+            od[plate] = now
+            od.move_to_end(plate)
+            while len(od) > self.max_per_point:
+                od.popitem(last=False)
+                self.evicted += 1
+
+    def seen_within(
+        self, point: str, plate: str, interval: float, touch: bool = False, now: float | None = None
+    ) -> bool:
+        """
+        Был ли номер на точке не раньше interval секунд назад.
+        При touch=True проверка и обновление выполняются атомарно под lock точки.
+        """
+        now = time.time() if now is None else now
+        lock, od = self._bucket(point)
+        with lock:
+            self._sweep(od, now)
+            last_ts = od.get(plate)
+            recent = last_ts is not None and (now - last_ts) < interval
+            if recent:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if touch:
+                od[plate] = now
+                od.move_to_end(plate)
+                while len(od) > self.max_per_point:
+                    od.popitem(last=False)
+                    self.evicted += 1
+            return recent
+
+    def _buckets(self) -> list[tuple[str, tuple[threading.Lock, OrderedDict[str, float]]]]:
+        # снимок под _points_lock: новая точка из рабочего потока не ломает обход
+        with self._points_lock:
+            return list(self._points.items())
+
+    def stats(self) -> dict[str, int]:
+        buckets = self._buckets()
+        return {
+            "points": len(buckets),
+            "entries": sum(len(od) for _, (_, od) in buckets),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        """
+        Копия содержимого (для отладки / test.py).
+        """
+        out = {}
+        for point, (lock, od) in self._buckets():
+            with lock:
+                out[point] = dict(od)
+        return out
+
+    def __repr__(self) -> str:
+        return f"SeenPlatesCache({self.snapshot()!r})"
+
+
+# TTL с запасом относительно CPAI_REPEAT_INTERVAL: is_plate_recent с interval > ttl не увидит повтор
+seen_plates = SeenPlatesCache(ttl=max(60.0, CPAI_REPEAT_INTERVAL))
+metrics.register_gauge("alpr_seen_plates_entries", "Entries in the repeat-suppression cache",
+                       lambda: seen_plates.stats()["entries"])
+
 # -----------------------
 # Статус открытия ворот
 # -----------------------
+# Единственная таблица состояния ворот; меняет её только планировщик в backend/gates.py.
 # gates_state[point_name] = {
 #     "is_open": bool,
-#     "last_change": ts
+#     "last_change": ts,
+#     "close_at": ts | None   # плановое автозакрытие
 # }
-gates_state: dict[str, dict[str, float | bool]] = {}
+gates_state: dict[str, dict[str, float | bool | None]] = {}
 gates_lock = threading.Lock()
 
 
+def status_snapshot() -> dict[str, bool]:
+    return {"mqtt": MQTT_CONNECTED, "cpai": CPAI_CONNECTED}
+
+
 def set_mqtt_connected(ok: bool) -> None:
     global MQTT_CONNECTED
+    changed = MQTT_CONNECTED != ok
     MQTT_CONNECTED = ok
+    if changed:
+        events.publish("status", status_snapshot())
 
 
 def set_cpai_connected(ok: bool) -> None:
     global CPAI_CONNECTED
+    changed = CPAI_CONNECTED != ok
     CPAI_CONNECTED = ok
+    if changed:
+        events.publish("status", status_snapshot())
 
 
-def is_plate_recent(point: str, plate: str, interval: float | None = None) -> bool:
+def is_plate_recent(point: str, plate: str, interval: float | None = None, touch: bool = False) -> bool:
     """
     Проверяет, был ли номер уже недавно замечен на данной точке.
+    touch=True — заодно отметить номер как увиденный (атомарно).
     """
     if not point or not plate:
         return False
     interval = interval or CPAI_REPEAT_INTERVAL
-    now = time.time()
-    with seen_plates_lock:
-        last_ts = seen_plates.get(point, {}).get(plate)
-        if last_ts and (now - last_ts) < interval:
-            return True
-    return False
+    return seen_plates.seen_within(point, plate, interval, touch=touch)
 
 
-def mark_gate(point: str, is_open: bool) -> None:
+def mark_plate_seen(point: str, plate: str) -> None:
+    """
+    Отмечает номер как увиденный на точке.
+    """
+    if point and plate:
+        seen_plates.touch(point, plate)
+
+
+def mark_gate(point: str, is_open: bool, close_at: float | None = None) -> None:
     """
     Обновляет состояние ворот (открыто/закрыто).
     """
     with gates_lock:
-        gates_state[point] = {
+        st = {
             "is_open": is_open,
             "last_change": time.time(),
+            "close_at": close_at if is_open else None,
         }
+        gates_state[point] = st
+    events.publish("gate", {"point": point, **st})
 
 
-def get_gate_state(point: str) -> dict[str, float | bool] | None:
+def get_gate_state(point: str) -> dict[str, float | bool | None] | None:
     """
-    Возвращает текущее состояние ворот для точки.
+    Возвращает текущее состояние ворот для точки (копию).
     """
     with gates_lock:
-        return gates_state.get(point, None)
+        st = gates_state.get(point, None)
+        return dict(st) if st else None
+
+
+def get_all_gates() -> dict[str, dict[str, float | bool | None]]:
+    with gates_lock:
+        return {p: dict(st) for p, st in gates_state.items()}
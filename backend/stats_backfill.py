@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# backend/stats_backfill.py
+# Запуск: python -m backend.stats_backfill [--since 2025-08-01] [--until 2025-08-31]
+import argparse
+import sys
+import time
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Пересчёт агрегатов stats по существующей истории.")
+    p.add_argument("--since", help="Начало интервала (unix ts или YYYY-MM-DD[ HH:MM:SS])")
+    p.add_argument("--until", help="Конец интервала (unix ts или YYYY-MM-DD[ HH:MM:SS])")
+    p.add_argument("--batch", type=int, default=5000, help="Размер пачки чтения истории (пересчёт — одна транзакция)")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    from backend import db
+
+    t0 = time.time()
+    done = db.rebuild_stats(db.parse_ts(args.since), db.parse_ts(args.until, end_of_day=True), batch=args.batch)
+    print(f"[stats_backfill] rows={done} elapsed={time.time() - t0:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+# backend/tracing.py
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+import uuid
+from collections import deque
+
+from backend.config import TRACE_RING_SIZE
+
+# -----------------------
+# Трассировка события «кадр → номер → ворота»
+# -----------------------
+# Трасса заводится при выборке кадра RTSP (backend/sampler.py) или при
+# получении кадра по MQTT (ALPR.process_snapshot). Её ID живёт в contextvar,
+# поэтому CPAI, нормализация, запись в историю, публикация в MQTT и ворота
+# добавляют свои span'ы без протаскивания параметра через все вызовы. Чтобы
+# продолжить трассу в другом потоке, её передают явно: with tracing.use(tr).
+# Завершённые трассы лежат в кольце фиксированного размера — для разбора
+# «ворота открылись поздно» без внешней инфраструктуры трассировки.
+# Отложенное событие трекера (выпуск при потере трека) дописывает span'ы в
+# уже завершённую трассу — её конец сдвигается, и slowest() видит задержку.
+
+_current: contextvars.ContextVar["Trace | None"] = contextvars.ContextVar("alpr_trace", default=None)
+
+_ring: deque["Trace"] = deque(maxlen=max(1, TRACE_RING_SIZE))
+_by_id: dict[str, "Trace"] = {}
+_lock = threading.Lock()
+
+
+class Trace:
+    __slots__ = ("id", "point", "start", "capture_ts", "spans", "attrs", "end")
+
+    def __init__(self, point: str, capture_ts: float | None = None, trace_id: str | None = None):
+        self.id = trace_id or uuid.uuid4().hex[:16]
+        self.point = point
+        self.start = time.time()
+        # время захвата кадра может быть раньше начала трассы (буфер, очередь MQTT)
+        self.capture_ts = capture_ts or self.start
+        self.spans: list[tuple[str, float, float, dict]] = []
+        self.attrs: dict = {}
+        self.end: float | None = None
+
+    def add_span(self, name: str, t_start: float, t_end: float, attrs: dict | None = None) -> None:
+        self.spans.append((name, t_start, t_end, attrs or {}))
+        if self.end is not None and t_end > self.end:
+            self.end = t_end
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.time()
+        return (end - self.capture_ts) * 1000.0
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "point": self.point,
+            "capture_ts": self.capture_ts,
+            "duration_ms": round(self.duration_ms, 2),
+            "attrs": dict(self.attrs),
+            "spans": [
+                {
+                    "name": name,
+                    "offset_ms": round((t0 - self.capture_ts) * 1000.0, 2),
+                    "duration_ms": round((t1 - t0) * 1000.0, 2),
+                    **({"attrs": a} if a else {}),
+                }
+                for name, t0, t1, a in self.spans
+            ],
+        }
+
+
+class _Span:
+    __slots__ = ("_name", "_attrs", "_t0", "_trace")
+
+    def __init__(self, name: str, attrs: dict):
+        self._name = name
+        self._attrs = attrs
+
+    def __enter__(self):
+        self._trace = _current.get()
+        self._t0 = time.time()
+        return self
+
+    def set(self, **attrs) -> None:
+        self._attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._trace is not None:
+            if exc_type is not None:
+                self._attrs["error"] = str(exc)
+            self._trace.add_span(self._name, self._t0, time.time(), self._attrs)
+        return False
+
+
+class _Scope:
+    """
+    Делает трассу текущей; на выходе возвращает прежнюю.
+    finish=True — владелец трассы: на выходе она попадает в кольцо.
+    """
+    __slots__ = ("_trace", "_finish", "_token")
+
+    def __init__(self, tr: Trace | None, finish: bool):
+        self._trace = tr
+        self._finish = finish
+
+    def __enter__(self) -> Trace | None:
+        self._token = _current.set(self._trace)
+        return self._trace
+
+    def __exit__(self, *exc):
+        _current.reset(self._token)
+        if self._finish and self._trace is not None:
+            finish(self._trace)
+        return False
+
+
+def new_trace(point: str, capture_ts: float | None = None, trace_id: str | None = None) -> Trace:
+    return Trace(point, capture_ts=capture_ts, trace_id=trace_id)
+
+
+def trace(point: str, capture_ts: float | None = None):
+    """
+    with tracing.trace(point, capture_ts) as tr: ...
+    Если трасса уже активна (вызов изнутри конвейера) — используется она и
+    не завершается здесь; иначе заводится новая и завершается на выходе.
+    """
+    cur = _current.get()
+    if cur is not None:
+        return _Scope(cur, finish=False)
+    return _Scope(new_trace(point, capture_ts), finish=True)
+
+
+def use(tr: Trace | None, finish: bool = False):
+    """
+    Продолжение трассы в другом потоке (воркер, пул CPAI).
+    """
+    return _Scope(tr, finish=finish)
+
+
+def span(name: str, **attrs) -> _Span:
+    """
+    with tracing.span("cpai"): ... — без активной трассы ничего не записывает.
+    """
+    return _Span(name, attrs)
+
+
+def current() -> Trace | None:
+    return _current.get()
+
+
+def current_id() -> str | None:
+    tr = _current.get()
+    return tr.id if tr is not None else None
+
+
+def annotate(**attrs) -> None:
+    tr = _current.get()
+    if tr is not None:
+        tr.attrs.update(attrs)
+
+
+def finish(tr: Trace) -> None:
+    if tr.end is not None:
+        return
+    tr.end = time.time()
+    with _lock:
+        if len(_ring) == _ring.maxlen:
+            old = _ring[0]
+            _by_id.pop(old.id, None)
+        _ring.append(tr)
+        _by_id[tr.id] = tr
+
+
+# -----------------------
+# Просмотр
+# -----------------------
+def get(trace_id: str) -> dict | None:
+    with _lock:
+        tr = _by_id.get(trace_id)
+    return tr.to_dict() if tr is not None else None
+
+
+def find(plate: str | None = None, point: str | None = None, limit: int = 50) -> list[dict]:
+    """
+    Последние трассы (новые первыми), опционально по номеру и/или точке.
+    """
+    with _lock:
+        items = list(_ring)
+    out = []
+    for tr in reversed(items):
+        if point and tr.point != point:
+            continue
+        if plate and tr.attrs.get("plate") != plate:
+            continue
+        out.append(tr.to_dict())
+        if len(out) >= limit:
+            break
+    return out
+
+
+def slowest(n: int = 20, since: float | None = None, plates_only: bool = True) -> list[dict]:
+    """
+    N самых долгих трасс в кольце (хвост латентности).
+    plates_only — только трассы, в которых был распознан номер.
+    """
+    with _lock:
+        items = list(_ring)
+    if since is not None:
+        items = [tr for tr in items if tr.capture_ts >= since]
+    if plates_only:
+        items = [tr for tr in items if "plate" in tr.attrs]
+    items.sort(key=lambda tr: tr.duration_ms, reverse=True)
+    return [tr.to_dict() for tr in items[:max(0, n)]]
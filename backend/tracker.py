@@ -0,0 +1,486 @@
+# backend/tracker.py
+from __future__ import annotations
+
+import itertools
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import NamedTuple
+
+from backend import config, metrics, state, tracing
+from backend.logger import log
+
+# -----------------------
+# Трекер машин: одно событие на проезд
+# -----------------------
+# Чтения CPAI на точке связываются в треки по рамке и похожести текста номера.
+# Рамка сравнивается с положением, экстраполированным по скорости трека:
+# похожий номер (≥ TRACKER_SIM_MIN) связывается, если рамка не дальше
+# TRACKER_MAX_JUMP ширин рамки (рамка номера мала, и между кадрами IoU часто 0);
+# заметно испорченное чтение — только при пересечении рамок (IoU). Без рамки
+# (кадр по MQTT от BlueIris) — по похожести номера; снимки BlueIris редкие,
+# поэтому такой трек живёт не меньше state.CPAI_REPEAT_INTERVAL.
+# Трек выпускает ровно одно событие — с лучшим чтением:
+#   - сразу, если чтение уверенное (confidence ≥ TRACKER_CONFIRM_CONF или
+#     источник уверенности не сообщает) либо номер прочитан одинаково
+#     TRACKER_CONFIRM_HITS раз — задержки открытия ворот нет;
+#   - иначе, когда трек теряется (нет чтений TRACKER_MAX_AGE сек) или через
+#     TRACKER_EMIT_WAIT сек от первого чтения (машина стоит у закрытых ворот),
+#     — с текстом, набравшим больше всего уверенности к этому моменту.
+# Пока на точке только подтверждённые треки, кадры на распознавание берутся
+# не чаще раза в TRACKER_CONFIRMED_INTERVAL сек (should_sample, sampler.py).
+#
+# Направление (IN/OUT) — по траектории центра рамки относительно линии точки
+# (points.direction_line, "x1,y1,x2,y2" в пикселях кадра, отправляемого в CPAI;
+# для RTSP-камер — после препроцессора, preprocess.width × preprocess.height).
+# Пересечение линии слева направо, если смотреть вдоль неё от (x1,y1) к (x2,y2),
+# — IN; обратно — OUT. Пример: "0,400,1920,400" — движение сверху вниз (к камере)
+# это IN; чтобы поменять направления, поменяйте концы линии местами. Если
+# трек потерян, так и не пересёкши линию, направление — по смещению поперёк
+# линии не меньше TRACKER_DIRECTION_MIN_PX (пока трек жив, машина ещё может
+# развернуться до линии). Для точки с линией событие ждёт направления до
+# TRACKER_DIRECTION_WAIT сек от первого чтения — одна камера вместо двух.
+
+_ids = itertools.count(1)
+
+
+def plate_similarity(a: str, b: str) -> float:
+    """
+    1 − расстояние Левенштейна / длина большего номера.
+    """
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return 1.0 - prev[-1] / max(len(a), len(b))
+
+
+def center_jump(a, b) -> float:
+    """
+    Расстояние между центрами рамок в ширинах рамки a.
+    """
+    w = max(a[2] - a[0], 1e-6)
+    dx = (a[0] + a[2] - b[0] - b[2]) / 2.0
+    dy = (a[1] + a[3] - b[1] - b[3]) / 2.0
+    return (dx * dx + dy * dy) ** 0.5 / w
+
+
+def iou(a, b) -> float:
+    ix = min(a[2], b[2]) - max(a[0], b[0])
+    iy = min(a[3], b[3]) - max(a[1], b[1])
+    if ix <= 0 or iy <= 0:
+        return 0.0
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+# -----------------------
+# Линии направления
+# -----------------------
+_lines: dict[str, tuple[float, float, float, float]] = {}
+_lines_loaded = 0.0
+_LINES_REFRESH_S = 30.0
+_lines_lock = threading.Lock()
+
+
+def parse_line(text) -> tuple[float, float, float, float] | None:
+    """
+    "x1,y1,x2,y2" -> кортеж; пустое или некорректное значение — None.
+    """
+    try:
+        vals = tuple(float(v) for v in str(text or "").replace(";", ",").split(","))
+    except ValueError:
+        return None
+    if len(vals) != 4 or (vals[0], vals[1]) == (vals[2], vals[3]):
+        return None
+    return vals
+
+
+def reload_lines() -> dict:
+    """
+    Перечитывает линии направления из points (base.db). Вызывается при правке точек.
+    """
+    global _lines, _lines_loaded
+    lines = {}
+    try:
+        conn = sqlite3.connect(config.DB_BASE_PATH, timeout=5.0)
+        try:
+            for name, text in conn.execute("SELECT name, direction_line FROM points"):
+                line = parse_line(text)
+                if name and line:
+                    lines[name] = line
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        # нет таблицы/столбца (база ещё не создана веб-интерфейсом) — направление не определяется
+        log(f"⚠️ Трекер: линии направления не загружены: {e}", debug=True)
+    with _lines_lock:
+        _lines, _lines_loaded = lines, time.monotonic()
+    return lines
+
+
+def line_for(point: str):
+    if time.monotonic() - _lines_loaded > _LINES_REFRESH_S:
+        reload_lines()
+    return _lines.get(point)
+
+
+def infer_direction(path, line, lost: bool = False) -> str | None:
+    """
+    IN/OUT по траектории [(ts, bbox), ...] относительно линии; None — не понятно.
+    lost — трек потерян: без пересечения направление берётся по смещению.
+    """
+    if len(path) < 2:
+        return None
+    x1, y1, x2, y2 = line
+    dx, dy = x2 - x1, y2 - y1
+    length = (dx * dx + dy * dy) ** 0.5
+
+    def dist(bbox):
+        # знаковое расстояние центра рамки до линии, пикселей (> 0 — справа по ходу линии)
+        cx, cy = (bbox[0] + bbox[2]) / 2.0, (bbox[1] + bbox[3]) / 2.0
+        return (dx * (cy - y1) - dy * (cx - x1)) / length
+
+    d = [dist(b) for _, b in path]
+    first = next((v for v in d if v != 0), 0.0)
+    if first < 0 < d[-1]:
+        return "IN"
+    if first > 0 > d[-1]:
+        return "OUT"
+    if not lost:
+        return None
+    shift = d[-1] - d[0]
+    if abs(shift) >= config.TRACKER_DIRECTION_MIN_PX:
+        return "IN" if shift > 0 else "OUT"
+    return None
+
+
+def _conf(r) -> float:
+    return -1.0 if r.confidence is None else r.confidence
+
+
+class Read:
+    # image — кадр чтения (для кропа события); в треке хранится только у лучшего чтения номера
+    __slots__ = ("plate", "confidence", "bbox", "ts", "capture_ts", "trace", "image")
+
+    def __init__(self, plate, confidence, bbox, ts, capture_ts, trace, image=None):
+        self.plate = plate
+        self.confidence = confidence
+        self.bbox = bbox
+        self.ts = ts
+        self.capture_ts = capture_ts
+        self.trace = trace
+        self.image = image
+
+
+class Admitted(NamedTuple):
+    """
+    Событие к выпуску: лучшее чтение трека и его кадр.
+    """
+    plate: str
+    track_id: int | None
+    direction: str | None
+    image: object
+    bbox: tuple | None
+
+
+class Track:
+    __slots__ = ("id", "point", "reads", "path", "first_ts", "last_ts", "emitted", "emit", "line", "direction")
+
+    def __init__(self, point: str, read: Read, emit):
+        self.id = next(_ids)
+        self.point = point
+        self.reads: list[Read] = []
+        # траектория центра рамки: (ts, bbox)
+        self.path: deque[tuple[float, tuple]] = deque(maxlen=64)
+        self.first_ts = read.ts
+        self.last_ts = read.ts
+        self.emitted: Read | None = None
+        self.emit = emit
+        self.line = line_for(point)
+        self.direction: str | None = None
+        self.add(read)
+
+    def max_age(self) -> float:
+        """
+        Сколько трек живёт без чтений: без рамок — не меньше интервала дедупликации по времени.
+        """
+        if self.path:
+            return config.TRACKER_MAX_AGE
+        return max(config.TRACKER_MAX_AGE, state.CPAI_REPEAT_INTERVAL)
+
+    def add(self, read: Read) -> None:
+        if len(self.reads) < 32:
+            self.reads.append(read)
+        else:
+            # храним лучшие: вытесняем самое неуверенное
+            worst = min(range(len(self.reads)), key=lambda i: self.reads[i].confidence or 0.0)
+            if (read.confidence or 0.0) >= (self.reads[worst].confidence or 0.0):
+                self.reads[worst] = read
+        if read.image is not None:
+            # кадры не копятся: остаётся только у самого уверенного чтения этого номера
+            same = [r for r in self.reads if r.plate == read.plate and r.image is not None]
+            keep = max(same, key=_conf) if same else None
+            for r in same:
+                if r is not keep:
+                    r.image = None
+        if read.bbox is not None:
+            self.path.append((read.ts, read.bbox))
+            if self.line is not None:
+                self.direction = infer_direction(self.path, self.line) or self.direction
+        self.last_ts = read.ts
+
+    def predicted_bbox(self, ts: float):
+        """
+        Рамка, экстраполированная на момент ts по двум последним положениям.
+        """
+        if not self.path:
+            return None
+        t1, b1 = self.path[-1]
+        if len(self.path) < 2:
+            return b1
+        t0, b0 = self.path[-2]
+        dt = t1 - t0
+        if dt <= 0:
+            return b1
+        k = min((ts - t1) / dt, 3.0)
+        return tuple(v1 + (v1 - v0) * k for v0, v1 in zip(b0, b1))
+
+    def best(self) -> tuple[Read, int]:
+        """
+        Лучшее чтение: текст с наибольшей суммой уверенности, из его чтений — самое уверенное.
+        Второе значение — сколько раз прочитан этот текст.
+        """
+        score: dict[str, float] = {}
+        hits: dict[str, int] = {}
+        for r in self.reads:
+            score[r.plate] = score.get(r.plate, 0.0) + (1.0 if r.confidence is None else r.confidence)
+            hits[r.plate] = hits.get(r.plate, 0) + 1
+        plate = max(score, key=score.get)
+        read = max((r for r in self.reads if r.plate == plate), key=_conf)
+        return read, hits[plate]
+
+    def to_dict(self) -> dict:
+        best, hits = self.best()
+        return {
+            "id": self.id,
+            "point": self.point,
+            "plate": best.plate,
+            "confidence": best.confidence,
+            "reads": len(self.reads),
+            "hits": hits,
+            "first_ts": self.first_ts,
+            "last_ts": self.last_ts,
+            "emitted": self.emitted is not None,
+            "direction": self.direction,
+            "bbox": list(self.path[-1][1]) if self.path else None,
+        }
+
+
+class PlateTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tracks: dict[str, list[Track]] = {}
+        self._last_sample: dict[str, float] = {}
+        self._sweeper: threading.Thread | None = None
+        self.emitted_now = 0
+        self.emitted_on_loss = 0
+        self.emitted_on_wait = 0
+        self.absorbed = 0
+        self.skipped_samples = 0
+
+    # -----------------------
+    # Связывание чтения с треком
+    # -----------------------
+    def _match(self, tracks: list[Track], read: Read) -> Track | None:
+        best, best_score = None, 0.0
+        for tr in tracks:
+            if read.ts - tr.last_ts > tr.max_age():
+                continue
+            last_plate = tr.reads[-1].plate
+            sim = max(plate_similarity(read.plate, last_plate), plate_similarity(read.plate, tr.best()[0].plate))
+            pred = tr.predicted_bbox(read.ts) if read.bbox is not None else None
+            if pred is not None:
+                ov = iou(read.bbox, pred)
+                if sim >= config.TRACKER_SIM_MIN:
+                    # тот же номер, но далеко — другая машина
+                    if ov == 0.0 and center_jump(pred, read.bbox) > config.TRACKER_MAX_JUMP:
+                        continue
+                elif ov < config.TRACKER_IOU_MIN or sim < config.TRACKER_SIM_MIN_IOU:
+                    # рамка совпала — допускаем заметно испорченное чтение того же номера
+                    continue
+                score = ov + sim
+            else:
+                if sim < config.TRACKER_SIM_MIN:
+                    continue
+                score = sim
+            if score > best_score:
+                best, best_score = tr, score
+        return best
+
+    def observe(self, point: str, plate: str, confidence: float | None = None, bbox=None,
+                capture_ts: float | None = None, emit=None, image=None) -> tuple[Track, Read | None]:
+        """
+        Добавляет чтение в трек (новый или найденный). Возвращает (трек, чтение
+        для события сейчас) — второе None, если событие трека уже выпущено или
+        откладывается до потери трека; тогда его выпустит emit(track, read).
+        """
+        now = time.time()
+        read = Read(plate, confidence, tuple(bbox) if bbox else None, now, capture_ts, tracing.current(), image)
+        with self._lock:
+            tracks = self._tracks.setdefault(point, [])
+            tr = self._match(tracks, read)
+            if tr is None:
+                tr = Track(point, read, emit)
+                tracks.append(tr)
+            else:
+                tr.add(read)
+                if emit is not None:
+                    tr.emit = emit
+            out = None
+            if tr.emitted is None:
+                best, hits = tr.best()
+                ready = (best.confidence is None or best.confidence >= config.TRACKER_CONFIRM_CONF
+                         or hits >= config.TRACKER_CONFIRM_HITS)
+                if (ready and tr.line is not None and tr.direction is None
+                        and read.ts - tr.first_ts < config.TRACKER_DIRECTION_WAIT):
+                    ready = False  # номер уверен, направление ещё нет — ждём следующих кадров
+                if not ready and read.ts - tr.first_ts >= config.TRACKER_EMIT_WAIT:
+                    ready = True  # ждали достаточно — выпускаем лучшее, что есть
+                if ready:
+                    tr.emitted = out = best
+                    self.emitted_now += 1
+            if out is None:
+                self.absorbed += 1
+        self._ensure_sweeper()
+        return tr, out
+
+    # -----------------------
+    # Потерянные треки
+    # -----------------------
+    def sweep(self, now: float | None = None) -> int:
+        """
+        Убирает треки без чтений дольше Track.max_age(); не выпустившим событие —
+        выпускает его с лучшим чтением. Живым трекам без события дольше
+        TRACKER_EMIT_WAIT от первого чтения — тоже. Возвращает число выпущенных событий.
+        """
+        now = time.time() if now is None else now
+        due: list[tuple[Track, Read]] = []
+        with self._lock:
+            for point, tracks in self._tracks.items():
+                keep = []
+                for tr in tracks:
+                    alive = now - tr.last_ts <= tr.max_age()
+                    if alive:
+                        keep.append(tr)
+                    elif tr.line is not None and tr.direction is None:
+                        tr.direction = infer_direction(tr.path, tr.line, lost=True)
+                    if tr.emitted is None and tr.emit is not None and (
+                            not alive or now - tr.first_ts >= config.TRACKER_EMIT_WAIT):
+                        tr.emitted = tr.best()[0]
+                        due.append((tr, tr.emitted))
+                        if alive:
+                            self.emitted_on_wait += 1
+                        else:
+                            self.emitted_on_loss += 1
+                tracks[:] = keep
+        for tr, read in due:
+            try:
+                tr.emit(tr, read)
+            except Exception as e:
+                log(f"⚠️ Трекер: ошибка выпуска события трека {tr.id} ({tr.point}): {e}")
+        return len(due)
+
+    def _sweep_loop(self) -> None:
+        while True:
+            time.sleep(max(0.05, config.TRACKER_MAX_AGE / 8.0))
+            try:
+                self.sweep()
+            except Exception as e:
+                log(f"⚠️ Трекер: ошибка обхода треков: {e}", debug=True)
+
+    def _ensure_sweeper(self) -> None:
+        if self._sweeper is None or not self._sweeper.is_alive():
+            with self._lock:
+                if self._sweeper is None or not self._sweeper.is_alive():
+                    self._sweeper = threading.Thread(target=self._sweep_loop, name="plate-tracker", daemon=True)
+                    self._sweeper.start()
+
+    # -----------------------
+    # Выборка кадров
+    # -----------------------
+    def should_sample(self, point: str, now: float | None = None) -> bool:
+        """
+        False — на точке только подтверждённые треки и последний кадр брали
+        меньше TRACKER_CONFIRMED_INTERVAL назад: CPAI не нужен.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            live = [tr for tr in self._tracks.get(point, ()) if now - tr.last_ts <= tr.max_age()]
+            if live and all(tr.emitted is not None for tr in live):
+                if now - self._last_sample.get(point, 0.0) < config.TRACKER_CONFIRMED_INTERVAL:
+                    self.skipped_samples += 1
+                    return False
+            self._last_sample[point] = now
+            return True
+
+    def active(self, point: str | None = None) -> list[dict]:
+        with self._lock:
+            items = [tr for p, ts in self._tracks.items() if point in (None, p) for tr in ts]
+            return [tr.to_dict() for tr in items]
+
+    def stats(self) -> dict:
+        with self._lock:
+            n = sum(len(ts) for ts in self._tracks.values())
+        return {
+            "active": n,
+            "emitted_now": self.emitted_now,
+            "emitted_on_loss": self.emitted_on_loss,
+            "emitted_on_wait": self.emitted_on_wait,
+            "absorbed": self.absorbed,
+            "skipped_samples": self.skipped_samples,
+        }
+
+
+tracker = PlateTracker()
+metrics.register_gauge("alpr_tracks_active", "Vehicle tracks currently alive", lambda: tracker.stats()["active"])
+
+
+def admit(point: str, plate: str, emit, confidence: float | None = None, bbox=None,
+          capture_ts: float | None = None, image=None) -> Admitted | None:
+    """
+    Выпускать ли событие номера сейчас. Возвращает Admitted (лучшее чтение трека,
+    id трека, направление IN/OUT или None, кадр и рамку для кропа) или None —
+    чтение поглощено треком (отложенное событие выпустит emit(track, read) —
+    при потере трека или через TRACKER_EMIT_WAIT).
+    При выключенном трекере — прежняя дедупликация по времени (state.is_plate_recent).
+    """
+    if not config.TRACKER_ENABLED:
+        if state.is_plate_recent(point, plate, touch=True):
+            return None
+        return Admitted(plate, None, None, image, tuple(bbox) if bbox else None)
+    tr, read = tracker.observe(point, plate, confidence=confidence, bbox=bbox, capture_ts=capture_ts,
+                               emit=emit, image=image)
+    state.mark_plate_seen(point, plate)
+    if read is None:
+        return None
+    return Admitted(read.plate, tr.id, tr.direction, read.image, read.bbox)
+
+
+def emitted_from(track: Track, read: Read) -> Admitted:
+    """
+    Admitted для отложенного события (emit(track, read) при потере трека или по таймауту).
+    """
+    return Admitted(read.plate, track.id, track.direction, read.image, read.bbox)
+
+
+def should_sample(point: str) -> bool:
+    return not config.TRACKER_ENABLED or tracker.should_sample(point)
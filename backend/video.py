@@ -1,8 +1,12 @@
-import cv2
 import threading
 import time
 import os
 
+from backend import config, metrics
+
+# cv2 импортируется в функциях: сам модуль (FrameBuffer, CameraManager)
+# нужен и веб-интерфейсу, которому OpenCV при старте не нужен.
+
 # -----------------------
 # FrameBuffer для потоковой обработки
 # -----------------------
@@ -21,12 +25,27 @@ class FrameBuffer:
         with self._lock:
             return self._frame, self._ts
 
+    def view(self):
+        """
+        Интерфейс capture_proc.SharedFrameBuffer: (кадр, ts, token). Кадры здесь
+        не перезаписываются (set() подменяет ссылку), поэтому копия не нужна.
+        """
+        frame, ts = self.get()
+        return frame, ts, None
+
+    def still_valid(self, token) -> bool:
+        return True
+
 # -----------------------
 # Цикл чтения кадров в отдельном потоке
 # -----------------------
 def reader_loop(rtsp_url: str, name: str, direction: str, fb: FrameBuffer, stop_evt: threading.Event):
+    import cv2
     cap = None
     last_log = 0.0
+    camera = f"{name}/{direction}"
+    fps_frames = 0
+    fps_since = time.time()
     while not stop_evt.is_set():
         try:
             if cap is None or not cap.isOpened():
@@ -41,6 +60,7 @@ def reader_loop(rtsp_url: str, name: str, direction: str, fb: FrameBuffer, stop_
                 except Exception:
                     pass
                 if not cap.isOpened():
+                    metrics.CAMERA_FPS.remove(camera=camera)
                     now = time.time()
                     if now - last_log > 2.0:
                         print(f"❌ Не удалось открыть RTSP {name}/{direction}")
@@ -49,13 +69,23 @@ def reader_loop(rtsp_url: str, name: str, direction: str, fb: FrameBuffer, stop_
                     continue
                 else:
                     print(f"✅ RTSP поток {name}/{direction} открыт")
+            t0 = time.perf_counter()
             ok, frame = cap.read()
             if not ok or frame is None:
                 time.sleep(0.01)
                 continue
+            metrics.DECODE_SECONDS.observe(time.perf_counter() - t0, camera=camera)
+            metrics.FRAMES_TOTAL.inc(camera=camera)
             fb.set(frame)
+            fps_frames += 1
+            now = time.time()
+            if now - fps_since >= 1.0:
+                metrics.CAMERA_FPS.set(fps_frames / (now - fps_since), camera=camera)
+                fps_frames = 0
+                fps_since = now
         except Exception as e:
             print(f"⚠️ reader_loop exception {name}/{direction}: {e}")
+            metrics.CAMERA_FPS.remove(camera=camera)
             try:
                 if cap:
                     cap.release()
@@ -64,6 +94,7 @@ def reader_loop(rtsp_url: str, name: str, direction: str, fb: FrameBuffer, stop_
             cap = None
             time.sleep(0.5)
     # cleanup
+    metrics.CAMERA_FPS.remove(camera=camera)
     try:
         if cap:
             cap.release()
@@ -77,12 +108,93 @@ def open_capture(rtsp_url: str, name: str, direction: str, fb: FrameBuffer, stop
     """Запускает reader_loop в отдельном потоке."""
     threading.Thread(target=reader_loop, args=(rtsp_url, name, direction, fb, stop_evt), daemon=True).start()
 
+# -----------------------
+# Набор читателей камер с точечным перезапуском
+# -----------------------
+class CameraManager:
+    """
+    Читатели RTSP по ключу (точка, направление). sync() сверяет их с
+    желаемым набором URL и трогает только изменившиеся камеры: правка одной
+    точки не рвёт RTSP-сессии остальных. FrameBuffer при перезапуске
+    сохраняется, так что потребители кадров ссылок не теряют.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (точка, направление) -> (url, FrameBuffer, stop_evt)
+        self._readers: dict[tuple[str, str], tuple[str, FrameBuffer, threading.Event]] = {}
+
+    def start(self, name: str, direction: str, rtsp_url: str) -> FrameBuffer:
+        key = (name, direction)
+        with self._lock:
+            cur = self._readers.get(key)
+            if cur and cur[0] == rtsp_url:
+                return cur[1]
+            fb = cur[1] if cur else FrameBuffer()
+            if cur:
+                cur[2].set()
+            stop_evt = threading.Event()
+            self._readers[key] = (rtsp_url, fb, stop_evt)
+        open_capture(rtsp_url, name, direction, fb, stop_evt)
+        return fb
+
+    def stop(self, name: str, direction: str) -> None:
+        with self._lock:
+            cur = self._readers.pop((name, direction), None)
+        if cur:
+            cur[2].set()
+            metrics.CAMERA_FPS.remove(camera=f"{name}/{direction}")
+
+    def buffer(self, name: str, direction: str) -> FrameBuffer | None:
+        with self._lock:
+            cur = self._readers.get((name, direction))
+        return cur[1] if cur else None
+
+    def buffers(self) -> dict[tuple[str, str], FrameBuffer]:
+        with self._lock:
+            return {k: v[1] for k, v in self._readers.items()}
+
+    def running(self) -> bool:
+        with self._lock:
+            return bool(self._readers)
+
+    def sync(self, desired: dict[tuple[str, str], str]) -> dict:
+        """
+        desired: {(точка, направление): rtsp_url}; пустой URL — камеры нет.
+        """
+        desired = {k: v for k, v in desired.items() if v}
+        with self._lock:
+            current = {k: v[0] for k, v in self._readers.items()}
+        report = {"started": [], "restarted": [], "stopped": []}
+        for key in current.keys() - desired.keys():
+            self.stop(*key)
+            report["stopped"].append("/".join(key))
+        for key, url in desired.items():
+            if current.get(key) == url:
+                continue
+            self.start(key[0], key[1], url)
+            report["restarted" if key in current else "started"].append("/".join(key))
+        return report
+
+
+def _make_camera_manager():
+    # capture.mode = "process": процесс на камеру, кадры через shared memory
+    if config.CAPTURE_MODE == "process":
+        from backend.capture_proc import ProcessCameraManager
+        return ProcessCameraManager()
+    return CameraManager()
+
+
+cameras = _make_camera_manager()
+
 # -----------------------
 # JPEG кодирование / сохранение миниатюр
 # -----------------------
 def to_jpeg_bytes(frame_bgr):
+    import cv2
     try:
-        ok, enc = cv2.imencode(".jpg", frame_bgr, [int(cv2.IMWRITE_JPEG_QUALITY), 92])
+        with metrics.JPEG_ENCODE_SECONDS.time():
+            ok, enc = cv2.imencode(".jpg", frame_bgr, [int(cv2.IMWRITE_JPEG_QUALITY), 92])
         if not ok:
             return None
         return enc.tobytes()
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# backend/visits_backfill.py
+# Запуск: python -m backend.visits_backfill
+import argparse
+import sys
+import time
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Пересборка presence/visits по существующей истории (события с direction).")
+    p.add_argument("--batch", type=int, default=5000, help="Размер пачки чтения истории (пересборка — одна транзакция)")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    from backend import db
+
+    t0 = time.time()
+    done = db.rebuild_visits(batch=args.batch)
+    print(f"[visits_backfill] rows={done} elapsed={time.time() - t0:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
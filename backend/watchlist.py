@@ -0,0 +1,362 @@
+# backend/watchlist.py
+from __future__ import annotations
+
+import fnmatch
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from backend import config, events, metrics, tracing
+from backend.config import DB_BASE_PATH
+from backend.logger import log
+from backend.mqtt_wrap import publish_message
+
+# -----------------------
+# Номера под наблюдением (тревога по шаблонам)
+# -----------------------
+# Источник — base.db веб-админки: watchlist(pattern, reason).
+# Шаблон — номер с подстановками: * — любая (в т.ч. пустая) последовательность,
+# ? — ровно один символ: А*23ВС*, ?777??77, Х001ХХ*.
+# Символы, которые OCR путает (О/0, В/8 …, config.WATCHLIST_CONFUSABLES),
+# сводятся к одному представителю и в шаблоне, и в номере, поэтому А123ВС77,
+# прочитанный как А12ЗВС77 или 4123ВС77, всё равно совпадает.
+#
+# Все шаблоны компилируются в один префиксный автомат (trie с петлями для *):
+# номер проходится один раз, набор активных состояний — общий для всех
+# шаблонов, цена проверки не растёт с их количеством. Шаблоны без
+# подстановок — словарь. Результаты кэшируются по канонической строке:
+# трекер читает одну машину много раз.
+
+RELOAD_CHECK_INTERVAL = 5.0
+CACHE_MAX = 4096
+
+WATCHLIST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watchlist (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pattern TEXT NOT NULL,
+    reason TEXT,
+    created_ts INTEGER
+)
+"""
+
+
+def normalize_pattern(pattern: str) -> str:
+    """
+    Как text_utils.normalize_text, но сохраняет * и ?; ** сводится к *.
+    """
+    if not pattern:
+        return ""
+    from backend.text_utils import LATIN_TO_CYR
+    t = re.sub(r"[^A-ZА-Я0-9*?]", "", pattern.upper())
+    t = "".join(LATIN_TO_CYR.get(ch, ch) for ch in t)
+    return re.sub(r"\*+", "*", t)
+
+
+def _canon_table(groups) -> dict[int, str]:
+    """
+    Таблица для str.translate: каждый символ группы -> её первый символ.
+    Пересекающиеся группы объединяются ("17", "7Т" -> 1, 7, Т — одна группа).
+    """
+    merged: list[set[str]] = []
+    for g in groups:
+        g = set(normalize_pattern(g).replace("*", "").replace("?", ""))
+        for m in [m for m in merged if m & g]:
+            g |= m
+            merged.remove(m)
+        if len(g) > 1:
+            merged.append(g)
+    table: dict[int, str] = {}
+    for g in merged:
+        rep = min(g)
+        for ch in g:
+            if ch != rep:
+                table[ord(ch)] = rep
+    return table
+
+
+class _Node:
+    __slots__ = ("edges", "any", "star", "loop", "hits")
+
+    def __init__(self, loop: bool = False):
+        self.edges: dict[str, _Node] = {}
+        self.any: _Node | None = None   # переход по ?
+        self.star: _Node | None = None  # ε-переход в узел-петлю для *
+        self.loop = loop                # узел * поглощает любой символ
+        self.hits: list[tuple] = []     # шаблоны, заканчивающиеся здесь
+
+
+class WatchlistEngine:
+    """
+    Скомпилированный список наблюдения. reload() строит новый автомат и
+    подменяет его одной операцией присваивания — match() без блокировок.
+    """
+
+    def __init__(self, db_path: str = DB_BASE_PATH):
+        self.db_path = db_path
+        self._table: dict[int, str] = {}
+        self._exact: dict[str, list[tuple]] = {}
+        self._root = _Node()
+        self._cache: dict[str, tuple] = {}
+        self._reload_lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._data_version: int | None = None
+        self._next_check = 0.0
+        self.loaded_at = 0.0
+        self.patterns = 0
+        self.nodes = 0
+        self.checks = 0
+        self.hits = 0
+        self.match_s = 0.0
+
+    # -----------------------
+    # Загрузка и компиляция
+    # -----------------------
+    def _version_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        return self._conn
+
+    def set_db_path(self, path: str) -> int:
+        """
+        Переключает движок на другую base.db (смена путей в настройках) и перечитывает её.
+        """
+        with self._reload_lock:
+            if path != self.db_path:
+                conn, self._conn = self._conn, None
+                self.db_path = path
+                self._data_version = None
+                if conn is not None:
+                    conn.close()
+        return self.reload()
+
+    def reload(self) -> int:
+        """
+        Перечитывает watchlist и перекомпилирует автомат. Возвращает число шаблонов.
+        """
+        with self._reload_lock:
+            try:
+                rows = self._load()
+            except Exception as e:
+                log(f"⚠️ Наблюдение: ошибка загрузки списка: {e}")
+                self.loaded_at = self.loaded_at or time.time()
+                return self.patterns
+            self.compile(rows)
+            try:
+                self._data_version = self._version_conn().execute("PRAGMA data_version").fetchone()[0]
+            except Exception:
+                self._data_version = None
+        log(f"🚨 Наблюдение: загружено {self.patterns} шаблонов ({self.nodes} узлов автомата)", debug=True)
+        return self.patterns
+
+    def _load(self) -> list[tuple]:
+        if not os.path.exists(self.db_path):
+            return []
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.execute(WATCHLIST_SCHEMA)
+            return conn.execute("SELECT id, pattern, reason FROM watchlist").fetchall()
+        finally:
+            conn.close()
+
+    def compile(self, rows) -> None:
+        """
+        rows — (id, шаблон, причина). Строит словарь точных номеров и автомат
+        для шаблонов с подстановками.
+        """
+        table = _canon_table(config.WATCHLIST_CONFUSABLES)
+        exact: dict[str, list[tuple]] = {}
+        root = _Node()
+        nodes = 1
+        count = 0
+        for wid, pattern, reason in rows:
+            pattern = normalize_pattern(pattern)
+            if not pattern:
+                continue
+            count += 1
+            entry = (wid, pattern, reason or "")
+            canon = pattern.translate(table)
+            if "*" not in canon and "?" not in canon:
+                exact.setdefault(canon, []).append(entry)
+                continue
+            node = root
+            for ch in canon:
+                if ch == "*":
+                    if node.star is None:
+                        node.star = _Node(loop=True)
+                        nodes += 1
+                    node = node.star
+                elif ch == "?":
+                    if node.any is None:
+                        node.any = _Node()
+                        nodes += 1
+                    node = node.any
+                else:
+                    nxt = node.edges.get(ch)
+                    if nxt is None:
+                        nxt = node.edges[ch] = _Node()
+                        nodes += 1
+                    node = nxt
+            node.hits.append(entry)
+
+        self._table, self._exact, self._root, self._cache = table, exact, root, {}
+        self.patterns, self.nodes = count, nodes
+        self.loaded_at = time.time()
+
+    def _maybe_reload(self, now: float) -> None:
+        """
+        Ловит правки base.db из другого процесса (см. access.AccessEngine._maybe_reload).
+        """
+        if now < self._next_check:
+            return
+        self._next_check = now + RELOAD_CHECK_INTERVAL
+        try:
+            v = self._version_conn().execute("PRAGMA data_version").fetchone()[0]
+        except Exception:
+            return
+        if v != self._data_version:
+            self.reload()
+
+    # -----------------------
+    # Проверка
+    # -----------------------
+    @staticmethod
+    def _run(root: _Node, canon: str) -> list[tuple]:
+        states = _closure([root])
+        for ch in canon:
+            nxt: list[_Node] = []
+            for n in states:
+                if n.loop:
+                    nxt.append(n)
+                e = n.edges.get(ch)
+                if e is not None:
+                    nxt.append(e)
+                if n.any is not None:
+                    nxt.append(n.any)
+            if not nxt:
+                return []
+            states = _closure(nxt)
+        return [h for n in states for h in n.hits]
+
+    def match(self, plate: str) -> list[dict]:
+        """
+        Шаблоны, которым соответствует нормализованный номер (с учётом путаницы
+        символов). exact=False — совпадение только после сведения похожих символов.
+        """
+        if not plate:
+            return []
+        if not self.loaded_at:
+            self.reload()
+        else:
+            self._maybe_reload(time.time())
+        t0 = time.perf_counter()
+        canon = plate.translate(self._table)
+        cache = self._cache
+        found = cache.get(canon)
+        if found is None:
+            found = tuple(self._exact.get(canon, ())) + tuple(self._run(self._root, canon))
+            if len(cache) >= CACHE_MAX:
+                cache.clear()
+            cache[canon] = found
+        self.checks += 1
+        self.match_s += time.perf_counter() - t0
+        if not found:
+            return []
+        self.hits += 1
+        return [
+            {"id": wid, "pattern": pattern, "reason": reason, "exact": fnmatch.fnmatchcase(plate, pattern)}
+            for wid, pattern, reason in found
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "patterns": self.patterns,
+            "exact": sum(len(v) for v in self._exact.values()),
+            "nodes": self.nodes,
+            "confusables": sorted({chr(k) + v for k, v in self._table.items()}),
+            "checks": self.checks,
+            "hits": self.hits,
+            "avg_match_us": round(self.match_s / self.checks * 1e6, 2) if self.checks else None,
+            "loaded_at": self.loaded_at,
+        }
+
+
+def _closure(states: list[_Node]) -> list[_Node]:
+    """
+    Добавляет узлы-петли * (ε-переход: * может быть пустой); без повторов.
+    """
+    out: list[_Node] = []
+    seen: set[int] = set()
+    for n in states:
+        while n is not None and id(n) not in seen:
+            seen.add(id(n))
+            out.append(n)
+            n = n.star
+    return out
+
+
+engine = WatchlistEngine()
+
+# (точка, id шаблона, номер) -> monotonic последней тревоги
+_last_alert: dict[tuple, float] = {}
+_alert_lock = threading.Lock()
+
+
+def reload() -> int:
+    return engine.reload()
+
+
+def match(plate: str) -> list[dict]:
+    return engine.match(plate)
+
+
+def screen(point: str, plate: str, ts: int | None = None) -> list[dict]:
+    """
+    Проверяет нормализованный номер и публикует тревоги в MQTT
+    (<prefix>/WATCHLIST_TOPIC) и в поток событий веба. Одна тревога на
+    (точку, шаблон, номер) за WATCHLIST_COOLDOWN сек — повторные чтения той же
+    машины не дублируют её. Возвращает совпадения (в том числе подавленные).
+    """
+    if not config.WATCHLIST_ENABLED:
+        return []
+    hits = engine.match(plate)
+    if not hits:
+        return hits
+    now = time.monotonic()
+    ts = ts or int(time.time())
+    with _alert_lock:
+        if len(_last_alert) > CACHE_MAX:
+            for k in [k for k, t in _last_alert.items() if now - t >= config.WATCHLIST_COOLDOWN]:
+                del _last_alert[k]
+        fresh = []
+        for h in hits:
+            key = (point, h["id"], plate)
+            last = _last_alert.get(key)
+            if last is not None and now - last < config.WATCHLIST_COOLDOWN:
+                continue
+            _last_alert[key] = now
+            fresh.append(h)
+    tracing.annotate(watchlist=[h["id"] for h in hits])
+    for h in fresh:
+        data = {
+            "plate": plate,
+            "point": point,
+            "ts": ts,
+            "watch_id": h["id"],
+            "pattern": h["pattern"],
+            "reason": h["reason"],
+            "exact": h["exact"],
+            "trace_id": tracing.current_id(),
+        }
+        publish_message(config.WATCHLIST_TOPIC, json.dumps(data, ensure_ascii=False))
+        events.publish("watchlist", data)
+        metrics.WATCHLIST_HITS.inc(point=point)
+        log(f"🚨 Номер под наблюдением: {plate} ({point}) — шаблон {h['pattern']}"
+            f"{' (с учётом похожих символов)' if not h['exact'] else ''}{': ' + h['reason'] if h['reason'] else ''}")
+    return hits
+
+
+config.subscribe(("WATCHLIST_CONFUSABLES",), lambda changed: engine.reload())
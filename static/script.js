@@ -14,65 +14,149 @@ function showTab(id, event) {
 // -----------------------
 // Статусбар
 // -----------------------
+function applyStatus(mqttText, cpaiText) {
+    document.getElementById("statusTime").innerText = new Date().toLocaleTimeString();
+
+    const indicator = document.getElementById("statusIndicator");
+    if (mqttText === "OK" && cpaiText === "OK") {
+        indicator.style.background = "#0a0";
+    } else {
+        indicator.style.background = "#c00";
+    }
+
+    document.getElementById("modalMQTT").innerText = mqttText;
+    document.getElementById("modalCPAI").innerText = cpaiText;
+}
+
 async function refreshStatus() {
     try {
         const res = await fetch("/api/status");
         const data = await res.json();
-
-        document.getElementById("statusTime").innerText = new Date().toLocaleTimeString();
-
-        const indicator = document.getElementById("statusIndicator");
-        if (data.mqtt === "OK" && data.cpai === "OK") {
-            indicator.style.background = "#0a0";
-        } else {
-            indicator.style.background = "#c00";
-        }
-
-        if (document.getElementById("statusModal").style.display === "block") {
-            document.getElementById("modalMQTT").innerText = data.mqtt;
-            document.getElementById("modalCPAI").innerText = data.cpai;
-        }
+        applyStatus(data.mqtt, data.cpai);
     } catch (err) {
-        document.getElementById("modalMQTT").innerText = "Нет соединения";
-        document.getElementById("modalCPAI").innerText = "Нет соединения";
-        document.getElementById("statusTime").innerText = new Date().toLocaleTimeString();
-        document.getElementById("statusIndicator").style.background = "#c00";
+        applyStatus("Нет соединения", "Нет соединения");
     }
 }
 
-setInterval(refreshStatus, 2000);
-refreshStatus();
+// -----------------------
+// Ворота
+// -----------------------
+const gatesState = {};
+
+function renderGates() {
+    const el = document.getElementById("modalGates");
+    if (!el) return;
+    const names = Object.keys(gatesState).sort();
+    el.innerText = names.length
+        ? names.map(n => `${n}: ${gatesState[n].is_open ? "OPEN" : "CLOSED"}`).join(", ")
+        : "—";
+}
 
 // -----------------------
 // Лог
 // -----------------------
 let logAutoScroll = true;
+const LOG_MAX_LINES = 2000;
+let logLines = [];
+let logCursor = null;
+
+function appendLogLine(out, line, showDebug) {
+    if (!showDebug && line.includes("[DEBUG]")) return; // фильтр debug
+    const p = document.createElement("div");
+    p.textContent = line;
+    out.appendChild(p);
+}
+
+function renderLog() {
+    const out = document.getElementById("logOutput");
+    if (!out) return;
+    const showDebug = document.getElementById("chkDebug")?.checked;
+    out.innerHTML = "";
+    logLines.forEach(line => appendLogLine(out, line, showDebug));
+    if (logAutoScroll) out.scrollTop = out.scrollHeight;
+}
+
+function pushLogLines(lines, reset) {
+    const out = document.getElementById("logOutput");
+    if (reset) logLines = [];
+    logLines.push(...lines);
+    if (logLines.length > LOG_MAX_LINES) {
+        logLines.splice(0, logLines.length - LOG_MAX_LINES);
+        reset = true;
+    }
+    if (!out) return;
+    if (reset) {
+        renderLog();
+        return;
+    }
+    const showDebug = document.getElementById("chkDebug")?.checked;
+    lines.forEach(line => appendLogLine(out, line, showDebug));
+    while (out.childElementCount > LOG_MAX_LINES) out.removeChild(out.firstChild);
+    if (logAutoScroll) out.scrollTop = out.scrollHeight;
+}
 
+// Запасной вариант без SSE: опрос только новых строк по курсору
 async function refreshLog() {
     try {
-        const res = await fetch("/api/log");
+        const params = logCursor === null ? "" : "?cursor=" + logCursor;
+        const res = await fetch("/api/log" + params);
         const data = await res.json();
-
-        const out = document.getElementById("logOutput");
-        if (!out) return;
-
-        const showDebug = document.getElementById("chkDebug")?.checked;
-
-        out.innerHTML = "";
-        (data.log || []).forEach(line => {
-            if (!showDebug && line.includes("[DEBUG]")) return; // фильтр debug
-            const p = document.createElement("div");
-            p.textContent = line;
-            out.appendChild(p);
-        });
-
-        if (logAutoScroll) out.scrollTop = out.scrollHeight;
+        logCursor = data.cursor;
+        pushLogLines(data.log || [], data.reset);
     } catch (err) {
         console.error("Ошибка загрузки лога:", err);
     }
 }
 
-setInterval(refreshLog, 2000);
+let pendingLog = [];
+let pendingLogScheduled = false;
+
+function queueLogLine(line) {
+    // пачкуем строки до ближайшего кадра отрисовки
+    pendingLog.push(line);
+    if (pendingLogScheduled) return;
+    pendingLogScheduled = true;
+    requestAnimationFrame(() => {
+        pushLogLines(pendingLog, false);
+        pendingLog = [];
+        pendingLogScheduled = false;
+    });
+}
+
+// -----------------------
+// Поток событий сервера (SSE): статус, ворота, номера, лог
+// -----------------------
+function startEventStream() {
+    refreshLog(); // начальный хвост лога, дальше строки приходят событиями
+    if (!window.EventSource) {
+        refreshStatus();
+        setInterval(refreshStatus, 2000);
+        setInterval(refreshLog, 2000);
+        return;
+    }
+    const es = new EventSource("/api/events");
+    const ok = v => (v ? "OK" : "Нет соединения");
+
+    es.addEventListener("status", e => {
+        const s = JSON.parse(e.data);
+        applyStatus(ok(s.mqtt), ok(s.cpai));
+    });
+    es.addEventListener("gate", e => {
+        const g = JSON.parse(e.data);
+        gatesState[g.point] = g;
+        renderGates();
+    });
+    es.addEventListener("plate", e => onPlateEvent(JSON.parse(e.data)));
+    es.addEventListener("log", e => queueLogLine(e.data));
+    es.addEventListener("reset", () => {
+        // отстали от кольца событий — перечитываем состояние целиком
+        refreshStatus();
+        logCursor = null;
+        refreshLog();
+        loadHistory();
+    });
+    es.onerror = () => applyStatus("Нет соединения", "Нет соединения");
+}
 
 document.getElementById("chkAutoScroll")?.addEventListener("change", function () {
     logAutoScroll = this.checked;
@@ -93,7 +177,7 @@ document.getElementById("chkDebug")?.addEventListener("change", function () {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ debug: checked })
-    }).then(() => refreshLog());
+    }).then(() => renderLog());
 });
 
 
@@ -162,6 +246,33 @@ async function addPerson() {
     }
 }
 
+async function importPeople() {
+    const input = document.getElementById("peopleImportFile");
+    const out = document.getElementById("peopleImportReport");
+    if (!input || !input.files.length) return;
+
+    const form = new FormData();
+    form.append("file", input.files[0]);
+    out.innerText = "Импорт...";
+    try {
+        const res = await fetch("/api/people/import", { method: "POST", body: form });
+        const data = await res.json();
+        if (data.status !== "ok") {
+            out.innerText = "Ошибка импорта: " + data.error;
+            return;
+        }
+        out.innerText =
+            `Добавлено: ${data.inserted}, обновлено: ${data.updated}, ` +
+            `дублей в файле: ${data.duplicates_in_file.length}, ошибочных строк: ${data.invalid.length} ` +
+            `(${data.elapsed_s} с)`;
+        input.value = "";
+        loadPeople();
+    } catch (err) {
+        console.error("Ошибка импорта людей:", err);
+        out.innerText = "Ошибка импорта";
+    }
+}
+
 async function deletePerson(id) {
     await fetch("/api/people/" + id, { method: "DELETE" });
     loadPeople();
@@ -230,6 +341,7 @@ async function loadPoints(search = "") {
                     <td contenteditable="true" data-field="mqtt_topic" data-id="${p.id}">${p.mqtt_topic}</td>
                     <td contenteditable="true" data-field="in_camera_url" data-id="${p.id}">${p.in_camera_url || ""}</td>
                     <td contenteditable="true" data-field="out_camera_url" data-id="${p.id}">${p.out_camera_url || ""}</td>
+                    <td contenteditable="true" data-field="direction_line" data-id="${p.id}">${p.direction_line || ""}</td>
                     <td>${thumbsHTML}</td>
                     <td>
                         <button onclick="deletePoint(${p.id})">Удалить</button>
@@ -339,12 +451,16 @@ async function saveSettings() {
         paths: { base_db: baseDb, snapshots: snapshots }
     };
 
-    await fetch("/api/settings", {
+    const res = await fetch("/api/settings", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify(payload)
     });
-    alert("Настройки сохранены");
+    const r = await res.json().catch(() => ({}));
+    const restart = r.restart_required || [];
+    alert(restart.length
+        ? `Настройки сохранены. После перезапуска вступят в силу: ${restart.join(", ")}`
+        : "Настройки сохранены и применены без перезапуска");
 }
 
 
@@ -389,16 +505,9 @@ function toggleStatus() {
     }
 }
 
-async function loadStatusModal() {
-    try {
-        const sres = await fetch("/api/status");
-        const s = await sres.json();
-
-        document.getElementById("modalMQTT").innerText = s.mqtt;
-        document.getElementById("modalCPAI").innerText = s.cpai;
-    } catch (e) {
-        console.warn(e);
-    }
+function loadStatusModal() {
+    // модалка обновляется событиями status/gate, здесь только отрисовка ворот
+    renderGates();
 }
 // -----------------------
 // История событий
@@ -429,14 +538,8 @@ async function loadHistory() {
         tbody.innerHTML = "";
 
         (data.items || []).forEach(row => {
-            const tr = document.createElement("tr");
             // row.timestamp, row.plate, row.point_name
-            tr.innerHTML = `
-                <td>${row.timestamp || ""}</td>
-                <td>${row.plate || ""}</td>
-                <td>${row.point_name || ""}</td>
-            `;
-            tbody.appendChild(tr);
+            tbody.appendChild(historyRow(row, row.point_name));
         });
 
         // Пагинация
@@ -454,6 +557,49 @@ async function loadHistory() {
     }
 }
 
+// Миниатюра события (кэшируется браузером навсегда — адрес по хэшу содержимого); клик — кроп
+const EVIDENCE_DIGEST = /^[0-9a-f]{32}$/;
+
+function evidenceThumb(item) {
+    if (!EVIDENCE_DIGEST.test(item.thumb || "")) return null;
+    const full = EVIDENCE_DIGEST.test(item.crop || "") ? item.crop : item.thumb;
+    const img = document.createElement("img");
+    img.className = "snapshot";
+    img.src = `/evidence/${item.thumb}.jpg`;
+    img.addEventListener("click", () => openImage(`/evidence/${full}.jpg`));
+    return img;
+}
+
+// Строка истории. Поля приходят из MQTT (топик, JSON) — только textContent, без innerHTML
+function historyRow(item, point) {
+    const tr = document.createElement("tr");
+    const tdTime = document.createElement("td");
+    tdTime.textContent = item.timestamp || "";
+    const tdPlate = document.createElement("td");
+    const thumb = evidenceThumb(item);
+    if (thumb) tdPlate.append(thumb, " ");
+    tdPlate.append(item.plate || "");
+    const tdPoint = document.createElement("td");
+    tdPoint.textContent = point || "";
+    tr.append(tdTime, tdPlate, tdPoint);
+    return tr;
+}
+
+// Новое событие номера: на первой странице без фильтров добавляем строку сразу
+function onPlateEvent(ev) {
+    if (histState.offset !== 0 || histState.search || histState.from || histState.to) return;
+    const tbody = document.querySelector("#historyTable tbody");
+    if (!tbody) return;
+
+    tbody.insertBefore(historyRow(ev, ev.point), tbody.firstChild);
+    while (tbody.childElementCount > histState.limit) tbody.removeChild(tbody.lastChild);
+
+    histState.total += 1;
+    const shown = tbody.childElementCount;
+    document.getElementById("histInfo").innerText = `Показаны 1–${shown} из ${histState.total}`;
+    document.getElementById("histNext").disabled = histState.limit >= histState.total;
+}
+
 function applyHistoryFilters() {
     const q = document.getElementById("histSearch")?.value?.trim() || "";
     const from = document.getElementById("histFrom")?.value || "";
@@ -499,8 +645,7 @@ document.getElementById("histSearch")?.addEventListener("keydown", (e) => {
 document.addEventListener("DOMContentLoaded", () => {
     loadPeople();
     loadPoints();
-    refreshLog();
-    refreshStatus();
+    startEventStream();
     loadSettings();
     loadHistory();
 });
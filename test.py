@@ -1,5 +1,5 @@
 from backend.cpai import handle_cpai_result
-from backend.state import seen_plates as _seen_plates, _gate_state
+from backend.state import seen_plates as _seen_plates, get_all_gates
 import paho.mqtt.client as mqtt
 
 # MQTT клиент для теста (можно локально)
@@ -23,6 +23,6 @@ while True:
     handle_cpai_result(res, "Ворота", "IN", client)
 
     # Печатаем текущее состояние ворот и виденные номера
-    print("Состояние ворот:", _gate_state)
+    print("Состояние ворот:", get_all_gates())
     print("Виденные номера:", _seen_plates)
     print("-" * 40)